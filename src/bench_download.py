@@ -0,0 +1,116 @@
+#!/usr/bin/python
+#
+# bench_download.py
+#
+# Measure download_products against the local mock HyP3 service.  Each
+# downloader configuration is run in its own process, into an empty
+# directory, and the products/sec, MB/sec, peak memory use and number of
+# retries are reported for each.
+#
+import os
+import sys
+import shutil
+import tempfile
+import argparse
+import multiprocessing
+try:
+    import resource
+except ImportError:
+    resource = None
+from mock_hyp3 import MockHyP3Server, MockAPI, make_products
+from download_products import download_products
+
+# Name and download_products arguments of each downloader configuration
+CONFIGS = [
+    ('serial', {'threads': 1, 'adaptive': False}),
+    ('threads-4', {'threads': 4, 'adaptive': False}),
+    ('threads-8', {'threads': 8, 'adaptive': False}),
+    ('adaptive', {'threads': 4, 'adaptive': True}),
+    ('insar-members', {'threads': 4, 'adaptive': True, 'members': 'insar'}),
+]
+
+
+def peak_rss():
+    """Peak resident memory of this process in MB, or None if unknown"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        rss /= 1024.0
+    return rss / 1024.0
+
+
+def run_config(base_url, names, directory, kwargs, results):
+    api = MockAPI(base_url, names)
+    try:
+        stats = download_products(api, directory=directory, sub_name="mock", verbose=False,
+                                  cache_ttl=0, **kwargs)
+    except Exception as err:
+        stats = {'error': str(err)}
+    stats['rss'] = peak_rss()
+    results.put(stats)
+
+
+def bench(server, names, configs, workdir):
+    """Run each (name, kwargs) in configs and return a list of (name, stats)"""
+    rows = []
+    for name, kwargs in configs:
+        directory = os.path.join(workdir, name)
+        if os.path.exists(directory):
+            shutil.rmtree(directory)
+        results = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=run_config,
+                                       args=(server.url(""), names, directory, kwargs, results))
+        requests, dropped = server.requests, server.dropped
+        proc.start()
+        stats = results.get()
+        proc.join()
+        if 'error' in stats:
+            print("{} failed: {}".format(name, stats['error']))
+            continue
+        stats['requests'] = server.requests - requests
+        stats['dropped'] = server.dropped - dropped
+        rows.append((name, stats))
+        shutil.rmtree(directory, ignore_errors=True)
+    return rows
+
+
+def report(rows):
+    print("{:<14} {:>9} {:>9} {:>10} {:>9} {:>8} {:>8} {:>8}".format(
+          "config", "ok/total", "prod/s", "MB/s", "peak MB", "retries", "dropped", "seconds"))
+    for name, stats in rows:
+        seconds = max(stats['seconds'], 1e-6)
+        rss = "-" if stats['rss'] is None else "{:.1f}".format(stats['rss'])
+        print("{:<14} {:>9} {:>9.2f} {:>10.2f} {:>9} {:>8} {:>8} {:>8.1f}".format(
+              name, "{}/{}".format(stats['succeeded'], stats['attempted']),
+              stats['succeeded'] / seconds, stats['bytes'] / seconds / (1024.0 * 1024.0),
+              rss, stats['retries'], stats['dropped'], stats['seconds']))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="bench_download.py",description="Benchmark download_products against a local mock HyP3 service")
+    parser.add_argument("-b","--bandwidth",type=float,help="Per-connection bandwidth limit in MB/s")
+    parser.add_argument("-c","--config",action="append",choices=[name for name, kwargs in CONFIGS],help="Configuration to run; may be repeated (default all)")
+    parser.add_argument("-f","--fail",type=float,default=0.0,help="Fraction of responses cut off part way")
+    parser.add_argument("-l","--latency",type=float,default=0.0,help="Seconds of latency added to each request")
+    parser.add_argument("-n","--products",type=int,default=20,help="Number of products (default 20)")
+    parser.add_argument("-s","--size",type=float,default=10.0,help="Size of each product in MB (default 10)")
+    parser.add_argument("-w","--workdir",help="Directory for the served and downloaded products (default a temporary directory)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_download.")
+    served = os.path.join(workdir, "served")
+    names = make_products(served,args.products,int(args.size*1024*1024))
+    bandwidth = int(args.bandwidth*1024*1024) if args.bandwidth else None
+    server = MockHyP3Server(served,latency=args.latency,bandwidth=bandwidth,fail_rate=args.fail).start()
+    configs = [c for c in CONFIGS if args.config is None or c[0] in args.config]
+    print("{} products of {} MB, latency {} s, bandwidth {}, failure rate {}".format(
+          args.products,args.size,args.latency,
+          "{} MB/s".format(args.bandwidth) if args.bandwidth else "unlimited",args.fail))
+    try:
+        report(bench(server,names,configs,workdir))
+    finally:
+        server.stop()
+        if args.workdir is None:
+            shutil.rmtree(workdir)
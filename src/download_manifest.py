@@ -0,0 +1,140 @@
+#!/usr/bin/python
+#
+# download_manifest.py
+#
+# Persistent record of the products in a download directory.  Each product
+# has its expected size, md5 checksum and download state stored in a small
+# SQLite database that lives next to the products, so that working out what
+# still needs to be downloaded is a metadata lookup instead of a re-download.
+#
+import os
+import sqlite3
+import hashlib
+import zipfile
+import logging
+import threading
+
+MANIFEST_NAME = ".download_manifest.sqlite"
+
+FIELDS = ('name', 'url', 'size', 'md5', 'state', 'mtime', 'members')
+
+
+def md5sum(file_name, block_size=1024*1024):
+    md5 = hashlib.md5()
+    with open(file_name, 'rb') as f:
+        for data in iter(lambda: f.read(block_size), b''):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def check_zip(file_name):
+    """Cheap integrity check: a truncated zip has no readable central directory"""
+    try:
+        zip_ref = zipfile.ZipFile(file_name, 'r')
+        zip_ref.close()
+        return True
+    except (zipfile.BadZipfile, IOError, OSError):
+        return False
+
+
+class DownloadManifest(object):
+
+    def __init__(self, directory, name=MANIFEST_NAME):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.directory = directory
+        self.path = os.path.join(directory, name)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS products ("
+                              "name TEXT PRIMARY KEY, url TEXT, size INTEGER, "
+                              "md5 TEXT, state TEXT, mtime REAL, members TEXT)")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(products)")]
+            if 'members' not in columns:
+                self.conn.execute("ALTER TABLE products ADD COLUMN members TEXT")
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _get(self, name):
+        # Caller must hold the lock
+        row = self.conn.execute("SELECT {} FROM products WHERE name=?".format(",".join(FIELDS)),
+                                (name,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(FIELDS, row))
+
+    def get(self, name):
+        with self.lock:
+            return self._get(name)
+
+    def mark(self, name, **fields):
+        """Insert or update the record for product name"""
+        with self.lock:
+            record = self._get(name) or {'name': name}
+            record.update(fields)
+            values = [record.get(f) for f in FIELDS]
+            self.conn.execute("INSERT OR REPLACE INTO products ({}) VALUES ({})".format(
+                              ",".join(FIELDS), ",".join("?" * len(FIELDS))), values)
+            self.conn.commit()
+
+    def complete(self, name, file_name, url=None, members=None, md5=None):
+        """Record a finished download, hashing it once unless the md5 is
+        already known.  members is the type of processing the zip was cut
+        down for, or None for the whole product."""
+        st = os.stat(file_name)
+        if md5 is None:
+            md5 = md5sum(file_name)
+        fields = {'size': st.st_size, 'md5': md5,
+                  'state': 'complete', 'mtime': st.st_mtime, 'members': members}
+        if url is not None:
+            fields['url'] = url
+        self.mark(name, **fields)
+
+    def verify(self, name, file_name, members=None):
+        """Return True if file_name holds a complete copy of product name.
+
+        Files whose size and mtime match the manifest are trusted without
+        being read.  Files that were touched are re-hashed, and files the
+        manifest has never seen are accepted if their zip directory is
+        readable.  A zip cut down to the members of one type of processing
+        only satisfies requests for that same type."""
+        if not os.path.isfile(file_name):
+            return False
+        st = os.stat(file_name)
+        record = self.get(name)
+        if record is not None and record['state'] == 'complete':
+            if record['members'] is not None and record['members'] != members:
+                logging.info("{} only holds the {} files".format(file_name, record['members']))
+                return False
+            if record['size'] != st.st_size:
+                logging.info("Size of {} does not match manifest".format(file_name))
+                return False
+            if record['mtime'] == st.st_mtime:
+                return True
+            if record['md5'] != md5sum(file_name):
+                logging.info("Checksum of {} does not match manifest".format(file_name))
+                return False
+            self.mark(name, mtime=st.st_mtime)
+            return True
+        if check_zip(file_name):
+            logging.info("Adding existing file {} to manifest".format(file_name))
+            self.complete(name, file_name)
+            return True
+        logging.info("Existing file {} is not a complete zip".format(file_name))
+        return False
+
+    def missing(self, product_list, members=None):
+        """Return the products from product_list that are not yet in the
+        directory, removing any damaged copies found along the way"""
+        todo = []
+        for product in product_list:
+            file_name = os.path.join(self.directory, product['name'])
+            if not self.verify(product['name'], file_name, members):
+                if os.path.isfile(file_name):
+                    os.remove(file_name)
+                    self.mark(product['name'], state='corrupt')
+                todo.append(product)
+        return todo
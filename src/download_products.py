@@ -8,17 +8,479 @@
 # Useful for downloading large quantity of products as they take a long time
 # to download.
 
-from asf_hyp3 import API
 try:
     import curses
 except:
     pass
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 import os
 import requests
 import sys
 import time
 import threading
 import argparse
+import random
+import json
+import logging
+from multiprocessing.pool import ThreadPool
+from download_manifest import DownloadManifest
+from remote_zip import fetch_members, RangeNotSupported, IncompleteDownload
+from product_store import ProductStore, default_store, STORE_ENV
+from product_filter import ProductFilter, shape_bbox
+
+
+# Number of simultaneous downloads used when the caller doesn't ask for one
+DEFAULT_THREADS = 4
+
+# Size of the blocks streamed to disk
+CHUNK_SIZE = 1024 * 1024
+
+# Upper limit on simultaneous downloads when adapting to the throughput
+MAX_THREADS = 16
+
+# Seconds between throughput measurements when adapting
+ADAPT_INTERVAL = 5.0
+
+# Fractional change in throughput treated as a real improvement or slowdown
+ADAPT_GAIN = 0.1
+
+# Number of times a failed download is resumed before giving up
+RETRIES = 5
+
+# Seconds to wait before the first retry; doubles on each further retry
+BACKOFF = 1.0
+BACKOFF_MAX = 60.0
+
+# Number of products the api returns on a full page
+PAGE_SIZE = 100
+
+# Number of listing pages requested at once
+PREFETCH = 4
+
+# Seconds a cached product listing is reused before the api is asked again
+LISTING_TTL = 3600
+
+LISTING_CACHE = ".listing_cache.json"
+
+
+def make_session(threads=DEFAULT_THREADS, per_host=None):
+    """Create a requests session whose connection pool is shared by all of the
+    download workers.  per_host limits the number of open connections to any
+    single host (defaults to one per worker)."""
+    if per_host is None:
+        per_host = max(threads, 1)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4,
+                                            pool_maxsize=per_host,
+                                            pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+class DownloadProgress(object):
+    """Combined progress and throughput report for all active downloads"""
+
+    def __init__(self, total, verbose=True, interval=0.5):
+        self.total = total
+        self.verbose = verbose
+        self.interval = interval
+        self.done = 0
+        self.failed = 0
+        self.retries = 0
+        self.bytes = 0
+        self.start = time.time()
+        self.last = 0
+        self.lock = threading.Lock()
+        self.tty = verbose and sys.stdout.isatty()
+        self.bar_length = 30
+        if self.tty:
+            try:
+                curses.setupterm()
+                self.bar_length = max(10, curses.tigetnum('cols') - 60)
+            except Exception:
+                pass
+
+    def rate(self):
+        elapsed = max(time.time() - self.start, 1e-6)
+        return self.bytes / elapsed
+
+    def add_bytes(self, nbytes):
+        with self.lock:
+            self.bytes += nbytes
+            self.report()
+
+    def retry(self):
+        with self.lock:
+            self.retries += 1
+
+    def finish(self, name, ok):
+        with self.lock:
+            if ok:
+                self.done += 1
+            else:
+                self.failed += 1
+            if self.verbose and not self.tty:
+                print("{} {}".format("Done" if ok else "Failed", name))
+            self.report(force=True)
+
+    def report(self, force=False):
+        # Caller must hold the lock
+        if not self.verbose:
+            return
+        now = time.time()
+        if not force and now - self.last < self.interval:
+            return
+        self.last = now
+        finished = self.done + self.failed
+        mbps = self.rate() / (1024.0 * 1024.0)
+        if self.tty:
+            frac = float(finished) / self.total if self.total else 1.0
+            progress = int(self.bar_length * frac)
+            sys.stdout.write("\r|{}{}| {}/{} products, {:.1f} MB/s ".format(
+                "█" * progress, " " * (self.bar_length - progress), finished, self.total, mbps))
+            sys.stdout.flush()
+        elif force:
+            print("{}/{} products, {:.1f} MB/s".format(finished, self.total, mbps))
+
+    def close(self):
+        if self.tty:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
+
+
+def fetch_part(session, url, part_name, progress=None, cancel=None):
+    """Stream url into part_name, resuming from the end of any existing partial
+    file with an HTTP Range request.  Returns True when the part file holds the
+    whole product and False if the download was cancelled."""
+    offset = 0
+    headers = {}
+    if os.path.isfile(part_name):
+        offset = os.path.getsize(part_name)
+        if offset > 0:
+            headers['Range'] = 'bytes={}-'.format(offset)
+    resp = session.get(url, stream=True, headers=headers)
+    try:
+        if resp.status_code == 416:
+            # Range starts at the end of the file; check the part is really complete
+            total = resp.headers.get('content-range', '').split('/')[-1]
+            if total.isdigit() and int(total) == offset:
+                return True
+            os.remove(part_name)
+            raise IncompleteDownload("Unable to resume download of {}".format(url))
+        resp.raise_for_status()
+        if resp.status_code == 206:
+            mode = 'ab'
+        else:
+            # Server ignored the range request; start over
+            mode = 'wb'
+            offset = 0
+        expected = resp.headers.get('content-length')
+        if expected is not None:
+            expected = offset + int(expected)
+        with open(part_name, mode) as out_f:
+            for data in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if cancel is not None and cancel.is_set():
+                    return False
+                out_f.write(data)
+                if progress is not None:
+                    progress.add_bytes(len(data))
+    finally:
+        resp.close()
+    if expected is not None and os.path.getsize(part_name) != expected:
+        raise IncompleteDownload("Incomplete download of {}".format(url))
+    return True
+
+
+def retryable(err):
+    """Return True if a download that failed with err may succeed if tried
+    again: dropped connections, timeouts, short transfers and server side
+    errors.  Anything else, such as a missing product or a full disk,
+    won't go away by retrying."""
+    if isinstance(err, requests.HTTPError):
+        status = err.response.status_code if err.response is not None else None
+        return status is None or status >= 500 or status == 429
+    return isinstance(err, (requests.ConnectionError, requests.Timeout,
+                            requests.exceptions.ChunkedEncodingError, IncompleteDownload))
+
+
+def fetch_file(session, url, out_name, progress=None, cancel=None, retries=RETRIES,
+               members=None):
+    """Download url into out_name using the shared session.  Data is streamed
+    into out_name.part, which is resumed after a dropped connection and renamed
+    to out_name once complete.  Returns True if the file was completely
+    downloaded and False if the download was cancelled; the part file is kept
+    so that a later run can resume it.
+
+    If members names a type of processing ('insar', 'rtc' or 'aria'), only
+    the zip members used by that processing are fetched, into
+    out_name.members.part."""
+    part_name = out_name + ".part"
+    # Member zips are rewritten from the start, and must never be resumed
+    # as if they were the head of the full file
+    members_name = out_name + ".members.part"
+    attempt = 0
+    while True:
+        try:
+            if members is not None:
+                try:
+                    return fetch_members(session, url, members_name, members, progress, cancel) and \
+                        finish_part(members_name, out_name)
+                except RangeNotSupported as err:
+                    logging.info("Downloading all of {}: {}".format(url, err))
+                    members = None
+                    if os.path.exists(members_name):
+                        os.remove(members_name)
+            if not fetch_part(session, url, part_name, progress, cancel):
+                return False
+            break
+        except Exception as err:
+            attempt += 1
+            if not retryable(err) or attempt > retries or (cancel is not None and cancel.is_set()):
+                raise
+            if progress is not None:
+                progress.retry()
+            delay = min(BACKOFF * 2 ** (attempt - 1), BACKOFF_MAX)
+            time.sleep(delay * random.uniform(0.5, 1.5))
+    return finish_part(part_name, out_name)
+
+
+def finish_part(part_name, out_name):
+    if os.name == 'nt' and os.path.exists(out_name):
+        os.remove(out_name)
+    os.rename(part_name, out_name)
+    return True
+
+
+class DownloadPool(object):
+    """Pool of worker threads that pull products off a queue and download them
+    using a shared session.  When adaptive is set the pool measures its
+    throughput and grows towards max_threads while that helps, and shrinks
+    again when transfers start failing or slowing down."""
+
+    def __init__(self, session, threads=DEFAULT_THREADS, progress=None, on_complete=None,
+                 members=None, adaptive=False, max_threads=MAX_THREADS):
+        self.session = session
+        self.members = members
+        self.threads = max(threads, 1)
+        self.target = self.threads
+        self.max_threads = max(max_threads, self.threads)
+        self.adaptive = adaptive
+        self.progress = progress
+        # Called from the worker thread as on_complete(url, out_name, ok)
+        self.on_complete = on_complete
+        self.tasks = queue.Queue()
+        self.cancel = threading.Event()
+        self.lock = threading.Lock()
+        self.succeeded = []
+        self.failed = []
+        self.workers = []
+        self.running = 0
+        self.bytes = 0
+        self.retries = 0
+        self.climbing = True
+        self.best_rate = 0.0
+
+    def submit(self, url, out_name):
+        self.tasks.put((url, out_name))
+
+    def stop(self):
+        self.cancel.set()
+
+    # fetch_file reports to the pool, which passes the numbers on to progress
+    def add_bytes(self, nbytes):
+        with self.lock:
+            self.bytes += nbytes
+        if self.progress is not None:
+            self.progress.add_bytes(nbytes)
+
+    def retry(self):
+        with self.lock:
+            self.retries += 1
+        if self.progress is not None:
+            self.progress.retry()
+
+    def _exit(self):
+        """Return True, having left the pool, if this worker should stop"""
+        with self.lock:
+            if self.cancel.is_set() or self.running > self.target or self.tasks.empty():
+                self.running -= 1
+                return True
+            return False
+
+    def _worker(self):
+        while not self._exit():
+            try:
+                url, out_name = self.tasks.get_nowait()
+            except queue.Empty:
+                continue
+            name = os.path.basename(out_name)
+            try:
+                ok = fetch_file(self.session, url, out_name, self, self.cancel,
+                                members=self.members)
+            except Exception as err:
+                logging.error("Unable to download {}: {}".format(url, err))
+                ok = False
+            if self.on_complete is not None:
+                try:
+                    self.on_complete(url, out_name, ok)
+                except Exception as err:
+                    logging.error("Unable to record download of {}: {}".format(url, err))
+                    ok = False
+            with self.lock:
+                if ok:
+                    self.succeeded.append(out_name)
+                else:
+                    self.failed.append(out_name)
+            if self.progress is not None:
+                self.progress.finish(name, ok)
+
+    def _add_worker(self):
+        with self.lock:
+            self.running += 1
+        t = threading.Thread(target=self._worker)
+        t.daemon = True
+        t.start()
+        self.workers.append(t)
+
+    def start(self):
+        """Start the workers on everything that has been submitted"""
+        self.workers = []
+        for i in range(min(self.threads, self.tasks.qsize())):
+            self._add_worker()
+
+    def adjust(self, rate, retries):
+        """Pick the number of simultaneous downloads from the throughput
+        (bytes/sec) and the number of retries seen since the last call"""
+        target = self.target
+        if retries > 0:
+            # Transfers are failing; back off
+            target = target - 1
+            self.climbing = False
+            self.best_rate = 0.0
+        elif self.climbing:
+            if rate > self.best_rate * (1 + ADAPT_GAIN):
+                self.best_rate = rate
+                target = target + 1
+            else:
+                # The last stream didn't help; drop it and stay here
+                target = target - 1
+                self.climbing = False
+        elif rate < self.best_rate * (1 - ADAPT_GAIN):
+            # Throughput fell off at this setting; start probing again
+            self.best_rate = rate
+            self.climbing = True
+        elif rate > self.best_rate:
+            self.best_rate = rate
+        target = max(1, min(target, self.max_threads))
+        if target != self.target:
+            logging.info("Adjusting simultaneous downloads from {} to {} ({:.1f} MB/s)".format(
+                         self.target, target, rate / (1024.0 * 1024.0)))
+        self.target = target
+        while self.running < self.target and not self.tasks.empty():
+            self._add_worker()
+
+    def run(self):
+        """Download everything that has been submitted.  A KeyboardInterrupt
+        cancels the outstanding downloads, leaving their .part files to resume,
+        and is raised again once the workers have stopped."""
+        if not self.workers:
+            self.start()
+        last_time = time.time()
+        last_bytes = 0
+        last_retries = 0
+        try:
+            while any(t.is_alive() for t in self.workers):
+                # Join with a timeout so that Ctrl-C is still delivered
+                for t in self.workers:
+                    if t.is_alive():
+                        t.join(0.5)
+                        break
+                now = time.time()
+                if self.adaptive and now - last_time >= ADAPT_INTERVAL:
+                    with self.lock:
+                        nbytes, retries = self.bytes, self.retries
+                    self.adjust((nbytes - last_bytes) / (now - last_time), retries - last_retries)
+                    last_time, last_bytes, last_retries = now, nbytes, retries
+        except KeyboardInterrupt:
+            self.stop()
+            for t in self.workers:
+                t.join()
+            raise
+        # Anything never started counts as failed
+        while True:
+            try:
+                url, out_name = self.tasks.get_nowait()
+            except queue.Empty:
+                break
+            self.failed.append(out_name)
+        return self.succeeded, self.failed
+
+
+def list_products(api, id=None, sub_id=None, sub_name=None, creation_date=None,
+                  prefetch=PREFETCH, verbose=True):
+    """Get the full product list from the api, requesting prefetch pages at a
+    time.  Returns the api's error message (a dict) if a request fails."""
+    def get_page(page):
+        return api.get_products(id, sub_id=sub_id, sub_name=sub_name,
+                                creation_date=creation_date, page=page)
+
+    product_list = []
+    page = 0
+    pool = ThreadPool(max(prefetch, 1))
+    try:
+        while True:
+            pages = pool.map(get_page, range(page, page + max(prefetch, 1)))
+            for prod_list in pages:
+                if 'message' in prod_list:
+                    return prod_list
+                product_list = product_list + prod_list
+                page = page + 1
+                if verbose:
+                    print("Found {} products; on page {}".format(len(prod_list),page))
+                if len(prod_list) != PAGE_SIZE:
+                    return product_list
+    finally:
+        pool.close()
+
+
+def listing_key(id, sub_id, sub_name, creation_date):
+    return "{}|{}|{}|{}".format(id, sub_id, sub_name, creation_date)
+
+
+def read_listing_cache(cache_file, key, ttl):
+    """Return the cached product list for key, or None if missing or stale"""
+    if ttl <= 0 or not os.path.isfile(cache_file):
+        return None
+    try:
+        with open(cache_file) as f:
+            cache = json.load(f)
+    except ValueError:
+        return None
+    entry = cache.get(key)
+    if entry is None or time.time() - entry['time'] > ttl:
+        return None
+    return entry['products']
+
+
+def write_listing_cache(cache_file, key, product_list):
+    cache = {}
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file) as f:
+                cache = json.load(f)
+        except ValueError:
+            pass
+    cache[key] = {'time': time.time(), 'products': product_list}
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f)
+    if os.name == 'nt' and os.path.exists(cache_file):
+        os.remove(cache_file)
+    os.rename(tmp_file, cache_file)
 
 
 def download_products(
@@ -29,191 +491,149 @@ def download_products(
                         sub_name=None,
                         creation_date=None,
                         verbose=True,
-                        threads=0):
-    try:
-        product_list = [] 
-        products = 100
-        page = 0
-        while (products == 100):
-            prod_list = api.get_products(id, sub_id=sub_id, sub_name=sub_name, creation_date=creation_date,page=page)
-            products = len(prod_list)
-            product_list = product_list + prod_list
-            page = page + 1
-            print("Found {} products; on page {}".format(products,page))
-       
-    except requests.ConnectionError:
-        if verbose:
-            print("Could not connect to the api")
-        return
-    # Check that the api call succeeded
-    if 'message' in product_list:
-        return product_list['message']
-
-    ###################################
-    # Define Helper functions/classes #
-    ###################################
-
-    # Downloading without progress tracking
-    def download(url, out_name):
-        resp = requests.get(url, stream=True)
-        with open(out_name, 'wb') as out_f:
-            out_f.write(resp.content)
-
-    # Download with progress tracking
-    def download_with_progress(url, out_name, bar):
-        if bar is not None:
-            bar.download(url, out_name)
-        elif sys.stdout.isatty():
-            # If curses is available on this platform, use it for clearing
-            # the terminal
-            try:
-                curses.setupterm()
-                bar = CursesBar()
-            except NameError:
-                # If Windows, we're out of luck... No progress tracking
-                if os.name == 'nt':
-                    download(url, out_name)
-                    return
-                else:
-                    bar = AsciiBar()
-            download_with_progress(url, out_name, bar)
-        else:
-            download(url, out_name)
-        return bar
-
-    # Progress bar template
-    class DownloadBar(object):
-        def __init__(self):
-            self.bar_length = 50
-            self.bar_template = "|{}{}| {}% "
-            pass
-
-        def download(self, url, out_name):
-            resp = requests.get(url, stream=True)
-            self.size = int(resp.headers['content-length'])
-            with open(out_name, 'wb') as out_f:
-                self.done = 0
-                for data in resp.iter_content(chunk_size=4096):
-                    out_f.write(data)
-                    self.done += len(data)
-                    self.progress = int(self.bar_length * self.done / self.size)
-                    # Clear the bar
-                    self.clear()
-                    sys.stdout.write(self.bar_template.format("█" * self.progress, " " * (self.bar_length - self.progress), 100 * self.done / self.size))
-                    sys.stdout.flush()
-
-    # Progress bar using curses function for clearing and getting terminal size
-    class CursesBar(DownloadBar):
-        def __init__(self):
-            try:
-                # Python 3
-                super().__init__()
-            except:
-                # Python 2
-                super(CursesBar, self).__init__()
-            self.bar_length = curses.tigetnum('cols') - 15
-
-        def clear(self):
-            sys.stdout.write(str(curses.tigetstr('cr')) + str(curses.tigetstr('el')))
-
-    # Progress bar using basic terminal. Does not work correctly on windows
-    class AsciiBar(DownloadBar):
-        def clear(self):
-            sys.stdout.write("\r")
-
-    class DownloadThread(threading.Thread):
-        def __init__(self, url, out_name):
-            super(DownloadThread, self).__init__()
-            self._stop_event = threading.Event()
-            self.url = url
-            self.out_name = out_name
-
-        def stop(self):
-            self._stop_event.set()
-
-        def stopped(self):
-            return self._stop_event.is_set()
-
-        def run(self):
-            resp = requests.get(self.url, stream=True)
-            with open(self.out_name, 'wb') as out_f:
-                for data in resp.iter_content(chunk_size=4096):
-                    if self.stopped():
-                        out_f.close()
-                        os.remove(self.out_name)
-                        break
-                    out_f.write(data)
+                        threads=DEFAULT_THREADS,
+                        per_host=None,
+                        adaptive=True,
+                        max_threads=MAX_THREADS,
+                        prefetch=PREFETCH,
+                        cache_ttl=LISTING_TTL,
+                        on_product=None,
+                        members=None,
+                        store=None,
+                        aoi=None,
+                        start=None,
+                        end=None,
+                        direction=None):
+    """Download the products of a HyP3 subscription into directory.  If given,
+    on_product(file_name) is called for every product zip as soon as it is
+    available locally, so processing can start before the last download
+    finishes.  If members is 'insar', 'rtc' or 'aria', only the parts of each
+    zip used by that processing are downloaded.  threads is the number of
+    simultaneous downloads to start with; unless adaptive is False this is
+    tuned between 1 and max_threads from the measured throughput.  Products
+    found in the ProductStore store are linked instead of downloaded, and new
+    downloads are added to it.
 
-    ###################################
-    #  End Helper functions/classes   #
-    ###################################
+    Only products acquired between the start and end dates (YYYYMMDD), whose
+    footprint overlaps aoi ([min lat, max lat, min lon, max lon]) and whose
+    orbit direction is direction ('a' or 'd') are downloaded.  The footprint
+    and direction are read from the product metadata before any download.
 
+    Returns a dict of download statistics (products attempted, succeeded and
+    failed, bytes, retries and seconds), or the api's message if the listing
+    failed."""
     # Create the download directory
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-    # Check each product and download it if it doesnt exist already
-    failed_products = 0
-    total_products = 0
-    active_threads = 0
-    threads_list = [None] * threads
-    thread_index = 0
-    bar = None
-    for product in product_list:
+    # Reuse a recent listing of this subscription if there is one
+    cache_file = os.path.join(directory, LISTING_CACHE)
+    key = listing_key(id, sub_id, sub_name, creation_date)
+    product_list = read_listing_cache(cache_file, key, cache_ttl)
+    fresh = False
+    if product_list is not None:
+        if verbose:
+            print("Using cached listing of {} products".format(len(product_list)))
+    else:
+        try:
+            product_list = list_products(api, id, sub_id, sub_name, creation_date,
+                                         prefetch=prefetch, verbose=verbose)
+        except requests.ConnectionError:
+            if verbose:
+                print("Could not connect to the api")
+            return
+        # Check that the api call succeeded
+        if 'message' in product_list:
+            return product_list['message']
+        fresh = True
+
+    # Drop the products outside the requested dates, area and direction.
+    # Their metadata is kept in the listing cache for the next run.
+    session = make_session(max_threads if adaptive else threads, per_host)
+    product_filter = ProductFilter(aoi, start, end, direction, filetype=members)
+    if product_filter.needs_metadata():
+        product_filter.describe(session, product_list, directory)
+    if fresh and cache_ttl > 0:
+        write_listing_cache(cache_file, key, product_list)
+    if product_filter.active():
+        total = len(product_list)
+        product_list = product_filter.filter(product_list)
+        if verbose:
+            print("Keeping {} of {} products".format(len(product_list), total))
+
+    # Check each product against the manifest and queue any that are
+    # missing or damaged
+    manifest = DownloadManifest(directory)
+    missing = manifest.missing(product_list, members)
+    todo = []
+    for product in missing:
         name = product['name']
-        # Check if it has already been downloaded
         file_name = os.path.join(directory, name)
-        if not os.path.isfile(file_name):
+        found = None
+        if store is not None:
+            found = store.find(name, members)
+        if found is not None:
+            stored, md5, stored_members = found
             if verbose:
-                print("Getting new product: {}".format(name))
-            try:
-                total_products += 1
-                # Check if a thread slot is available and we are using threads
-                if threads > 0 and active_threads < threads:
-                    # Fire off a new download thread
-                    threads_list[thread_index] = DownloadThread(product['url'], file_name)
-                    threads_list[thread_index].start()
-                    thread_index = (thread_index + 1) % threads
-                    active_threads += 1
-                    # Check if thread slots are full
-                    if active_threads == threads:
-                        try:
-                            # wait for the first thread to complete
-                            while threads_list[thread_index].isAlive():
-                                time.sleep(0.05)
-                                thread_index = (thread_index + 1) % threads
-                        except KeyboardInterrupt:
-                            for t in threads_list:
-                                if t.isAlive():
-                                    t.stop()
-                                    failed_products += 1
-                            if verbose:
-                                print("")
-                            break
-                        active_threads -= 1
-                else:
-                    if verbose:
-                        bar = download_with_progress(product['url'], file_name, bar)
-                        print("Done")
-                    else:
-                        download(product['url'], file_name)
-            except KeyboardInterrupt:
-                if verbose:
-                    print("Failed")
-                failed_products += 1
-                if os.path.isfile(file_name):
-                    os.remove(file_name)
-                if verbose:
-                    print("")
-                break
-            except requests.ConnectionError:
-                if verbose:
-                    print("Failed")
-                failed_products += 1
-                if os.path.isfile(file_name):
-                    os.remove(file_name)
+                print("Linking stored product: {}".format(name))
+            store.link(stored, file_name)
+            manifest.complete(name, file_name, url=product['url'], members=stored_members, md5=md5)
+            continue
+        if verbose:
+            print("Getting new product: {}".format(name))
+        manifest.mark(name, url=product['url'], state='pending')
+        todo.append((product['url'], file_name))
+
+    # Put products downloaded before the store was in use into it
+    if store is not None:
+        missing_names = set(product['name'] for product in missing)
+        for product in product_list:
+            if product['name'] in missing_names:
+                continue
+            file_name = os.path.join(directory, product['name'])
+            if store.lookup(file_name) is None:
+                entry = manifest.get(product['name'])
+                store.add(file_name, entry['md5'], entry['members'])
+
+    def record(url, file_name, ok):
+        name = os.path.basename(file_name)
+        if ok:
+            manifest.complete(name, file_name, url=url, members=members)
+            if store is not None:
+                store.add(file_name, manifest.get(name)['md5'], members)
+        else:
+            manifest.mark(name, state='failed')
+        if ok and on_product is not None:
+            on_product(file_name)
+
+    total_products = len(todo)
+    progress = DownloadProgress(total_products, verbose=verbose)
+    pool = DownloadPool(session, threads=threads, progress=progress, on_complete=record,
+                        members=members, adaptive=adaptive, max_threads=max_threads)
+    for url, file_name in todo:
+        pool.submit(url, file_name)
+    try:
+        pool.start()
+        # Products that were already here go down the pipeline while the
+        # new ones download
+        if on_product is not None:
+            queued = set(file_name for url, file_name in todo)
+            for product in product_list:
+                file_name = os.path.join(directory, product['name'])
+                if file_name not in queued:
+                    on_product(file_name)
+        succeeded, failed = pool.run()
+    finally:
+        progress.close()
+        session.close()
+        manifest.close()
+    failed_products = len(failed)
+
     if verbose:
         print("Attempted to download {} products: {} succeeded, {} failed".format(total_products, total_products - failed_products, failed_products))
+    return {'attempted': total_products, 'succeeded': len(succeeded), 'failed': failed_products,
+            'bytes': progress.bytes, 'retries': progress.retries,
+            'seconds': time.time() - progress.start}
 
 
 if __name__ == "__main__":
@@ -222,16 +642,29 @@ if __name__ == "__main__":
     group.add_argument("-s","--sub_name",help="Name of the subscription to download")
     group.add_argument("-i","--id",help="ID of the subscription to download")
     group.add_argument("-d","--date",help="Date of the subscription to download")
+    parser.add_argument("-a","--after",help="Only download products acquired on or after this date (YYYYMMDD)")
+    parser.add_argument("-b","--before",help="Only download products acquired on or before this date (YYYYMMDD)")
+    parser.add_argument("-f","--fixed",action="store_true",help="Keep the number of simultaneous downloads fixed instead of adapting it to the throughput")
+    parser.add_argument("-m","--members",choices=['insar','rtc','aria'],help="Only download the files from each zip used by this type of processing")
+    parser.add_argument("-p","--store",help="Shared product store to download into (default ${})".format(STORE_ENV))
+    parser.add_argument("-o","--orbit",choices=['a','d'],help="Only download ascending or descending products")
+    parser.add_argument("-r","--refresh",action="store_true",help="Ignore any cached listing of the subscription")
+    parser.add_argument("-t","--threads",type=int,default=DEFAULT_THREADS,help="Number of simultaneous downloads (default {})".format(DEFAULT_THREADS))
+    area = parser.add_mutually_exclusive_group()
+    area.add_argument("-x","--bbox",type=float,nargs=4,metavar=('MINLAT','MAXLAT','MINLON','MAXLON'),help="Only download products overlapping this bounding box")
+    area.add_argument("-y","--shape",help="Only download products overlapping this shapefile")
 
     args = parser.parse_args()
 
+    from asf_hyp3 import API
+
     print("Username: ")
     try:
         username = input()
     except:
         username = raw_input()
 
-    print "Username is {}".format(username)
+    print("Username is {}".format(username))
     api = API(username)
     api.login()
 
@@ -243,5 +676,13 @@ if __name__ == "__main__":
                         sub_name=args.sub_name,
                         creation_date=args.date,
                         verbose=True,
-                        threads=0)
+                        threads=args.threads,
+                        adaptive=not args.fixed,
+                        cache_ttl=0 if args.refresh else LISTING_TTL,
+                        members=args.members,
+                        store=ProductStore(args.store) if args.store else default_store(),
+                        aoi=shape_bbox(args.shape) if args.shape else args.bbox,
+                        start=args.after,
+                        end=args.before,
+                        direction=args.orbit)
 #    download_products(api)
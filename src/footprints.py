@@ -0,0 +1,125 @@
+#!/usr/bin/python
+#
+# footprints.py
+#
+# Footprints of a stack of scenes held as NumPy arrays, so that the common
+# overlap, the fraction of an area of interest each scene covers and the
+# best fitting scene are worked out for the whole stack at once.  Boxes are
+# [ulx, uly, lrx, lry], the order read_tif_header and gdal's projWin use;
+# all boxes must be in the same projection.  If the rtree package is
+# installed, overlap queries on large stacks go through a spatial index.
+#
+import numpy as np
+try:
+    from rtree import index as rtree_index
+except ImportError:
+    rtree_index = None
+
+# Stacks smaller than this are simply scanned
+INDEX_MIN_SCENES = 256
+
+# Scenes sharing at least this fraction of the smaller footprint are
+# stacked together by cluster()
+MIN_OVERLAP = 0.5
+
+
+def box_bounds(box):
+    """Return (west, south, east, north) of a [ulx, uly, lrx, lry] box"""
+    return (min(box[0], box[2]), min(box[1], box[3]),
+            max(box[0], box[2]), max(box[1], box[3]))
+
+
+class Footprints(object):
+
+    def __init__(self, boxes):
+        boxes = np.asarray(boxes, dtype=float).reshape(-1, 4)
+        self.west = np.minimum(boxes[:, 0], boxes[:, 2])
+        self.east = np.maximum(boxes[:, 0], boxes[:, 2])
+        self.south = np.minimum(boxes[:, 1], boxes[:, 3])
+        self.north = np.maximum(boxes[:, 1], boxes[:, 3])
+        self._index = None
+
+    def __len__(self):
+        return len(self.west)
+
+    def areas(self):
+        return (self.east - self.west) * (self.north - self.south)
+
+    def common_overlap(self):
+        """Return the box covered by every scene as [ulx, uly, lrx, lry].
+        The box is inverted if the scenes have no common overlap."""
+        return [float(self.west.max()), float(self.north.min()),
+                float(self.east.min()), float(self.south.max())]
+
+    def box(self, i):
+        return [self.west[i], self.north[i], self.east[i], self.south[i]]
+
+    def intersection_areas(self, box, scenes=None):
+        """Return the area of each scene (or of the scenes given) inside box"""
+        if scenes is None:
+            scenes = slice(None)
+        west, south, east, north = box_bounds(box)
+        width = np.minimum(self.east[scenes], east) - np.maximum(self.west[scenes], west)
+        height = np.minimum(self.north[scenes], north) - np.maximum(self.south[scenes], south)
+        return np.clip(width, 0, None) * np.clip(height, 0, None)
+
+    def fractions(self, box):
+        """Return the fraction of box each scene covers"""
+        west, south, east, north = box_bounds(box)
+        area = (east - west) * (north - south)
+        if area <= 0:
+            return np.zeros(len(self))
+        return self.intersection_areas(box) / area
+
+    def best_fit(self, box):
+        """Return the scene indices ordered from most to least of box
+        covered; ties keep stack order"""
+        return np.argsort(-self.fractions(box), kind='mergesort')
+
+    @property
+    def index(self):
+        if self._index is None and rtree_index is not None and len(self) >= INDEX_MIN_SCENES:
+            self._index = rtree_index.Index()
+            for i in range(len(self)):
+                self._index.insert(i, (self.west[i], self.south[i], self.east[i], self.north[i]))
+        return self._index
+
+    def overlapping(self, box):
+        """Return the sorted indices of the scenes that overlap box"""
+        west, south, east, north = box_bounds(box)
+        if self.index is not None:
+            return np.array(sorted(self.index.intersection((west, south, east, north))), dtype=int)
+        mask = (self.west <= east) & (west <= self.east) & \
+               (self.south <= north) & (south <= self.north)
+        return np.nonzero(mask)[0]
+
+
+def cluster(boxes, keys=None, min_overlap=MIN_OVERLAP):
+    """Group scenes into stacks.  Scenes are in the same stack if they are
+    linked by footprints sharing at least min_overlap of the smaller one.
+    Scenes with different keys (e.g. relative orbits) are never stacked
+    together.  Returns lists of scene indices, ordered by first scene."""
+    footprints = Footprints(boxes)
+    areas = footprints.areas()
+    parent = list(range(len(footprints)))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i in range(len(footprints)):
+        others = footprints.overlapping(footprints.box(i))
+        others = others[others > i]
+        if len(others) == 0:
+            continue
+        shared = footprints.intersection_areas(footprints.box(i), others)
+        for j in others[shared >= min_overlap * np.minimum(areas[others], areas[i])]:
+            if keys is None or keys[i] == keys[j]:
+                parent[root(j)] = root(i)
+
+    groups = {}
+    for i in range(len(footprints)):
+        groups.setdefault(root(i), []).append(i)
+    return sorted(groups.values())
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+#
+# mock_hyp3.py
+#
+# Local stand-in for the HyP3 product listing and download service, for
+# exercising download_products without the live service.  MockHyP3Server
+# serves zip files from a directory over HTTP (with Range support) and can be
+# made slow, bandwidth limited or unreliable; MockAPI answers get_products
+# with pages of products pointing at the server.
+#
+import os
+import re
+import time
+import random
+import zipfile
+import logging
+import argparse
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+
+# Number of products on a full page of the listing
+PAGE_SIZE = 100
+
+# Size of the blocks written to each connection
+BLOCK_SIZE = 64 * 1024
+
+
+def make_products(directory, count, size, seed=0):
+    """Write count InSAR-like product zips of roughly size bytes each into
+    directory and return their names.  Most of each zip is amplitude and DEM
+    data that the GIANT processing doesn't read."""
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    rand = random.Random(seed)
+    names = []
+    for i in range(count):
+        mdate = "2018{:02d}{:02d}".format(1 + i // 28 % 12, 1 + i % 28)
+        sdate = "2019{:02d}{:02d}".format(1 + i // 28 % 12, 1 + i % 28)
+        base = "S1AA_{}T000000_{}T000000_VVP012_INT80_G_ueF_{:04X}".format(mdate, sdate, i)
+        name = base + ".zip"
+        path = os.path.join(directory, name)
+        names.append(name)
+        if os.path.isfile(path):
+            continue
+        part = max(size // 8, 1)
+        zip_ref = zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED)
+        for member, length in [("unw_phase.tif", part), ("corr.tif", part),
+                               ("amp.tif", 3 * part), ("dem.tif", 2 * part),
+                               ("color_phase.png", part)]:
+            data = bytearray(rand.getrandbits(8) for j in range(min(length, 4096)))
+            zip_ref.writestr("{}/{}_{}".format(base, base, member),
+                             bytes(data * (length // len(data) + 1))[:length])
+        zip_ref.writestr("{}/{}.txt".format(base, base),
+                         "Baseline: 42.0\nUTCtime: 3600.0\nHeading: -12.0\n")
+        zip_ref.close()
+    return names
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        logging.debug("mock_hyp3: " + format % args)
+
+    def do_GET(self):
+        server = self.server
+        time.sleep(server.latency)
+        path = os.path.join(server.directory, os.path.basename(self.path.split("?")[0]))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end, status = 0, size, 200
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get('Range') or "")
+        if match and server.ranges:
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)) + 1, size)
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(size))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start))
+        if status == 206:
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(start, end - 1, size))
+        self.end_headers()
+
+        # Decide up front whether this response dies part way through
+        drop_at = None
+        if end - start > BLOCK_SIZE and server.random() < server.fail_rate:
+            drop_at = start + int((end - start) * server.random())
+        with server.lock:
+            server.requests += 1
+        began = time.time()
+        sent = 0
+        with open(path, 'rb') as f:
+            f.seek(start)
+            pos = start
+            while pos < end:
+                if drop_at is not None and pos >= drop_at:
+                    with server.lock:
+                        server.dropped += 1
+                    self.close_connection = True
+                    return
+                data = f.read(min(BLOCK_SIZE, end - pos))
+                self.wfile.write(data)
+                pos += len(data)
+                sent += len(data)
+                if server.bandwidth:
+                    ahead = sent / float(server.bandwidth) - (time.time() - began)
+                    if ahead > 0:
+                        time.sleep(ahead)
+        with server.lock:
+            server.bytes_sent += sent
+
+
+class MockHyP3Server(ThreadingMixIn, HTTPServer):
+    """HTTP server for the product zips in directory.  latency is added to
+    every request, bandwidth (bytes/sec) limits each connection, fail_rate is
+    the chance that a response is cut off part way, and ranges=False makes
+    the server ignore Range requests."""
+    daemon_threads = True
+
+    def __init__(self, directory, port=0, latency=0.0, bandwidth=None, fail_rate=0.0,
+                 ranges=True, seed=0):
+        HTTPServer.__init__(self, ('127.0.0.1', port), MockHandler)
+        self.directory = directory
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fail_rate = fail_rate
+        self.ranges = ranges
+        self.lock = threading.Lock()
+        self.rand = random.Random(seed)
+        self.requests = 0
+        self.dropped = 0
+        self.bytes_sent = 0
+        self.thread = None
+
+    def handle_error(self, request, client_address):
+        # Clients closing connections early is expected here
+        logging.debug("mock_hyp3: connection from {} closed".format(client_address))
+
+    def random(self):
+        with self.lock:
+            return self.rand.random()
+
+    def url(self, name):
+        return "http://127.0.0.1:{}/{}".format(self.server_address[1], name)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class MockAPI(object):
+    """Stand-in for asf_hyp3.API that lists the products names, served from
+    base_url (e.g. MockHyP3Server.url(""))"""
+
+    def __init__(self, base_url, names, sub_name="mock", latency=0.0):
+        self.base_url = base_url
+        self.names = names
+        self.sub_name = sub_name
+        self.latency = latency
+        self.calls = 0
+
+    def login(self, password=None):
+        pass
+
+    def get_products(self, id=None, sub_id=None, sub_name=None, creation_date=None, page=0):
+        time.sleep(self.latency)
+        self.calls += 1
+        if sub_name is not None and sub_name != self.sub_name:
+            return {'message': "No subscription named {}".format(sub_name)}
+        names = self.names[page * PAGE_SIZE:(page + 1) * PAGE_SIZE]
+        return [{'name': name, 'url': self.base_url + name, 'sub_id': 1,
+                 'id': page * PAGE_SIZE + i} for i, name in enumerate(names)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="mock_hyp3.py",description="Serve generated HyP3-like products over HTTP")
+    parser.add_argument("directory",help="Directory to create and serve the products from")
+    parser.add_argument("-b","--bandwidth",type=float,help="Per-connection bandwidth limit in MB/s")
+    parser.add_argument("-f","--fail",type=float,default=0.0,help="Fraction of responses cut off part way")
+    parser.add_argument("-l","--latency",type=float,default=0.0,help="Seconds of latency added to each request")
+    parser.add_argument("-n","--products",type=int,default=20,help="Number of products to create (default 20)")
+    parser.add_argument("-p","--port",type=int,default=8080,help="Port to listen on (default 8080)")
+    parser.add_argument("-s","--size",type=float,default=10.0,help="Size of each product in MB (default 10)")
+    args = parser.parse_args()
+
+    names = make_products(args.directory,args.products,int(args.size*1024*1024))
+    bandwidth = int(args.bandwidth*1024*1024) if args.bandwidth else None
+    server = MockHyP3Server(args.directory,port=args.port,latency=args.latency,
+                            bandwidth=bandwidth,fail_rate=args.fail)
+    print("Serving {} products from {} at {}".format(len(names),args.directory,server.url("")))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -11,53 +11,41 @@ import numpy as np
 import shutil
 import logging
 import zipfile
+import multiprocessing
 from osgeo import gdal
 import saa_func_lib as saa
+from zip_index import zipContents
+from raster_cache import read_geo
+from footprints import Footprints
 
 def getPixSize(fi):
-    (x1,y1,t1,p1) = saa.read_gdal_file_geo(saa.open_gdal_file(fi))
+    (x1,y1,t1,p1) = read_geo(fi)
     return (t1[1])
 
 def getCorners(fi):
-    (x1,y1,t1,p1) = saa.read_gdal_file_geo(saa.open_gdal_file(fi))
+    (x1,y1,t1,p1) = read_geo(fi)
     ullon1 = t1[0]
     ullat1 = t1[3]
     lrlon1 = t1[0] + x1*t1[1]
     lrlat1 = t1[3] + y1*t1[5]
     return (ullon1,ullat1,lrlon1,lrlat1)
 
-def getOverlap(coords,fi):
-    (x1,y1,t1,p1) = saa.read_gdal_file_geo(saa.open_gdal_file(fi))
-
-    ullon1 = t1[0]
-    ullat1 = t1[3]
-    lrlon1 = t1[0] + x1*t1[1]
-    lrlat1 = t1[3] + y1*t1[5]
-
-    ullon2 = coords[0]
-    ullat2 = coords[1]
-    lrlon2 = coords[2]
-    lrlat2 = coords[3]
-
-    ullat = min(ullat1,ullat2)
-    ullon = max(ullon1,ullon2)
-    lrlat = max(lrlat1,lrlat2)
-    lrlon = min(lrlon1,lrlon2)
-
-    return (ullon,ullat,lrlon,lrlat)
-
-
-def get_bbox_isce(intdir):
+def get_bbox_isce(intdir,bbox=None):
+    """Return the (min lat, max lat, min lon, max lon) box covered by every
+    interferogram in intdir, limited to bbox if one is given"""
+    corners = [getCorners(myfile) for myfile in glob.glob(os.path.join(intdir, '*/merged/filt_topophase.unw.geo'))]
+    coords = Footprints(corners).common_overlap()
+    overlap = (coords[3],coords[1],coords[0],coords[2])
+    if overlap[0] >= overlap[1] or overlap[2] >= overlap[3]:
+        raise Exception('Interferograms in {0} have no common overlap'.format(intdir))
+    if bbox is None:
+        return overlap
 
-    this_pass = 0
-    for myfile in glob.glob(os.path.join(intdir, '*/merged/filt_topophase.unw.geo')):
-        if this_pass == 0:
-            coords = getCorners(myfile)
-        else:
-            coords = getOverlap(coords,myfile)
-        this_pass = this_pass + 1
-        
-    return(coords[3],coords[1],coords[0],coords[2])
+    coords = (max(overlap[0],bbox[0]),min(overlap[1],bbox[1]),
+              max(overlap[2],bbox[2]),min(overlap[3],bbox[3]))
+    if coords[0] >= coords[1] or coords[2] >= coords[3]:
+        raise Exception('Bounding box {0} does not overlap the common area {1} of the interferograms'.format(list(bbox),list(overlap)))
+    return coords
 
 def make_descriptor_file(vrtdir):
 
@@ -79,20 +67,43 @@ def unzip_file(infile):
     chkdir = infile.replace(".unw_geo.zip","")
     if not os.path.isdir(chkdir):
         zip_ref = zipfile.ZipFile(infile,'r')
-        string = zip_ref.namelist()
+        contents = zipContents(infile)
+        string = contents.members
+        # Only the unwrapped phase and coherence files are used
+        members = contents.wanted('aria')
+        if len(members) == 0:
+            members = None
         if "/" in string[0]:
             print "File {} has a directory".format(infile)
-            zip_ref.extractall(intdir)
+            zip_ref.extractall(intdir,members)
             zip_ref.close()    
         else:
            print "File {} has no directory".format(infile)
            dirname = os.path.join(intdir,infile.replace(".unw_geo.zip","")+"/merged")
            os.makedirs(dirname)
-           zip_ref.extractall(dirname)
+           zip_ref.extractall(dirname,members)
            zip_ref.close()   
 
 
-def prepGIAnT(bbox=None,refpt=None,intdir=None):
+# Files cropped from each interferogram: (vrt, band, output suffix)
+CROPS = [('phsig.cor.geo.vrt',1,'_cor.tif'),('filt_topophase.unw.geo.vrt',2,'_unw.tif')]
+
+def cropPair(args):
+    """Crop the coherence and unwrapped phase of one interferogram.
+    Returns (vroot, error or None)."""
+    bname,vroot,projwin,vrtdir = args
+    try:
+        for vrt,band,suffix in CROPS:
+            src = os.path.abspath(os.path.join(bname,vrt))
+            dst = gdal.Translate(os.path.join(vrtdir,vroot+suffix),src,bandList=[band],projWin=projwin)
+            if dst is None:
+                raise Exception('Error processing {0} for {1} from dir {2}'.format(vrt,vroot,bname))
+            dst = None
+    except Exception as err:
+        return vroot,str(err)
+    return vroot,None
+
+def prepGIAnT(bbox=None,refpt=None,intdir=None,workers=None):
 
     logging.info("***********************************************************************************")
     logging.info("               Preparing ARIA phase and coherence files")
@@ -107,9 +118,8 @@ def prepGIAnT(bbox=None,refpt=None,intdir=None):
     for myfile in glob.glob(os.path.join(intdir,"S1-IFG_*.zip")):
         unzip_file(myfile)
 
-    # If no bounding box given, determine one
-    if bbox is None:
-        bbox = get_bbox_isce(intdir)
+    # Keep to the area every interferogram covers
+    bbox = get_bbox_isce(intdir,bbox)
    
     logging.info("Using bounding box of {}".format(bbox))
 
@@ -138,11 +148,9 @@ def prepGIAnT(bbox=None,refpt=None,intdir=None):
     else:
         os.mkdir(vrtdir)
 
-    #Crop cmd tmpl
-    cmdunwtmpl  = 'gdal_translate -b 2 -projwin {0} {1} {2} {3}'.format(bbox[2], bbox[1], bbox[3], bbox[0])
-    cmdcortmpl  = 'gdal_translate -b 1 -projwin {0} {1} {2} {3}'.format(bbox[2], bbox[1], bbox[3], bbox[0])
+    projwin = [bbox[2], bbox[1], bbox[3], bbox[0]]
 
-    pairs = []
+    jobs = []
     #####Cut out the interferograms
     for dirf in glob.glob(os.path.join(intdir, '*/merged/filt_topophase.unw.geo')):
         bname = os.path.dirname(dirf)
@@ -153,20 +161,25 @@ def prepGIAnT(bbox=None,refpt=None,intdir=None):
         slave = root.split('-')[2][0:8]
         tstamp = root.split('-')[2][9:15]
         vroot = master + '_' + slave
-
-        ###Create crop vrt for cor file
-        cmd = "{0}  {1} {2}".format(cmdcortmpl, os.path.abspath(os.path.join(bname, 'phsig.cor.geo.vrt')), os.path.join(vrtdir, vroot + '_cor.tif'),1)
-        status = os.system(cmd)
-        if status:
-            print(cmd)
-            raise Exception('Error processing cor for {0} from dir {1}'.format(vroot, bname))
-
-        ###Create crop vrt for unw file
-        cmd = "{0}  {1} {2}".format(cmdunwtmpl, os.path.abspath(os.path.join(bname, 'filt_topophase.unw.geo.vrt')), os.path.join(vrtdir, vroot + '_unw.tif'),2)
-        status = os.system(cmd)
-        if status:
-            print(cmd)
-            raise Exception('Error processing cor for {0} from dir {1}'.format(vroot, bname))    
+        jobs.append((bname,vroot,projwin,vrtdir))
+
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    logging.info("Cropping {} interferograms with {} workers".format(len(jobs),workers))
+    if workers > 1 and len(jobs) > 1:
+        pool = multiprocessing.Pool(min(workers,len(jobs)))
+        try:
+            results = pool.map(cropPair,jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [cropPair(job) for job in jobs]
+    failures = [(pair,err) for pair,err in results if err is not None]
+    for pair,err in failures:
+        logging.error("ERROR: Unable to crop {}: {}".format(pair,err))
+    if failures:
+        raise Exception('Unable to crop {0} of {1} interferograms'.format(len(failures),len(jobs)))
 
     #####Make the descriptor file
     make_descriptor_file(vrtdir)
@@ -193,6 +206,8 @@ if __name__ == '__main__':
     parser.add_argument("-r","--refpt",type=float,nargs=2,metavar=('lat','lon'),
         help="Set reference point (default is center of image)")
     parser.add_argument("-p","--path",help="Path to input interferograms")
+    parser.add_argument("-w","--workers",type=int,default=multiprocessing.cpu_count(),
+        help="Number of interferograms to crop at once (default {})".format(multiprocessing.cpu_count()))
     args = parser.parse_args()
 
     logFile = "prepGIAnT_{}_log.txt".format(os.getpid())
@@ -201,4 +216,4 @@ if __name__ == '__main__':
     logging.getLogger().addHandler(logging.StreamHandler())
     logging.info("Starting run")
 
-    prepGIAnT(args.bbox,args.refpt)
+    prepGIAnT(args.bbox,args.refpt,args.path,args.workers)
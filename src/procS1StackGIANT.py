@@ -29,12 +29,14 @@
 # Boston, MA 02111-1307, USA.
 ###############################################################################
 import os
+import math
 import argparse
 import shutil
 import zipfile
 import glob
+import multiprocessing
 from getParameter import getParameter
-from osgeo import gdal
+from osgeo import gdal, osr
 from cutGeotiffs import cutFiles
 from execute import execute
 import saa_func_lib as saa
@@ -46,15 +48,70 @@ from asf_hyp3 import API
 from os.path import expanduser
 from download_products import download_products
 from getUsernamePassword import getUsernamePassword
-from sortByTime import sortByTime 
-from unzipFiles import unzipFiles
+from sortByTime import sortByTime, sortByFootprint
+from unzipFiles import unzipFiles, checkUnzipped
 from osgeo.gdalconst import *
 import logging
 import configparser
 from time_series_utils import *
+from zip_index import vsiZipGlob
 from prepGIAnT import prepGIAnT
-
-def prepareHypFiles(path,hyp):
+from product_pipeline import ProductPipeline
+from product_store import default_store
+from product_catalog import catalog, product_name
+from raster_cache import read_geo
+from footprints import Footprints
+from product_filter import shape_bbox
+from staging import stage_file
+
+HYP_PARAMETERS = ["Baseline","UTCtime","Heading"]
+
+def hypParameters(txtFile):
+    values = {}
+    if isVsiPath(txtFile):
+        # Parameter file still inside its zip
+        lines = readText(txtFile).splitlines()
+        for name in HYP_PARAMETERS:
+            values[name] = None
+            for line in lines:
+                if name in line:
+                    values[name] = line.split(":")[1].strip()
+                    break
+    else:
+        for name in HYP_PARAMETERS:
+            values[name] = getParameter(txtFile,name)
+    return values
+
+def readHypParameters(prodDir):
+    # Catalog the product while the rest of the subscription downloads
+    for txtFile in glob.glob("{}/*20*_20*.txt".format(prodDir)):
+        getHypParameter(txtFile,"Baseline")
+
+def getHypParameter(txtFile,name):
+    values = catalog().file_info(txtFile,"parameters",hypParameters)
+    product = product_name(txtFile)
+    record = catalog().product(product)
+    # The product may have been cataloged from its rasters alone
+    if record is None or None in (record['baseline'],record['utctime'],record['heading']):
+        catalog().update(product,baseline=values["Baseline"],utctime=values["UTCtime"],
+                         heading=values["Heading"])
+    return values[name]
+
+def hypFiles(pattern,zipPattern=None):
+    """Return the product files matching pattern: files in the product
+    directories linked into the current directory, and /vsizip/ paths of
+    files in the product zips matching zipPattern"""
+    files = glob.glob("*/{}".format(pattern))
+    if zipPattern is not None:
+        files = files + vsiZipGlob(pattern,zipPattern)
+    return files
+
+def linkHypProduct(testName,hypDir):
+    linkFile = os.path.join(hypDir,os.path.basename(testName))
+    if not os.path.exists(linkFile):
+        os.symlink(testName,linkFile)
+
+def prepareHypFiles(path,hyp,vsizip=False):
     hypDir = "HYP"
     createCleanDir(hypDir)
 
@@ -63,15 +120,21 @@ def prepareHypFiles(path,hyp):
     else:
         tmpPath = path
 
+    # Zips are read in place, so their index stays in the download directory
+    zipPattern = None
+    if vsizip:
+        zipPattern = os.path.join(os.path.abspath(tmpPath),"*.zip")
+
     dir_cnt = 0
     for myfile in os.listdir(tmpPath):
         if path is not None:
             myfile = os.path.join(path,myfile)
         testName = os.path.join(path,myfile)
         if os.path.isdir(testName) and (len(glob.glob("{}/*_unw_phase.tif".format(testName)))>0 or len(glob.glob("{}/*_unwrapped.tif".format(testName)))>0):
-            linkFile = os.path.join(hypDir,os.path.basename(myfile))
-            if not os.path.exists(linkFile):
-                os.symlink(testName,linkFile)
+            linkHypProduct(testName,hypDir)
+            dir_cnt = dir_cnt + 1
+        elif vsizip and testName.endswith(".zip") and os.path.isfile(testName):
+            # Read straight from the zip instead of unzipping it
             dir_cnt = dir_cnt + 1
 
     if dir_cnt == 0:
@@ -80,18 +143,18 @@ def prepareHypFiles(path,hyp):
         
     os.chdir(hypDir)
 
-    unw_cnt = len(glob.glob("*/*_unw_phase.tif"))
-    cor_cnt = len(glob.glob("*/*_corr.tif"))
+    unw_cnt = len(hypFiles("*_unw_phase.tif",zipPattern))
+    cor_cnt = len(hypFiles("*_corr.tif",zipPattern))
 
     old_coh = False
     if cor_cnt == 0:
-        cor_cnt = len(glob.glob("*/*_coh.tif"))
+        cor_cnt = len(hypFiles("*_coh.tif",zipPattern))
         if cor_cnt != 0:
             old_coh = True         
 
     old_snap = False
     if unw_cnt == 0:
-        unw_cnt = len(glob.glob("*/*_unwrapped.tif"))
+        unw_cnt = len(hypFiles("*_unwrapped.tif",zipPattern))
         if unw_cnt != 0:
             old_snap = True
 
@@ -105,24 +168,34 @@ def prepareHypFiles(path,hyp):
     else:
         ext = "_unw_phase.tif"
 
-    for myfile in glob.glob("*/*{}".format(ext)):
+    for myfile in hypFiles("*{}".format(ext),zipPattern):
         logging.debug("Checking file {}".format(myfile))
+        relName = myfile
+        if isVsiPath(myfile):
+            relName = splitVsiZip(myfile)[1]
         mdate = os.path.basename(myfile).split("_")[0]
         sdate = os.path.basename(myfile).split("_")[1]
 
         # Catch the case of S1TBX names
         if not len(mdate)==15 and not len(mdate)==8:
             logging.debug("mdate is not a date or date time {}; reparsing".format(mdate))
-            mdate = os.path.basename(myfile.split("_")[5])
-            sdate = myfile.split("_")[6]
+            mdate = os.path.basename(relName.split("_")[5])
+            sdate = relName.split("_")[6]
             
         pFile = os.path.basename(myfile)
 	if not old_coh:
             cFile = os.path.basename(myfile.replace(ext,"_corr.tif"))
         else:
             cFile = os.path.basename(myfile.replace(ext,"_coh.tif"))
-        txtFile = glob.glob("{}/*20*_20*.txt".format(os.path.dirname(myfile)))[0]
-        baseline = getParameter(txtFile,"Baseline")
+        if isVsiPath(myfile):
+            # Rasters in zips are read in place by their full path
+            pFile = myfile
+            cFile = os.path.join(os.path.dirname(myfile),cFile)
+            zipFile = splitVsiZip(myfile)[0]
+            txtFile = vsiZipGlob("*20*_20*.txt",zipFile)[0]
+        else:
+            txtFile = glob.glob("{}/*20*_20*.txt".format(os.path.dirname(myfile)))[0]
+        baseline = getHypParameter(txtFile,"Baseline")
         f.write("{} {} {} {} {}\n".format(mdate,sdate,pFile,cFile,baseline))
 
     # Older zipfiles don't unzip into their own directory!
@@ -132,7 +205,7 @@ def prepareHypFiles(path,hyp):
         pFile = myfile
         cFile = myfile.replace(ext,"_corr.tif")
         txtFile = myfile.replace(ext,".txt")
-        baseline = getParameter(txtFile,"Baseline")
+        baseline = getHypParameter(txtFile,"Baseline")
         f.write("{} {} {} {} {}\n".format(mdate,sdate,pFile,cFile,baseline))
 
     f.close()
@@ -186,51 +259,238 @@ def getFileList(descFile):
 
     return(params)
 
-def resizeFiles(params):
-    x,y,trans,proj = saa.read_gdal_file_geo(saa.open_gdal_file(params['pFile'][0]))
-    if x>4096 or y>4096:
+# Largest width or height of the files given to GIAnT
+MAX_SIZE = 4096
+
+def makeSrs(wkt=None):
+    """Return the projection wkt, or lon/lat, in x/y axis order"""
+    srs = osr.SpatialReference()
+    if wkt is None:
+        srs.ImportFromEPSG(4326)
+    else:
+        srs.ImportFromWkt(wkt)
+    if hasattr(srs,'SetAxisMappingStrategy'):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+def onGrid(myfile,srs,trans):
+    """Return True if myfile has projection srs and the pixels of geotransform trans"""
+    x,y,ftrans,proj = read_geo(myfile)
+    if not makeSrs(proj).IsSame(srs):
+        return False
+    eps = 1e-6
+    for i,res in [(0,trans[1]),(3,trans[5])]:
+        offset = (ftrans[i]-trans[i])/res
+        if abs(ftrans[i+1]-trans[i+1]) > eps*abs(res) or abs(offset-round(offset)) > eps:
+            return False
+    return True
+
+def projectBox(box,srs,dstSrs):
+    """Return the [ulx, uly, lrx, lry] box holding box, in projection srs,
+    in projection dstSrs"""
+    if srs.IsSame(dstSrs):
+        return list(box)
+    trans = osr.CoordinateTransformation(srs,dstSrs)
+    xs = []
+    ys = []
+    for x,y in [(box[0],box[1]),(box[2],box[1]),(box[0],box[3]),(box[2],box[3])]:
+        x,y = trans.TransformPoint(x,y)[:2]
+        xs.append(x)
+        ys.append(y)
+    return [min(xs),max(ys),max(xs),min(ys)]
+
+def fileBox(myfile,dstSrs):
+    """Return the [ulx, uly, lrx, lry] box of a raster in projection dstSrs"""
+    x,y,trans,proj = read_geo(myfile)
+    box = [trans[0],trans[3],trans[0]+x*trans[1],trans[3]+y*trans[5]]
+    return projectBox(box,makeSrs(proj),dstSrs)
+
+def targetGrid(params,datadir,bbox=None,native=False):
+    """Work out the grid every file is warped to: the common overlap of the
+    files, limited to bbox (min lat, max lat, min lon, max lon) if given,
+    on the pixels of the first file, shrunk to fit in MAX_SIZE pixels.  The
+    grid is in lon/lat, or with native in the projection of the first file,
+    so that a stack sharing one projected grid isn't resampled."""
+    first = dataPath(datadir,params['pFile'][0])
+    x,y,trans,proj = read_geo(first)
+    lonlat = makeSrs()
+    if native and "PROJCS" in proj:
+        dstSrs = makeSrs(proj)
+    else:
+        dstSrs = lonlat
+        # The pixels gdal.Warp picks for the first file in lon/lat
+        vrt = gdal.Warp("",first,format="VRT",dstSRS="EPSG:4326")
+        trans = vrt.GetGeoTransform()
+        vrt = None
+
+    files = params['pFile']+params['cFile']
+    boxes = [fileBox(dataPath(datadir,myfile),dstSrs) for myfile in files]
+    west,north,east,south = Footprints(boxes).common_overlap()
+    if west >= east or south >= north:
+        logging.error("ERROR: The input files have no common overlap")
+        exit(1)
+    if bbox is not None:
+        aoi = projectBox([bbox[2],bbox[1],bbox[3],bbox[0]],lonlat,dstSrs)
+        west = max(west,aoi[0])
+        north = min(north,aoi[1])
+        east = min(east,aoi[2])
+        south = max(south,aoi[3])
+        if west >= east or south >= north:
+            logging.error("ERROR: The bounding box {} is outside the input files".format(bbox))
+            exit(1)
+
+    # Snap the overlap to the pixels of the first file
+    xres = trans[1]
+    yres = -trans[5]
+    eps = 1e-6
+    west = trans[0] + math.ceil((west-trans[0])/xres - eps)*xres
+    east = trans[0] + math.floor((east-trans[0])/xres + eps)*xres
+    north = trans[3] - math.ceil((trans[3]-north)/yres - eps)*yres
+    south = trans[3] - math.floor((trans[3]-south)/yres + eps)*yres
+    width = int(round((east-west)/xres))
+    height = int(round((north-south)/yres))
+
+    resample = "near"
+    if width > MAX_SIZE or height > MAX_SIZE:
+        scale = float(MAX_SIZE)/max(width,height)
+        width = max(1,int(round(width*scale)))
+        height = max(1,int(round(height*scale)))
+        resample = "cubic"
+
+    if native:
+        for myfile in files:
+            if not onGrid(dataPath(datadir,myfile),dstSrs,trans):
+                logging.info("    file {} is not on the grid of the stack; it will be resampled".format(myfile))
+
+    grid = {'srs': dstSrs.ExportToWkt(), 'bounds': [west,south,east,north], 'width': width,
+            'height': height, 'resample': resample}
+    logging.info("Target grid is {}".format(grid))
+    return grid
+
+def dataPath(datadir,myfile):
+    """Return the path of a file named relative to the DATA directory"""
+    if isVsiPath(myfile) or os.path.isabs(myfile):
+        return myfile
+    return os.path.join(datadir,myfile)
+
+def runPairs(func,jobs,workers=None):
+    """Run func on each job over a pool of workers processes (default one
+    per CPU) and return the results"""
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(workers,len(jobs))
+    if workers < 2:
+        return [func(job) for job in jobs]
+    pool = multiprocessing.Pool(workers)
+    try:
+        return pool.map(func,jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+def warpFile(args):
+    datadir,inFile,outName,grid = args
+    logging.info("    processing file {} to create file {}".format(inFile,outName))
+    gdal.Warp(os.path.join(datadir,outName),dataPath(datadir,inFile),format="ENVI",
+              dstSRS=grid['srs'],outputBounds=grid['bounds'],width=grid['width'],
+              height=grid['height'],resampleAlg=grid['resample'])
+    return outName
+
+def warpFiles(params,datadir,bbox=None,native=False,workers=None):
+    """Warp each phase and coherence file in one pass to the ENVI raw file,
+    under the name GIAnT reads, on a grid common to all the files.  Does
+    the work of reprojectFiles, cutFiles, resizeFiles, toRaw and renameFiles."""
+    grid = targetGrid(params,datadir,bbox,native)
+    jobs = []
+    written = set()
+    for i in range(len(params['mdate'])):
+        for key,suffix in [('pFile','unw_phase'),('cFile','corr')]:
+            outName = "{}_{}_{}.raw".format(params['mdate'][i][0:8],params['sdate'][i][0:8],suffix)
+            if outName not in written:
+                jobs.append((datadir,params[key][i],outName,grid))
+                written.add(outName)
+            elif key == 'pFile':
+                logging.warning("WARNING: You may have two different interferograms with the same dates")
+                logging.warning("WARNING: Only one inteferogram per date pair is allowed")
+                logging.warning("WARNING: Try using the --group switch to process your files as groups")
+            else:
+                logging.info("File exists; skipping")
+            params[key][i] = outName
+    runPairs(warpFile,jobs,workers)
+
+def resizePair(args):
+    datadir,pFile,cFile,width,height = args
+    newFiles = []
+    for myfile in [pFile,cFile]:
+        outFile = myfile.replace(".tif","_resize.tif")
+        logging.info("    processing file {} to create file {}".format(myfile,outFile))
+        gdal.Translate(os.path.join(datadir,outFile),dataPath(datadir,myfile),resampleAlg=GRIORA_Cubic,
+                       width=width,height=height)
+        newFiles.append(outFile)
+    return newFiles
+
+def resizeFiles(params,datadir,workers=None):
+    x,y,trans,proj = read_geo(dataPath(datadir,params['pFile'][0]))
+    if x>MAX_SIZE or y>MAX_SIZE:
         if x > y:
-            width = 4096
+            width = MAX_SIZE
             height = 0
         else:
             width = 0
-            height = 4096
+            height = MAX_SIZE
  
-        for i in range(len(params['mdate'])):
-            outFile = params['pFile'][i].replace(".tif","_resize.tif")
-            logging.info("    processing file {} to create file {}".format(params['pFile'][i],outFile))
-            gdal.Translate(outFile,params['pFile'][i],resampleAlg=GRIORA_Cubic,width=width,height=height)
-            params['pFile'][i] = outFile
-
-            outFile = params['cFile'][i].replace(".tif","_resize.tif")
-            logging.info("    processing file {} to create file {}".format(params['cFile'][i],outFile))
-            gdal.Translate(outFile,params['cFile'][i],resampleAlg=GRIORA_Cubic,width=width,height=height)
-            params['cFile'][i] = outFile
+        jobs = [(datadir,params['pFile'][i],params['cFile'][i],width,height) for i in range(len(params['mdate']))]
+        for i,newFiles in enumerate(runPairs(resizePair,jobs,workers)):
+            params['pFile'][i],params['cFile'][i] = newFiles
+
+def reprojectPair(args):
+    datadir,pFile,cFile,bbox = args
+    x,y,trans,proj = read_geo(dataPath(datadir,pFile))
+    newFiles = []
+    for myfile in [pFile,cFile]:
+        if "PROJCS" in proj:
+            outFile = os.path.basename(myfile).replace(".tif","_wgs84.tif")
+            logging.info("    processing file {} to create file {}".format(myfile,outFile))
+            if bbox is not None:
+                gdal.Warp(os.path.join(datadir,outFile),dataPath(datadir,myfile),dstSRS="EPSG:4326",
+                          outputBounds=[bbox[2],bbox[0],bbox[3],bbox[1]])
+            else:
+                gdal.Warp(os.path.join(datadir,outFile),dataPath(datadir,myfile),dstSRS="EPSG:4326")
+        elif bbox is not None:
+            outFile = os.path.basename(myfile).replace(".tif","_aoi.tif")
+            logging.info("    processing file {} to create file {}".format(myfile,outFile))
+            gdal.Translate(os.path.join(datadir,outFile),dataPath(datadir,myfile),
+                           projWin=[bbox[2],bbox[1],bbox[3],bbox[0]])
+        elif isVsiPath(myfile):
+            # The following steps work on local files
+            outFile = os.path.basename(myfile)
+            logging.info("    processing file {} to create file {}".format(myfile,outFile))
+            gdal.Translate(os.path.join(datadir,outFile),myfile)
+        else:
+            outFile = myfile
+        newFiles.append(outFile)
+    return newFiles
 
+def reprojectFiles(params,datadir,bbox=None,workers=None):
+    """Reproject the files to lon/lat, only keeping what is inside bbox
+    (min lat, max lat, min lon, max lon) if it is given"""
+    jobs = [(datadir,params['pFile'][i],params['cFile'][i],bbox) for i in range(len(params['mdate']))]
+    for i,newFiles in enumerate(runPairs(reprojectPair,jobs,workers)):
+        params['pFile'][i],params['cFile'][i] = newFiles
 
-def reprojectFiles(params):
-    os.chdir("DATA") 
-    for i in range(len(params['mdate'])):
-        x,y,trans,proj = saa.read_gdal_file_geo(saa.open_gdal_file(params['pFile'][i]))
-        if "PROJCS" in proj:
-            outFile = params['pFile'][i].replace(".tif","_wgs84.tif")
-            logging.info("    processing file {} to create file {}".format(params['pFile'][i],outFile))
-            gdal.Warp(outFile,params['pFile'][i],dstSRS="EPSG:4326")
-            params['pFile'][i] = outFile
-            outFile = params['cFile'][i].replace(".tif","_wgs84.tif")
-            logging.info("    processing file {} to create file {}".format(params['cFile'][i],outFile))
-            gdal.Warp(outFile,params['cFile'][i],dstSRS="EPSG:4326")
-            params['cFile'][i] = outFile
-    os.chdir("..")
 
+def rasterExists(myfile):
+    if isVsiPath(myfile):
+        return gdal.VSIStatL(myfile) is not None
+    return os.path.isfile(myfile)
 
 def checkFileExistence(params):
     os.chdir("DATA")
     for i in range(len(params['mdate'])):
-        if not os.path.isfile(params['pFile'][i]):
+        if not rasterExists(params['pFile'][i]):
             logging.error("ERROR: Unable to find phase file {}".format(params['pFile'][i]))
             exit(1)
-        if not os.path.isfile(params['cFile'][i]):
+        if not rasterExists(params['cFile'][i]):
             logging.error("ERROR: Unable to find coherence file {}".format(params['cFile'][i]))
             exit(1)
     os.chdir("..")
@@ -332,17 +592,17 @@ def renameFiles(params):
     os.chdir("DATA")
     for i in range(len(params['mdate'])):
         outName = "{}_{}_unw_phase.raw".format(params['mdate'][i][0:8],params['sdate'][i][0:8])
-        logging.debug("Copying file {} to {}".format(params['pFile'][i],outName))
+        logging.debug("Staging file {} as {}".format(params['pFile'][i],outName))
         if not os.path.exists(outName):
-            shutil.copy(params['pFile'][i],outName)
+            stage_file(params['pFile'][i],outName)
         else:
             logging.warning("WARNING: You may have two different interferograms with the same dates")
             logging.warning("WARNING: Only one inteferogram per date pair is allowed")
             logging.warning("WARNING: Try using the --group switch to process your files as groups")
         outName = "{}_{}_corr.raw".format(params['mdate'][i][0:8],params['sdate'][i][0:8])
-        logging.debug("Copying file {} to {}".format(params['cFile'][i],outName))
+        logging.debug("Staging file {} as {}".format(params['cFile'][i],outName))
         if not os.path.exists(outName):
-            shutil.copy(params['cFile'][i],outName)
+            stage_file(params['cFile'][i],outName)
         else:  
             logging.info("File exists; skipping")
     os.chdir("..")
@@ -364,7 +624,8 @@ def fixPrepBasXml(params,templateDir):
     g.close()
     f.close()
 
-def toRaw(myfile):
+def toRaw(args):
+    datadir,myfile = args
     rawname = myfile
     if "wgs84" in rawname:
         rawname = rawname.replace("_wgs84","")
@@ -372,9 +633,11 @@ def toRaw(myfile):
         rawname = rawname.replace("_resize","")
     if "clip" in rawname:
         rawname = rawname.replace("_clip","")
+    if "aoi" in rawname:
+        rawname = rawname.replace("_aoi","")
     rawname = rawname.replace(".tif",".raw")
     logging.info("    processing file {} to create file {}".format(myfile,rawname))
-    gdal.Translate(rawname,myfile,format="ENVI")
+    gdal.Translate(os.path.join(datadir,rawname),dataPath(datadir,myfile),format="ENVI")
     return rawname
 
 def makeGeotiffFiles(h5File,dataName,params):
@@ -387,7 +650,7 @@ def makeGeotiffFiles(h5File,dataName,params):
  
     # Read a reference file for geolocation and size information
     os.chdir("../DATA")    
-    x,y,trans,proj = saa.read_gdal_file_geo(saa.open_gdal_file(params['pFile'][0]))
+    x,y,trans,proj = read_geo(params['pFile'][0])
     os.chdir("../Stack")
     
     # Get the entire date range
@@ -439,12 +702,12 @@ def prepareFilesForTrain(params):
     for i in range(len(params['pFile'])):
         myfile = params['pFile'][i]
         newfile = "{}_{}_unw_phase.tif".format(params['mdate'][i],params['sdate'][i])
-        shutil.copy("{}".format(os.path.join(os.pardir,myfile)),newfile)
+        stage_file(os.path.join(os.pardir,myfile),newfile)
 
-def fixFileNamesTrain(params):
+def fixFileNamesTrain(params,datadir):
     for i in range(len(params['pFile'])):
         newfile = "{}/{}_{}_unw_phase_corrected.tif".format("TRAIN",params['mdate'][i][0:8],params['sdate'][i][0:8])
-        if os.path.isfile(newfile):
+        if os.path.isfile(os.path.join(datadir,newfile)):
             params['pFile'][i] = newfile
         else:
             logging.warning("***********************************************************************************")
@@ -453,11 +716,16 @@ def fixFileNamesTrain(params):
 
 def procS1StackGIANT(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,filt=0.1,
                      path=None,utcTime=None,heading=None,leave=False,train=False,hyp=None,
-                     rawFlag=False,mm=None,errorFlag=False):
+                     rawFlag=False,mm=None,errorFlag=False,vsizip=False,bbox=None,native=False,
+                     workers=None):
 
     logging.info("***********************************************************************************")
     logging.info("                 STARTING RUN {}".format(output))
     logging.info("***********************************************************************************")
+
+    # Open the product catalog in the run directory before changing directory
+    catalog()
+
     logging.info("Type of run is {}".format(type))
 
     if path is not None:
@@ -474,7 +742,7 @@ def procS1StackGIANT(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,f
     logging.debug("Looking for templates in %s" % templateDir)
 
     if type == 'hyp':
-        descFile,hypDir = prepareHypFiles(path,hyp)
+        descFile,hypDir = prepareHypFiles(path,hyp,vsizip=vsizip)
     elif type == 'custom':
         if train:
             logging.warning("***********************************************************************************")
@@ -492,7 +760,7 @@ def procS1StackGIANT(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,f
             logging.error("ERROR: Must specify a heading when using custom option")
             exit(1)
     elif type == 'aria':
-        descFile,utcTime = prepGIAnT(intdir=path)
+        descFile,utcTime = prepGIAnT(bbox=bbox,intdir=path,workers=workers)
         heading = 12.0
     else:
         logging.error("ERROR: Unknown processing type {}".format(type))
@@ -511,15 +779,15 @@ def procS1StackGIANT(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,f
 
     if utcTime is None:
         os.chdir(hypDir)
-        txtFile = glob.glob("*/*20*_20*.txt")[0]
-        utcTime = getParameter(txtFile,"UTCtime")
+        txtFile = hypFiles("*20*_20*.txt")[0]
+        utcTime = getHypParameter(txtFile,"UTCtime")
         os.chdir("..")
     params['utctime'] = utcTime
 
     if heading is None:
         os.chdir(hypDir)
-        txtFile = glob.glob("*/*20*_20*.txt")[0]
-        heading = getParameter(txtFile,"Heading")
+        txtFile = hypFiles("*20*_20*.txt")[0]
+        heading = getHypParameter(txtFile,"Heading")
         os.chdir("..")
     params['heading'] = heading
 
@@ -533,59 +801,67 @@ def procS1StackGIANT(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,f
     checkFileExistence(params) 
     root = os.getcwd()
 
-    logging.info("Reprojecting files...")
-    reprojectFiles(params)
+    # TRAIN reads the intermediate GeoTIFFs, and ARIA files are already
+    # cropped to a common grid by prepGIAnT
+    fused = type != 'aria' and not train
+    if native and train:
+        logging.warning("WARNING: TRAIN corrections need lon/lat files; ignoring --native")
+    datadir = os.path.abspath("DATA")
+    if fused:
+        logging.info("Warping files to a common grid...")
+        warpFiles(params,datadir,bbox,native,workers)
+    else:
+        logging.info("Reprojecting files...")
+        # prepGIAnT has already cut ARIA files to the bounding box
+        reprojectFiles(params,datadir,bbox if type != 'aria' else None,workers)
 
-    logging.info("Cutting files...")
-    os.chdir("DATA")
-    if type != 'aria':
-        cutFiles(params['pFile'])
-        cutFiles(params['cFile'])
+        logging.info("Cutting files...")
+        os.chdir("DATA")
+        if type != 'aria':
+            cutFiles(params['pFile'])
+            cutFiles(params['cFile'])
 
-        for i in range(len(params['mdate'])):
-            params['pFile'][i] = params['pFile'][i].replace(".tif","_clip.tif")
-            params['cFile'][i] = params['cFile'][i].replace(".tif","_clip.tif")
+            for i in range(len(params['mdate'])):
+                params['pFile'][i] = params['pFile'][i].replace(".tif","_clip.tif")
+                params['cFile'][i] = params['cFile'][i].replace(".tif","_clip.tif")
+        os.chdir(root)
 
-    logging.info("Resizing files...")
-    resizeFiles(params)
+        logging.info("Resizing files...")
+        resizeFiles(params,datadir,workers)
 
-    if train:
-        logging.info("***********************************************************************************")
-        logging.info("          PREPARING TO RUN THE TRAIN MERRA2 WEATHER MODEL")
-        logging.info("***********************************************************************************")
-        createCleanDir("TRAIN")
-        os.chdir("TRAIN")
-        makeParmsAPS(params,root)
-        prepareFilesForTrain(params)
-        myfile = os.path.join(os.pardir,params['pFile'][0])
-        aps_weather_model("merra2",1,4,myfile)
-        os.chdir("..")
-        fixFileNamesTrain(params) 
+        if train:
+            logging.info("***********************************************************************************")
+            logging.info("          PREPARING TO RUN THE TRAIN MERRA2 WEATHER MODEL")
+            logging.info("***********************************************************************************")
+            createCleanDir(os.path.join(datadir,"TRAIN"))
+            os.chdir(os.path.join(datadir,"TRAIN"))
+            makeParmsAPS(params,root)
+            prepareFilesForTrain(params)
+            myfile = os.path.join(os.pardir,params['pFile'][0])
+            aps_weather_model("merra2",1,4,myfile)
+            os.chdir(root)
+            fixFileNamesTrain(params,datadir)
  
-    logging.info("Translating files to raw format...")
-    for i in range(len(params['pFile'])):
-        params['pFile'][i] = toRaw(params['pFile'][i])
-        params['cFile'][i] = toRaw(params['cFile'][i])
+        logging.info("Translating files to raw format...")
+        params['pFile'] = runPairs(toRaw,[(datadir,myfile) for myfile in params['pFile']],workers)
+        params['cFile'] = runPairs(toRaw,[(datadir,myfile) for myfile in params['cFile']],workers)
         
-    if not leave:
-        for myfile in glob.glob("*_wgs84.tif"):
-            os.remove(myfile)
-        for myfile in glob.glob("*_clip.tif"):
-            os.remove(myfile)
-        for myfile in glob.glob("*_resize.tif"):
-            os.remove(myfile)
+        if not leave:
+            for suffix in ["_wgs84.tif","_aoi.tif","_clip.tif","_resize.tif"]:
+                for myfile in glob.glob(os.path.join(datadir,"*"+suffix)):
+                    os.remove(myfile)
 
-    width,length,trans,proj = saa.read_gdal_file_geo(saa.open_gdal_file(params['pFile'][0]))
+    width,length,trans,proj = read_geo(dataPath(datadir,params['pFile'][0]))
     params['width'] = width
     params['length'] = length
-    os.chdir("..")
 
     createIfgList(params)
     createExampleRSC(params)
     fixPrepDataXml(params,templateDir)
     fixUserfnPy(params,templateDir)
     fixPrepBasXml(params,templateDir)
-    renameFiles(params)
+    if not fused:
+        renameFiles(params)
 
     execute("python prepdataxml.py",uselogging=True)
     execute("PrepIgramStack.py",uselogging=True)
@@ -715,7 +991,8 @@ def procS1StackGIANT(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,f
 
 def printParameters(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,filt=0.1,
                 path=None,utcTime=None,heading=None,leave=False,train=False,hyp=None,
-                zipFlag=False,group=False,rawFlag=False,mm=None,errorFlag=False,api_key=None):
+                zipFlag=False,group=False,rawFlag=False,mm=None,errorFlag=False,api_key=None,
+                vsizip=False,groupby="time",bbox=None,shape=None,native=False,workers=None):
 
     cmd = "procS1StackGIANT.py "
     
@@ -745,6 +1022,8 @@ def printParameters(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,fi
        cmd = cmd + "--zip "
     if group: 
        cmd = cmd + "--group "
+    if groupby != "time":
+       cmd = cmd + "--groupby {} ".format(groupby)
     if rawFlag:
        cmd = cmd + "--raw "
     if mm:
@@ -753,6 +1032,16 @@ def printParameters(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,fi
        cmd = cmd + "--error "
     if api_key:
        cmd = cmd + "--apikey {} ".format(api_key)
+    if vsizip:
+       cmd = cmd + "--vsizip "
+    if bbox:
+       cmd = cmd + "--bbox {} {} {} {} ".format(bbox[0],bbox[1],bbox[2],bbox[3])
+    if shape:
+       cmd = cmd + "--shape {} ".format(shape)
+    if native:
+       cmd = cmd + "--native "
+    if workers:
+       cmd = cmd + "--workers {} ".format(workers)
 
     cmd = cmd + "{} ".format(type)
     cmd = cmd + "{} ".format(output)
@@ -774,25 +1063,43 @@ def printParameters(type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,fi
     logging.info("    hyp name of subscription : {}".format(hyp))
     logging.info("    zip flag                 : {}".format(zipFlag))
     logging.info("    group flag               : {}".format(group))
+    logging.info("    group by                 : {}".format(groupby))
     logging.info("    raw time series flag     : {}".format(rawFlag))
     logging.info("    min/max scale range      : {}".format(mm))
     logging.info("    error estimation         : {}".format(errorFlag))
     logging.info("    name of api-key file     : {}".format(api_key))
+    logging.info("    read from zip files      : {}".format(vsizip))
+    logging.info("    bounding box             : {}".format(bbox))
+    logging.info("    shapefile name           : {}".format(shape))
+    logging.info("    native projection        : {}".format(native))
+    logging.info("    worker processes         : {}".format(workers))
     logging.info("\n")
 
 def procS1StackGroupsGIANT (type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=False,filt=0.1,
                      path=None,utcTime=None,heading=None,leave=False,train=False,hyp=None,
-                     zipFlag=False,group=False,rawFlag=False,mm=None,errorFlag=False,api_key=None):
+                     zipFlag=False,group=False,rawFlag=False,mm=None,errorFlag=False,api_key=None,
+                     vsizip=False,groupby="time",bbox=None,shape=None,native=False,
+                     workers=None):
 
     logging.info("***********************************************************************************")
     logging.info("                 STARTING RUN {}".format(output))
     logging.info("***********************************************************************************")
 
+    # Open the product catalog in the run directory before changing directory
+    catalog()
+
     printParameters(type,output,descFile=descFile,rxy=rxy,nvalid=nvalid,nsbas=nsbas,filt=filt,
                 path=path,utcTime=utcTime,heading=heading,leave=leave,train=train,hyp=hyp,
                 zipFlag=zipFlag,group=group,rawFlag=rawFlag,mm=mm,errorFlag=errorFlag,
-                api_key=api_key)
+                api_key=api_key,vsizip=vsizip,groupby=groupby,bbox=bbox,shape=shape,
+                native=native,workers=workers)
+
+    # Only the area of interest is read from each file
+    if shape:
+        bbox = shape_bbox(shape)
+        logging.info("Using bounding box {} of shapefile {}".format(bbox,shape))
 
+    pipeline_failures = []
     if hyp:
         logging.info("Using Hyp3 subscription named {} to download input files".format(hyp))
         if api_key is not None:
@@ -805,12 +1112,25 @@ def procS1StackGroupsGIANT (type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=
             username,password = getUsernamePassword()
             api = API(username)
             api.login(password=password)
-        download_products(api,sub_name=hyp)
+        store = default_store()
+        if vsizip:
+            download_products(api,sub_name=hyp,members='insar',store=store,aoi=bbox)
+        else:
+            # Unzip and read each product as soon as it has downloaded
+            pipeline = ProductPipeline("hyp3-products-unzipped",store=store,process=readHypParameters,
+                                       filetype='insar')
+            download_products(api,sub_name=hyp,on_product=pipeline.submit,members='insar',
+                              store=store,aoi=bbox)
+            pipeline_failures = pipeline.close()
         zipFlag = True
         path = "hyp3-products"
 
-    if zipFlag:
-        unzipFiles(path,"hyp3-products-unzipped")
+    if zipFlag and not vsizip:
+        # The products the download pipeline failed on stay out of the stack
+        failures = unzipFiles(path,"hyp3-products-unzipped",store=default_store(),
+                              workers=workers or multiprocessing.cpu_count(),filetype='insar',
+                              exclude=[myfile for myfile,err in pipeline_failures])
+        checkUnzipped(path,pipeline_failures + failures)
         zipFlag = False
         path = "hyp3-products-unzipped"
 
@@ -832,12 +1152,17 @@ def procS1StackGroupsGIANT (type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=
         for myfile in os.listdir(path):
             if os.path.isdir(os.path.join(path,myfile)):
                 filelist.append(myfile)
+            elif vsizip and myfile.endswith(".zip"):
+                filelist.append(myfile)
 
         if len(filelist)==0:
             logging.error("ERROR: Unable to find files to process")
             exit(1)
 
-        classes, filelists = sortByTime(path,filelist,"insar")
+        if groupby == "footprint":
+            classes, filelists = sortByFootprint(path,filelist,"insar")
+        else:
+            classes, filelists = sortByTime(path,filelist,"insar")
         for i in range(len(classes)):
             if len(filelists[i])>2:
                 mydir = "DATA_{}".format(classes[i])
@@ -851,12 +1176,14 @@ def procS1StackGroupsGIANT (type,output,descFile=None,rxy=None,nvalid=0.8,nsbas=
                 outfile = output + "_" + classes[i]
                 procS1StackGIANT(type,outfile,descFile=descFile,rxy=rxy,nvalid=nvalid,
                      nsbas=nsbas,filt=filt, path=mydir,utcTime=utcTime,heading=heading,
-                     leave=leave,train=train,hyp=hyp,rawFlag=rawFlag,mm=mm,errorFlag=errorFlag)
+                     leave=leave,train=train,hyp=hyp,rawFlag=rawFlag,mm=mm,errorFlag=errorFlag,
+                     vsizip=vsizip,bbox=bbox,native=native,workers=workers)
                 shutil.rmtree(mydir)
     else:
         procS1StackGIANT(type,output,descFile=descFile,rxy=rxy,nvalid=nvalid,nsbas=nsbas,
              filt=filt,path=path,utcTime=utcTime,heading=heading,leave=leave,train=train,
-             hyp=hyp,rawFlag=rawFlag,mm=mm,errorFlag=errorFlag)
+             hyp=hyp,rawFlag=rawFlag,mm=mm,errorFlag=errorFlag,vsizip=vsizip,bbox=bbox,
+             native=native,workers=workers)
 
     if not leave:
         if group:
@@ -876,6 +1203,8 @@ if __name__ == '__main__':
   parser.add_argument("-d","--desc",help='Name of descriptor file')
   parser.add_argument("-f","--filter",type=float,default=0.1,help='Filter length in years (Default=0.1)')
   parser.add_argument("-g","--group",action="store_true",help="Group files by time before processing")
+  parser.add_argument("--groupby",choices=['time','footprint'],default='time',
+      help="Group files by time of day or by overlapping footprints (Default=time)")
   parser.add_argument("-i","--input",help="Name of the Hyp3 subscription to download for input files")
   parser.add_argument("-l","--leave",action="store_true",help="Leave intermediate files in place")
   parser.add_argument("-m","--minmax",type=float,nargs=2,help='Minium and maximum scale for animations',metavar=('MIN', 'MAX'))
@@ -885,10 +1214,20 @@ if __name__ == '__main__':
   parser.add_argument("-s","--heading",type=float,help='Spacecraft heading at time of acquisitions')
   parser.add_argument("-t","--train",action="store_true",help="Run TRAIN weather model correction prior to time series inversion")
   parser.add_argument("-u","--utc",type=float,help='UTC time of image stack')
+  parser.add_argument("-j","--workers",type=int,default=multiprocessing.cpu_count(),
+      help="Number of files to prepare at once (Default={})".format(multiprocessing.cpu_count()))
+  parser.add_argument("-k","--native",action="store_true",
+      help="Keep the projection of the input files instead of reprojecting to lon/lat; only files off the stack's grid are resampled")
+  parser.add_argument("-y","--vsizip",action='store_true',help="Read the hyp3 zip files in place instead of unzipping them")
   parser.add_argument("-v","--nvalid",type=float,default=0.8,
       help='Fraction of samples that must be valid for a point to be included for NSBAS inversion.  (Default=0.8)')
   parser.add_argument("-z","--zip",action='store_true',help="Start from hyp3 zip files instead of directories")
 
+  group = parser.add_mutually_exclusive_group()
+  group.add_argument("-b","--bbox",type=float,nargs=4,metavar=('minLat','maxLat','minLon','maxLon'),
+      help="Only process the area inside this bounding box")
+  group.add_argument("-c","--shape",metavar="shapefile",help="Only process the area inside the bounding box of this shapefile")
+
   group = parser.add_mutually_exclusive_group()
   group.add_argument("-e","--error",action="store_true",help="Create animation and geotiffs of error estimates")
   group.add_argument("-w","--raw",action="store_true",help='Create animation and geotiffs of raw time series')
@@ -903,5 +1242,6 @@ if __name__ == '__main__':
   procS1StackGroupsGIANT(args.type,args.output,descFile=args.desc,rxy=args.rxy,nvalid=args.nvalid,nsbas=args.nsbas,
                    filt=args.filter,path=args.path,utcTime=args.utc,heading=args.heading,leave=args.leave,
                    train=args.train,hyp=args.input,zipFlag=args.zip,group=args.group,rawFlag=args.raw,mm=args.minmax,
-                   errorFlag=args.error,api_key=args.apikey)
+                   errorFlag=args.error,api_key=args.apikey,vsizip=args.vsizip,groupby=args.groupby,
+                   bbox=args.bbox,shape=args.shape,native=args.native,workers=args.workers)
 
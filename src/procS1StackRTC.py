@@ -33,13 +33,14 @@ import argparse
 import zipfile
 import shutil
 import glob
+import multiprocessing
 from osgeo import gdal
 import ogr
 from execute import execute
 import saa_func_lib as saa
 import numpy as np
 from cutGeotiffsByLine import cutGeotiffsByLine
-from sortByTime import sortByTime
+from sortByTime import sortByTime, sortByFootprint
 from download_products import download_products
 from getUsernamePassword import getUsernamePassword
 from subset_geotiff_shape import subset_geotiff_shape
@@ -47,9 +48,18 @@ from enh_lee_filter import enh_lee
 from asf_hyp3 import API
 from os.path import expanduser
 import logging
-from time_series_utils import createCleanDir 
-from unzipFiles import unzipFiles 
+from time_series_utils import createCleanDir, isVsiPath
+from zip_index import vsiZipGlob
+from unzipFiles import unzipFiles, checkUnzipped
 import boto3
+from product_pipeline import ProductPipeline
+from product_store import default_store
+from product_filter import shape_bbox
+from product_catalog import catalog
+from raster_cache import open_raster, read_geo
+from footprints import Footprints
+from staging import stage_tree
+from rtc_stack import getDates, getAscDesc, cull_stack_by_direction, clipCandidates
 
 def apply_speckle_filter(fi):
 
@@ -92,15 +102,16 @@ def amp2pwr(fi):
 
 def byteScale(fi,lower,upper):
     outfile = fi.replace('.tif','%s_%s.tif' % (int(lower),int(upper)))
-    gdal.Translate(outfile,fi,outputType=gdal.GDT_Byte,scaleParams=[[lower,upper]],noData=0)
+    dst = gdal.Translate(outfile,fi,outputType=gdal.GDT_Byte,scaleParams=[[lower,upper]],noData=0)
     
     # Once again, I'm getting zeros in my files eventhough I have set 
     # the output range to 1,255!  The following will fix the issue.
-    (x,y,trans,proj,data) = saa.read_gdal_file(saa.open_gdal_file(fi))
+    (x,y,trans,proj,data) = saa.read_gdal_file(open_raster(fi))
     mask = np.isinf(data)
     data[mask==True]=0
     mask = (data<0).astype(bool)
-    (x,y,trans,proj,data) = saa.read_gdal_file(saa.open_gdal_file(outfile))
+    (x,y,trans,proj,data) = saa.read_gdal_file(dst)
+    dst = None
     mask2 = (data>0).astype(bool)
     saa.write_gdal_file_byte("mask2.tif",trans,proj,mask.astype(np.byte),nodata=0) 
     mask3 = mask ^ mask2
@@ -110,7 +121,7 @@ def byteScale(fi,lower,upper):
     return(outfile)
 
 def get2sigmacutoffs(fi):
-    (x,y,trans,proj,data) = saa.read_gdal_file(saa.open_gdal_file(fi))
+    (x,y,trans,proj,data) = saa.read_gdal_file(open_raster(fi))
     top = np.percentile(data,98)
     data[data>top]=top
     stddev = np.std(data)
@@ -142,48 +153,6 @@ def cut(pt1,pt2,pt3,pt4,fi,thresh=0.4,aws=None):
 # anno_s1b-iw-rtcm-vv-S1B_IW_GRDH_1SDV_20180118T031947_20180118T032012_009220_01084D_97C9_clipped_dB-40_0.png
 #
 
-def getDates(filelist,dates=None):
-    if dates:
-         logging.info("Reading image names and dates from file {}".format(dates))
-         f = open("../{}".format(dates),"r")
-         new_dates = []
-         names = []
-         for line in f:
-             t = line.split()
-             if t[0] != "/":
-                    t[0] = os.path.join("{}/../".format(os.getcwd()),t[0])
-             names.append(t[0])
-             new_dates.append(t[1])
-         logging.info("Names: {}".format(names))
-         logging.info("Dates: {}".format(new_dates))
-    
-    else:
-        new_dates = []
-        names = []
-        for myfile in filelist:
-            myfile = os.path.basename(myfile)
-            logging.debug("Getting date for file {}".format(myfile))
-            try:
-                if "IW_RT" in myfile:
-                    s = myfile.split("_")[3]
-                    new_dates.append(s) 
-                    names.append(myfile) 
-                else:
-                    s = myfile.split("-")[4]
-                    if len(s) <= 26:
-                        t = s.split("_")[0]
-                        new_dates.append(t)
-                    else:       
-                        t = s.split("_")[4]
-                        new_dates.append(t)
-                    names.append(myfile) 
-            except:
-                names.append(myfile)
-                new_dates.append("UNKNOWN")
-                logging.warning("Unable to determine date for file {}".format(myfile))
-
-    return(names,new_dates)
-
 def report_stats(myfile,tmpfile,frac):
     msg = "{} : {} : ".format(myfile,frac)
     if tmpfile is None:
@@ -205,15 +174,29 @@ def changeResStack(filelist,res):
         filelist[i] = changeRes(res,filelist[i]) 
     return filelist
 
-def read_tif_header(fi):
-    x,y,trans,proj = saa.read_gdal_file_geo(saa.open_gdal_file(fi))
+def tif_header(fi):
+    x,y,trans,proj = read_geo(fi)
     lat_max = trans[3]
     lat_min = trans[3] + y*trans[5]
     lon_min = trans[0]
     lon_max = trans[0] + x*trans[1]
     coords = [lon_min,lat_max,lon_max,lat_min]
+    return [proj,list(trans),coords]
+
+def read_tif_header(fi):
+    proj,trans,coords = catalog().file_info(fi,"raster",tif_header)
     return(proj,trans,coords)
 
+def read_product_headers(prodDir):
+    # Catalog the product while the rest of the subscription downloads
+    name = os.path.basename(os.path.normpath(prodDir))
+    for pol in ["vv","VV","hh","HH"]:
+        for fi in glob.glob("{}/*{}*.tif".format(prodDir,pol)):
+            proj,trans,coords = read_tif_header(fi)
+            catalog().update(name,proj=proj,pixsize=trans[1],footprint=coords)
+    for myxml in glob.glob("{}/*.iso.xml".format(prodDir)):
+        catalog().update(name,direction=catalog().file_info(myxml,"direction",getAscDesc))
+
 def fix_lists(filelist,all_proj,all_pixsize,all_coords,item):
     proj,trans,coords = read_tif_header(filelist[item])
     all_proj[item] = proj
@@ -274,7 +257,14 @@ def cutStack(filelist,overlap,clip,shape,thresh,aws,all_proj,all_pixsize,all_coo
         logging.info("Statistics for clipping:")
         logging.info("file name : percent overlap : result")
         power_filelist = []
+        fracs = None
+        if aws is None:
+            fracs,candidates = clipCandidates(all_coords,clip,thresh)
         for i in range(len(filelist)):
+            if fracs is not None and not candidates[i]:
+                logging.info("    Image fraction ({}) less than threshold of {} discarding".format(fracs[i],thresh))
+                report_stats(filelist[i],None,fracs[i])
+                continue
             myfile,frac = cut(pt1,pt2,pt3,pt4,filelist[i],thresh=thresh,aws=aws)
             report_stats(filelist[i],myfile,frac)
             if myfile is not None:
@@ -313,45 +303,15 @@ def findBestFit(filelist,clip,all_coords,all_proj,all_pixsize):
 
     logging.debug("got file list {}".format(filelist))
 
-    lon_min = clip[0]
-    lat_max = clip[1]
-    lon_max = clip[2]
-    lat_min = clip[3]
-    wkt1 = "POLYGON ((%s %s, %s %s, %s %s, %s %s, %s %s))" % (lat_min,lon_min,lat_max,lon_min,lat_max,lon_max,lat_min,lon_max,lat_min,lon_min)
-    poly0 = ogr.CreateGeometryFromWkt(wkt1)
-    total_area = poly0.GetArea()
-    logging.info("Bounding Box {}".format(poly0.ExportToWkt()))
-    logging.info("Total area is {}".format(total_area))
-
     # Find location of best overlap with bounding box
-    max_frac = 0.0
+    fracs = Footprints(all_coords).fractions(clip)
+    logging.info("Bounding Box {}".format(clip))
     for i in range(len(filelist)):
-        coords = all_coords[i]
-
-        lat_max1 = coords[1]
-        lat_min1 = coords[3]
-        lon_min1 = coords[0]
-        lon_max1 = coords[2]
-
-        wkt2 = "POLYGON ((%s %s, %s %s, %s %s, %s %s, %s %s))" % (lat_min1,lon_min1,lat_max1,lon_min1,lat_max1,lon_max1,lat_min1,lon_max1,lat_min1,lon_min1)
-
-        logging.info("{} Box {}".format(filelist[i],poly0.ExportToWkt()))
-        poly1 = ogr.CreateGeometryFromWkt(wkt2)
-        intersect1 = poly0.Intersection(poly1)
-      
-        logging.info("{} Int {}".format(filelist[i],intersect1.ExportToWkt()))
-        area1 = intersect1.GetArea()
-        logging.info("area1 is %s" % area1)
-    
-        frac = area1 / total_area
-        logging.info("Fraction is {}".format(frac))
-        if frac > max_frac:
-            max_frac = frac
-            max_file = filelist[i]
-    if max_frac == 0:
+        logging.info("{} Box {} Fraction {}".format(filelist[i],all_coords[i],fracs[i]))
+    loc = int(np.argmax(fracs))
+    if fracs[loc] == 0:
         logging.error("ERROR: None of the input scenes overlap with your area of interest!")
         exit(1)
-    loc = filelist.index(max_file)
     
     #
     # Make best overlap image the first in the list
@@ -375,46 +335,6 @@ def findBestFit(filelist,clip,all_coords,all_proj,all_pixsize):
     all_pixsize[loc] = tmp
         
 
-def getAscDesc(myxml):
-    with open(myxml) as f:
-        content = f.readlines()
-        for item in content:
-            if 'ascending' in item:
-                 return "a"
-            if 'descending' in item:
-                 return "d"
-
-def getXmlFiles(filelist,dates=None):
-    names,new_dates = getDates(filelist,dates)
-    logging.debug("Got dates {}".format(new_dates))
-    newlist = []
-    for date in new_dates:
-        mydir = glob.glob("*{}*-rtc-gamma".format(date))[0]
-        myfile = glob.glob("{}/*.iso.xml".format(mydir))[0]
-        logging.debug("looking for {}".format(myfile))
-        newlist.append(myfile)
-    return(new_dates,newlist)
- 
-def cull_list_by_direction(filelist,direction,dates=None):
-    new_dates,xmlFiles = getXmlFiles(filelist,dates=dates)
-    if len(xmlFiles)>0:
-        newlist = []
-        logging.debug("Got xmlfiles {}".format(xmlFiles))
-        for i in range(len(filelist)):
-            myfile = filelist[i]
-            logging.info("Checking file {} for flight direction".format(xmlFiles[i]))
-            ad = getAscDesc(xmlFiles[i])
-            logging.info("    Found adflag {}".format(ad))
-            if ad == direction:
-                logging.info("    Keeping")
-                newlist.append(myfile)
-            else:
-                logging.info("    Discarding")
-        return newlist 
-    else:
-        logging.warning("Unable to determine orbit direction; using all files")
-        return filelist
-
 def aws_ls(bucket_name):
     s3 = boto3.resource('s3')
     if "/" in bucket_name:
@@ -449,12 +369,15 @@ def filter_file_list(file_list,subdir,ext):
 
 def procS1StackRTC(outfile=None,infiles=None,path=None,res=None,filter=False,type='dB-byte',
     scale=[-40,0],clip=None,shape=None,overlap=False,zipFlag=False,leave=False,thresh=0.4,
-    font=24,keep=None,aws=None,inamp=False,exclude=False,datefile=None,delay=50):
+    font=24,keep=None,aws=None,inamp=False,exclude=False,datefile=None,delay=50,vsizip=False):
 
     logging.info("***********************************************************************************")
     logging.info("                 STARTING RUN {}".format(outfile))
     logging.info("***********************************************************************************")
 
+    # Open the product catalog in the run directory before changing directory
+    catalog()
+
     dates = None
 
     # Do some error checking and info printing
@@ -519,7 +442,13 @@ def procS1StackRTC(outfile=None,infiles=None,path=None,res=None,filter=False,typ
     	    infiles = None
     	    if zipFlag:
     		logging.info("No input files given, using hyp3 zip files from {}".format(path))
-    		unzipFiles(path,"TEMP")
+    		if vsizip:
+    		    # Read the rasters in place instead of unzipping them
+    		    for myfile in glob.glob("{}/*.zip".format(path)):
+    			os.symlink(os.path.abspath(myfile),os.path.join("TEMP",os.path.basename(myfile)))
+    		else:
+    		    failures = unzipFiles(path,"TEMP",workers=multiprocessing.cpu_count(),filetype='rtc')
+    		    checkUnzipped(path,failures)
     	    else:
     		logging.info("No input files given, using already unzipped hyp3 files in {}".format(path))
     		os.chdir("TEMP")
@@ -533,11 +462,11 @@ def procS1StackRTC(outfile=None,infiles=None,path=None,res=None,filter=False,typ
 
     	    # Now, get the actual list of files
     	    os.chdir("TEMP")
-    	    filelist = glob.glob("*/*vv*.tif")
-            filelist = filelist + glob.glob("*/*VV*.tif")
+    	    filelist = glob.glob("*/*vv*.tif") + vsiZipGlob("*vv*.tif")
+            filelist = filelist + glob.glob("*/*VV*.tif") + vsiZipGlob("*VV*.tif")
             if len(filelist) == 0:
-                filelist = glob.glob("*/*hh*.tif")
-                filelist = filelist + glob.glob("*/*HH*.tif")
+                filelist = glob.glob("*/*hh*.tif") + vsiZipGlob("*hh*.tif")
+                filelist = filelist + glob.glob("*/*HH*.tif") + vsiZipGlob("*HH*.tif")
 
     	    # Older zip files don't unzip into their own directories!
     	    filelist = filelist +  glob.glob("*vv*.tif")
@@ -573,7 +502,13 @@ def procS1StackRTC(outfile=None,infiles=None,path=None,res=None,filter=False,typ
     os.chdir("TEMP")
     if aws is None:
         for i in range(len(filelist)):
-            if "/" in filelist[i]:
+            if isVsiPath(filelist[i]):
+                # A small VRT under the raster's own name stands in for the
+                # file inside the zip, so later steps can name their outputs
+                # after it
+                gdal.Translate(os.path.basename(filelist[i]),filelist[i],format="VRT")
+                filelist[i] = os.path.basename(filelist[i])
+            elif "/" in filelist[i]:
                 os.symlink(filelist[i],os.path.basename(filelist[i]))
                 filelist[i] = os.path.basename(filelist[i])
             else:
@@ -584,7 +519,8 @@ def procS1StackRTC(outfile=None,infiles=None,path=None,res=None,filter=False,typ
     logging.info("{}".format(filelist))
 
     if keep is not None and aws is None:
-        filelist = cull_list_by_direction(filelist,keep)
+        filelist,all_proj,all_coords,all_pixsize = cull_stack_by_direction(filelist,keep,
+            all_proj,all_coords,all_pixsize)
         if len(filelist) == 0:
             logging.error("All files have been culled by direction ({})".format(keep))
             exit(1)
@@ -712,7 +648,8 @@ def procS1StackRTC(outfile=None,infiles=None,path=None,res=None,filter=False,typ
                 logging.info("    moving tree {} to {}".format(myfile,newDir))
                 if os.path.exists(newDir):
                     shutil.rmtree(newDir)
-                shutil.copytree(myfile,newDir)
+                # TEMP is removed below unless we are leaving it
+                stage_tree(myfile,newDir,move=not leave)
 #            else:
 #                logging.info("        file is normal... moving file {} to {}".format(myfile,permDir))
 #                shutil.copy(myfile,permDir)
@@ -729,7 +666,7 @@ def procS1StackRTC(outfile=None,infiles=None,path=None,res=None,filter=False,typ
 def printParameters(outfile=None,infiles=None,path=None,res=None,filter=False,type='dB-byte',
         scale=[-40,0],clip=None,shape=None,overlap=False,zipFlag=False,leave=False,thresh=0.4,
         font=24,hyp=None,keep=None,group=False,aws=None,inamp=False,exclude=False,dates=None,
-        delay=50):
+        delay=50,vsizip=False,groupby="time"):
 
     cmd = "procS1StackRTC.py "
     if outfile:
@@ -766,6 +703,8 @@ def printParameters(outfile=None,infiles=None,path=None,res=None,filter=False,ty
        cmd = cmd + "--keep {} ".format(keep)
     if group:
        cmd = cmd + "--group "
+    if groupby != "time":
+       cmd = cmd + "--groupby {} ".format(groupby)
     if inamp:
        cmd = cmd + "--inamp "
     if exclude:
@@ -774,6 +713,8 @@ def printParameters(outfile=None,infiles=None,path=None,res=None,filter=False,ty
        cmd = cmd + "--dates {} ".format(dates)
     if delay:
        cmd = cmd + "--delay {} ".format(delay)
+    if vsizip:
+       cmd = cmd + "--vsizip "
   
     if infiles:
        for myfile in infiles:
@@ -800,16 +741,18 @@ def printParameters(outfile=None,infiles=None,path=None,res=None,filter=False,ty
     logging.info("    hyp name of subscription  : {} ".format(hyp))
     logging.info("    keep ascending/descending : {} ".format(keep))
     logging.info("    group flag                : {} ".format(group))
+    logging.info("    group by                  : {} ".format(groupby))
     logging.info("    exclude flag              : {} ".format(exclude))
     logging.info("    dates file                : {} ".format(dates))
     logging.info("    delay                     : {} ".format(delay))
+    logging.info("    read from zip files       : {} ".format(vsizip))
     logging.info("\n")
 
 
 def procS1StackGroupsRTC(outfile=None,infiles=None,path=None,res=None,filter=False,type='dB-byte',
         scale=[-40,0],clip=None,shape=None,overlap=False,zipFlag=False,leave=False,thresh=0.4,
         font=24,hyp=None,keep=None,group=False,aws=None,inamp=False,exclude=False,dates=None,
-        delay=50):
+        delay=50,vsizip=False,groupby="time"):
 
     if outfile is not None:
         logFile = "{}_log.txt".format(outfile)
@@ -821,21 +764,40 @@ def procS1StackGroupsRTC(outfile=None,infiles=None,path=None,res=None,filter=Fal
     logging.info("                 STARTING RUN {}".format(outfile))
     logging.info("***********************************************************************************")
 
+    # Open the product catalog in the run directory before changing directory
+    catalog()
+
     printParameters(outfile,infiles,path,res,filter,type,scale,clip,shape,overlap,zipFlag,
-                    leave,thresh,font,hyp,keep,group,aws,inamp,exclude,dates,delay)
+                    leave,thresh,font,hyp,keep,group,aws,inamp,exclude,dates,delay,vsizip,groupby)
 
+    pipeline_failures = []
     if hyp:
         logging.info("Using Hyp3 subscription named {} to download input files".format(hyp))
         username,password = getUsernamePassword()
         api = API(username)
         api.login(password=password)
-        download_products(api,sub_name=hyp)
+        store = default_store()
+        # Skip products outside the shape file or of the wrong orbit direction
+        aoi = shape_bbox(shape) if shape else None
+        if vsizip:
+            download_products(api,sub_name=hyp,members='rtc',store=store,aoi=aoi,direction=keep)
+        else:
+            # Unzip and read each product as soon as it has downloaded
+            pipeline = ProductPipeline("hyp3-products-unzipped",store=store,process=read_product_headers,
+                                       filetype='rtc')
+            download_products(api,sub_name=hyp,on_product=pipeline.submit,members='rtc',
+                              store=store,aoi=aoi,direction=keep)
+            pipeline_failures = pipeline.close()
         hyp = None
         zipFlag = True
         path = "hyp3-products"
 
-    if zipFlag:
-        unzipFiles(path,"hyp3-products-unzipped")
+    if zipFlag and not vsizip:
+        # The products the download pipeline failed on stay out of the stack
+        failures = unzipFiles(path,"hyp3-products-unzipped",store=default_store(),
+                              workers=multiprocessing.cpu_count(),filetype='rtc',
+                              exclude=[myfile for myfile,err in pipeline_failures])
+        checkUnzipped(path,pipeline_failures + failures)
         zipFlag = False
         path = "hyp3-products-unzipped"
 
@@ -881,7 +843,10 @@ def procS1StackGroupsRTC(outfile=None,infiles=None,path=None,res=None,filter=Fal
             logging.error("ERROR: Unable to find input files")
             exit(1)
 
-        classes, filelists = sortByTime(path,filelist,"rtc")
+        if groupby == "footprint":
+            classes, filelists = sortByFootprint(path,filelist,"rtc")
+        else:
+            classes, filelists = sortByTime(path,filelist,"rtc")
 	logging.debug("aws is {}".format(aws))
         for i in range(len(classes)):
             if len(filelists[i])>2:
@@ -904,7 +869,7 @@ def procS1StackGroupsRTC(outfile=None,infiles=None,path=None,res=None,filter=Fal
                 procS1StackRTC(outfile=output,infiles=infiles,path=mydir,res=res,filter=filter,
                     type=type,scale=scale,clip=None,shape=None,overlap=True,zipFlag=zipFlag,
                     leave=leave,thresh=thresh,font=font,keep=keep,aws=aws,inamp=inamp,exclude=exclude,
-                    datefile=dates,delay=delay)
+                    datefile=dates,delay=delay,vsizip=vsizip)
 
                 if mydir is not None:
                     shutil.rmtree(mydir)
@@ -912,7 +877,7 @@ def procS1StackGroupsRTC(outfile=None,infiles=None,path=None,res=None,filter=Fal
         procS1StackRTC(outfile=outfile,infiles=infiles,path=path,res=res,filter=filter,
             type=type,scale=scale,clip=clip,shape=shape,overlap=overlap,zipFlag=zipFlag,
             leave=leave,thresh=thresh,font=font,keep=keep,aws=aws,inamp=inamp,exclude=exclude,
-            datefile=dates,delay=delay)
+            datefile=dates,delay=delay,vsizip=vsizip)
 
     if not leave and group:
         for myfile in glob.glob("sorted_*"):
@@ -930,6 +895,7 @@ if __name__ == "__main__":
     parser.add_argument("-e","--exclude",action='store_true',help="Excludes video creation")
     parser.add_argument("-f","--filter",action='store_true',help="Apply speckle filtering")
     parser.add_argument("-g","--group",action='store_true',help="Group files by time before processing into stacks.  Turns on overlap option.")
+    parser.add_argument("--groupby",choices=['time','footprint'],default='time',help="Group files by time of day or by overlapping footprints (default time)")
     parser.add_argument("-k","--keep",choices=['a','d'],help="Switch to keep only ascending or descending images (default is to keep all)")
     parser.add_argument("-l","--leave",action="store_true",help="Leave intermediate files in place")
     parser.add_argument("-m","--magnify",type=int,help="Magnify (set) annotation font size (def 24)",default=24)
@@ -939,6 +905,7 @@ if __name__ == "__main__":
     parser.add_argument("-r","--res",type=float,help="Desired output resolution")
     parser.add_argument("-t","--type",choices=['dB','sigma-byte','dB-byte','amp','power'],help="Output type (default dB-byte)",default="dB-byte")
     parser.add_argument("-w","--delay",type=int,help="Set wait time between frames",default=50)
+    parser.add_argument("-y","--vsizip",action='store_true',help="Read the hyp3 zip files in place instead of unzipping them")
     parser.add_argument("-z","--zip",action='store_true',help="Start from hyp3 zip files instead of directories")
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-c","--clip",type=float,metavar=('ULE','ULN','LRE','LRN'),nargs=4,help="Clip output to bounding box (ULE, ULN, LRE, LRN)")
@@ -962,5 +929,6 @@ if __name__ == "__main__":
     procS1StackGroupsRTC(outfile=args.outfile,infiles=args.infile,path=args.path,res=args.res,filter=args.filter,
         type=args.type,scale=args.dBscale,clip=args.clip,shape=args.shape,overlap=args.overlap,zipFlag=args.zip,
         leave=args.leave,thresh=args.black,font=args.magnify,hyp=args.name,keep=args.keep,group=args.group,
-        aws=args.aws,inamp=args.inamp,exclude=args.exclude,dates=args.dates,delay=args.delay)
+        aws=args.aws,inamp=args.inamp,exclude=args.exclude,dates=args.dates,delay=args.delay,
+        vsizip=args.vsizip,groupby=args.groupby)
  
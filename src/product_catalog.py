@@ -0,0 +1,148 @@
+#!/usr/bin/python
+#
+# product_catalog.py
+#
+# Persistent catalog of product metadata shared by the InSAR and RTC
+# processing.  Facts read from product files (raster headers, parameter
+# files, iso.xml) are kept in a SQLite database in the run directory,
+# keyed by the file's real path and mtime, so a file is only read once
+# across runs as long as it stays where it is.  Products read from their
+# zips, the product store or an unzipped directory are cached this way;
+# rasters unzipped afresh into a scratch directory each run are not.  A per-product table collects acquisition time, platform, orbit
+# direction, footprint, projection and the InSAR parameters as products
+# are read.
+#
+import os
+import re
+import json
+import sqlite3
+import threading
+from time_series_utils import isVsiPath, splitVsiZip
+
+CATALOG_NAME = ".product_catalog.sqlite"
+
+PRODUCT_FIELDS = ('name', 'date', 'time', 'platform', 'direction', 'footprint',
+                  'proj', 'pixsize', 'baseline', 'utctime', 'heading')
+
+# The catalog lives in the directory that is current when it is first
+# opened; the processing scripts open it in the run directory before they
+# chdir about
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def catalog():
+    """Return the catalog of the run directory, opening it in the current
+    directory on first use"""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = ProductCatalog(os.path.join(os.getcwd(), CATALOG_NAME))
+        return _catalog
+
+
+def source_mtime(path):
+    """Return the mtime of the file holding path, or None if it can't be
+    cached (e.g. a file in a bucket)"""
+    if isVsiPath(path):
+        if not path.startswith("/vsizip/"):
+            return None
+        path = splitVsiZip(path)[0]
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+
+def source_key(path):
+    if isVsiPath(path):
+        return path
+    return os.path.realpath(path)
+
+
+def product_name(path):
+    """Return the name of the product a product file belongs to"""
+    if path.startswith("/vsizip/"):
+        return os.path.basename(splitVsiZip(path)[0]).replace(".zip", "")
+    return os.path.basename(os.path.dirname(os.path.realpath(path)))
+
+
+def name_fields(name):
+    """Return the acquisition date, time and platform found in a product name"""
+    fields = {}
+    match = re.search(r"(\d{8})T(\d{6})", name)
+    if match is not None:
+        fields['date'] = match.group(1)
+        fields['time'] = match.group(2)
+    match = re.search(r"S1[AB]", name.upper())
+    if match is not None:
+        fields['platform'] = match.group(0)
+    return fields
+
+
+class ProductCatalog(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock:
+            # Everything here can be read again from the products
+            self.conn.execute("PRAGMA synchronous=OFF")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS files ("
+                              "path TEXT, kind TEXT, mtime REAL, data TEXT, "
+                              "PRIMARY KEY (path, kind))")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS products ("
+                              "name TEXT PRIMARY KEY, date TEXT, time TEXT, platform TEXT, "
+                              "direction TEXT, footprint TEXT, proj TEXT, pixsize REAL, "
+                              "baseline TEXT, utctime TEXT, heading TEXT)")
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def file_info(self, path, kind, reader):
+        """Return reader(path), reading the file only if the catalog has no
+        kind information for it from its current mtime"""
+        mtime = source_mtime(path)
+        if mtime is None:
+            return reader(path)
+        key = source_key(path)
+        with self.lock:
+            row = self.conn.execute("SELECT mtime, data FROM files WHERE path=? AND kind=?",
+                                    (key, kind)).fetchone()
+        if row is not None and row[0] == mtime:
+            return json.loads(row[1])
+        data = reader(path)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO files VALUES (?,?,?,?)",
+                              (key, kind, mtime, json.dumps(data)))
+            self.conn.commit()
+        return data
+
+    def update(self, name, **fields):
+        """Record fields of product name, along with what its name tells us"""
+        record = self.product(name) or {'name': name}
+        record.update(name_fields(name))
+        record.update(fields)
+        if isinstance(record.get('footprint'), (list, tuple)):
+            record['footprint'] = json.dumps(list(record['footprint']))
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO products ({}) VALUES ({})".format(
+                              ",".join(PRODUCT_FIELDS), ",".join("?" * len(PRODUCT_FIELDS))),
+                              [record.get(f) for f in PRODUCT_FIELDS])
+            self.conn.commit()
+
+    def _record(self, row):
+        record = dict(zip(PRODUCT_FIELDS, row))
+        if record['footprint'] is not None:
+            record['footprint'] = json.loads(record['footprint'])
+        return record
+
+    def product(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT {} FROM products WHERE name=?".format(
+                                    ",".join(PRODUCT_FIELDS)), (name,)).fetchone()
+        if row is None:
+            return None
+        return self._record(row)
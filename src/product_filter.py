@@ -0,0 +1,225 @@
+#!/usr/bin/python
+#
+# product_filter.py
+#
+# Decide which products of a subscription are worth downloading.  Products
+# can be filtered by acquisition date, which is read from the product name,
+# and by area of interest and orbit direction, which are read from the
+# product metadata.  The metadata comes from the listing if the api provides
+# it, otherwise from the iso.xml (or failing that a GeoTIFF header) inside
+# the remote zip, read with HTTP Range requests so nothing is downloaded in
+# full.
+#
+import os
+import re
+import zipfile
+import logging
+from multiprocessing.pool import ThreadPool
+from remote_zip import HttpRangeFile
+from time_series_utils import wantedMember
+try:
+    from osgeo import gdal, ogr, osr
+except ImportError:
+    gdal = None
+
+# Number of products whose metadata is read at once
+METADATA_THREADS = 8
+
+BOUNDS = ('southBoundLatitude', 'northBoundLatitude', 'westBoundLongitude', 'eastBoundLongitude')
+
+
+def product_dates(name):
+    """Return the acquisition dates (YYYYMMDD) in a product name"""
+    return re.findall(r"(\d{8})T\d{6}", name)
+
+
+def orbit_direction(text):
+    """Return 'a' or 'd' for the first line of text naming an orbit direction"""
+    for line in text.splitlines():
+        if 'ascending' in line:
+            return "a"
+        if 'descending' in line:
+            return "d"
+    return None
+
+
+def xml_bbox(text):
+    """Return the geographic bounding box of an ISO metadata file as
+    [min lat, max lat, min lon, max lon], or None"""
+    bbox = []
+    for bound in BOUNDS:
+        match = re.search(r"<(?:\w+:)?{}>\s*(?:<(?:\w+:)?Decimal>)?\s*([-+0-9.eE]+)".format(bound), text)
+        if match is None:
+            return None
+        bbox.append(float(match.group(1)))
+    return bbox
+
+
+def wkt_bbox(wkt):
+    if gdal is None:
+        return None
+    minx, maxx, miny, maxy = ogr.CreateGeometryFromWkt(wkt).GetEnvelope()
+    return [miny, maxy, minx, maxx]
+
+
+def to_lat_lon(srs):
+    ll = osr.SpatialReference()
+    ll.ImportFromEPSG(4326)
+    for s in (srs, ll):
+        if hasattr(s, 'SetAxisMappingStrategy'):
+            s.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return osr.CoordinateTransformation(srs, ll)
+
+
+def transform_bbox(srs, minx, maxx, miny, maxy):
+    """Return the lat/lon bounding box of a box in the projection srs"""
+    trans = to_lat_lon(srs)
+    lats, lons = [], []
+    for x, y in [(minx, miny), (minx, maxy), (maxx, miny), (maxx, maxy)]:
+        lon, lat = trans.TransformPoint(x, y)[:2]
+        lats.append(lat)
+        lons.append(lon)
+    return [min(lats), max(lats), min(lons), max(lons)]
+
+
+def raster_bbox(path):
+    """Return the lat/lon bounding box of a raster GDAL can open, or None"""
+    if gdal is None:
+        return None
+    dst = gdal.Open(path)
+    if dst is None:
+        return None
+    trans = dst.GetGeoTransform()
+    srs = osr.SpatialReference()
+    srs.ImportFromWkt(dst.GetProjection())
+    x0, y0 = trans[0], trans[3]
+    x1 = x0 + dst.RasterXSize * trans[1]
+    y1 = y0 + dst.RasterYSize * trans[5]
+    return transform_bbox(srs, min(x0, x1), max(x0, x1), min(y0, y1), max(y0, y1))
+
+
+def shape_bbox(shape):
+    """Return the lat/lon bounding box of the features in a shapefile"""
+    if gdal is None:
+        raise ImportError("GDAL is needed to read shapefile {}".format(shape))
+    dataset = ogr.Open(shape)
+    if dataset is None:
+        raise IOError("Unable to open shapefile {}".format(shape))
+    layer = dataset.GetLayer()
+    minx, maxx, miny, maxy = layer.GetExtent()
+    srs = layer.GetSpatialRef()
+    if srs is None:
+        return [miny, maxy, minx, maxx]
+    return transform_bbox(srs, minx, maxx, miny, maxy)
+
+
+def overlaps(bbox1, bbox2):
+    return bbox1[0] <= bbox2[1] and bbox2[0] <= bbox1[1] and \
+           bbox1[2] <= bbox2[3] and bbox2[2] <= bbox1[3]
+
+
+def read_metadata(source, vsi_path, filetype=None):
+    """Return (bbox, direction) read from a product zip.  source is the path
+    of a local zip or an HttpRangeFile, and vsi_path the GDAL path of the
+    zip, used to read a raster header if the zip has no iso.xml."""
+    bbox = direction = None
+    zip_ref = zipfile.ZipFile(source, 'r')
+    try:
+        names = zip_ref.namelist()
+        for name in names:
+            if name.endswith(".iso.xml"):
+                text = zip_ref.read(name).decode('utf-8', 'replace')
+                bbox = xml_bbox(text)
+                direction = orbit_direction(text)
+                break
+    finally:
+        zip_ref.close()
+    if bbox is None:
+        for name in names:
+            if name.lower().endswith(".tif") and (filetype is None or wantedMember(name, filetype)):
+                bbox = raster_bbox("/vsizip/{}/{}".format(vsi_path, name))
+                break
+    return bbox, direction
+
+
+class ProductFilter(object):
+    """Date, area of interest and orbit direction filter for a product list.
+    aoi is [min lat, max lat, min lon, max lon], start and end are YYYYMMDD
+    dates, and direction is 'a' or 'd'."""
+
+    def __init__(self, aoi=None, start=None, end=None, direction=None, filetype=None):
+        self.aoi = aoi
+        self.start = start
+        self.end = end
+        self.direction = direction
+        self.filetype = filetype
+
+    def active(self):
+        return any(f is not None for f in (self.aoi, self.start, self.end, self.direction))
+
+    def needs_metadata(self):
+        return self.aoi is not None or self.direction is not None
+
+    def date_ok(self, product):
+        for date in product_dates(product['name']):
+            if (self.start is not None and date < self.start) or \
+               (self.end is not None and date > self.end):
+                return False
+        return True
+
+    def describe(self, session, product_list, directory, threads=METADATA_THREADS):
+        """Add 'bbox' and 'direction' to each product of product_list that
+        passes the date filter and doesn't have them yet"""
+        todo = [p for p in product_list if self.date_ok(p) and
+                not ('bbox' in p and 'direction' in p)]
+        if len(todo) == 0:
+            return
+
+        def describe_one(product):
+            bbox = direction = None
+            for key in ('footprint', 'wkt'):
+                if product.get(key):
+                    bbox = wkt_bbox(product[key])
+                    break
+            local = os.path.join(directory, product['name'])
+            try:
+                if os.path.isfile(local):
+                    meta = read_metadata(local, local, self.filetype)
+                else:
+                    meta = read_metadata(HttpRangeFile(session, product['url']),
+                                         "/vsicurl/" + product['url'], self.filetype)
+                bbox = bbox or meta[0]
+                direction = meta[1]
+            except Exception as err:
+                logging.warning("Unable to read metadata of {}: {}".format(product['name'], err))
+            product['bbox'] = bbox
+            product['direction'] = direction
+
+        logging.info("Reading metadata of {} products".format(len(todo)))
+        pool = ThreadPool(min(threads, len(todo)))
+        try:
+            pool.map(describe_one, todo)
+        finally:
+            pool.close()
+            pool.join()
+
+    def keep(self, product):
+        if not self.date_ok(product):
+            return False
+        # Products whose metadata couldn't be read are kept
+        if self.aoi is not None and product.get('bbox') is not None:
+            if not overlaps(self.aoi, product['bbox']):
+                return False
+        if self.direction is not None and product.get('direction') is not None:
+            if product['direction'] != self.direction:
+                return False
+        return True
+
+    def filter(self, product_list):
+        kept = []
+        for product in product_list:
+            if self.keep(product):
+                kept.append(product)
+            else:
+                logging.info("Skipping {}; outside the requested area, dates or direction".format(product['name']))
+        return kept
@@ -0,0 +1,88 @@
+#!/usr/bin/python
+#
+# product_pipeline.py
+#
+# Overlap download, extraction and per-product preprocessing.  Finished
+# downloads are handed to an extraction thread through a bounded queue, and
+# each extracted product is then handed to a preprocessing function, so the
+# network and the CPU are both kept busy on large subscriptions.
+#
+import logging
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+from unzipFiles import unzipProduct, removeProduct
+
+# Number of products allowed to wait at each stage before the stage in
+# front of it is made to wait
+QUEUE_SIZE = 8
+
+_DONE = None
+
+
+class ProductPipeline(object):
+
+    def __init__(self, unzip_dir, process=None, maxsize=QUEUE_SIZE, store=None, filetype=None):
+        self.unzip_dir = unzip_dir
+        self.filetype = filetype
+        self.store = store
+        self.process = process
+        self.extract_queue = queue.Queue(maxsize)
+        self.process_queue = queue.Queue(maxsize)
+        self.errors = []
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self._extract),
+                        threading.Thread(target=self._preprocess)]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def submit(self, zip_file):
+        """Queue a downloaded zip file; blocks while the extraction queue is full"""
+        self.extract_queue.put(zip_file)
+
+    def _error(self, myfile, err):
+        logging.error("ERROR: Unable to prepare {}: {}".format(myfile, err))
+        with self.lock:
+            self.errors.append((myfile, err))
+
+    def _extract(self):
+        while True:
+            zip_file = self.extract_queue.get()
+            if zip_file is _DONE:
+                self.process_queue.put(_DONE)
+                return
+            try:
+                path = unzipProduct(zip_file, self.unzip_dir, store=self.store,
+                                    filetype=self.filetype)
+            except Exception as err:
+                self._error(zip_file, err)
+                continue
+            self.process_queue.put((zip_file, path))
+
+    def _preprocess(self):
+        while True:
+            item = self.process_queue.get()
+            if item is _DONE:
+                return
+            if self.process is None:
+                continue
+            zip_file, path = item
+            try:
+                self.process(path)
+            except Exception as err:
+                # Leave the product out rather than stack a file we can't read
+                removeProduct(path)
+                self._error(zip_file, err)
+
+    def close(self):
+        """Wait for every queued product to pass through the pipeline.
+        Returns a list of (zip file, error) for the products that failed;
+        they are not left in the unzip directory."""
+        self.extract_queue.put(_DONE)
+        for t in self.threads:
+            while t.is_alive():
+                t.join(0.5)
+        return self.errors
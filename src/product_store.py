@@ -0,0 +1,157 @@
+#!/usr/bin/python
+#
+# product_store.py
+#
+# Shared store of downloaded and extracted HyP3 products.  Each product is
+# kept once, under its name and md5 checksum, and every run's workspace
+# links to it, so overlapping subscriptions and repeat runs don't download
+# or unzip the same granule again.  The layout of the store is
+#
+#     <root>/<product name>/<md5>/<product name>   the product zip
+#     <root>/<product name>/<md5>/members          files the zip holds
+#     <root>/<product name>/<md5>/unzipped/        the extracted product
+#     <root>/<product name>/<md5>/unzipped-<type>/ the files one type of
+#                                                  processing reads
+#
+# Set HYP3_PRODUCT_STORE to the path of the store to use it from the
+# processing scripts.
+#
+import os
+import glob
+import time
+import shutil
+import tempfile
+import logging
+
+STORE_ENV = "HYP3_PRODUCT_STORE"
+
+# Contents of the members file for a complete product zip
+ALL_MEMBERS = "all"
+
+# Seconds after which an unfinished extraction is taken to be abandoned
+STALE_UNZIP = 24 * 3600
+
+
+def default_store():
+    """Return the store named by $HYP3_PRODUCT_STORE, or None"""
+    root = os.environ.get(STORE_ENV)
+    if root:
+        return ProductStore(root)
+    return None
+
+
+def link_file(src, dst):
+    """Hard link src to dst, falling back to a symbolic link"""
+    try:
+        os.link(src, dst)
+    except (OSError, AttributeError):
+        os.symlink(os.path.abspath(src), dst)
+
+
+class ProductStore(object):
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root)
+
+    def entries(self, name):
+        """Return (entry dir, members) for each stored copy of product name"""
+        top = os.path.join(self.root, name)
+        if not os.path.isdir(top):
+            return []
+        found = []
+        for md5 in sorted(os.listdir(top)):
+            entry = os.path.join(top, md5)
+            if os.path.isfile(os.path.join(entry, name)):
+                members = ALL_MEMBERS
+                members_file = os.path.join(entry, "members")
+                if os.path.isfile(members_file):
+                    with open(members_file) as f:
+                        members = f.read().strip()
+                found.append((entry, members))
+        return found
+
+    def find(self, name, members=None):
+        """Return (path, md5, members) of a stored zip of product name holding
+        at least the given members, or None.  members is None for a complete
+        product zip."""
+        for entry, stored in self.entries(name):
+            if stored == ALL_MEMBERS or stored == members:
+                if stored == ALL_MEMBERS:
+                    stored = None
+                return os.path.join(entry, name), os.path.basename(entry), stored
+        return None
+
+    def lookup(self, zip_file):
+        """Return the store entry that zip_file is linked to, or None"""
+        name = os.path.basename(zip_file)
+        for entry, stored in self.entries(name):
+            try:
+                if os.path.samefile(os.path.join(entry, name), zip_file):
+                    return entry
+            except OSError:
+                pass
+        return None
+
+    def add(self, zip_file, md5, members=None):
+        """Move a downloaded zip into the store and link it back into place"""
+        name = os.path.basename(zip_file)
+        entry = os.path.join(self.root, name, md5)
+        stored = os.path.join(entry, name)
+        if not os.path.isfile(stored):
+            if not os.path.isdir(entry):
+                try:
+                    os.makedirs(entry)
+                except OSError:
+                    # Another run made it first
+                    pass
+            with open(os.path.join(entry, "members"), "w") as f:
+                f.write(members or ALL_MEMBERS)
+            fd, tmp = tempfile.mkstemp(dir=entry, suffix=".tmp")
+            os.close(fd)
+            try:
+                os.rename(zip_file, tmp)
+            except OSError:
+                # Different file system
+                shutil.copy2(zip_file, tmp)
+            os.rename(tmp, stored)
+        logging.debug("Stored {} in {}".format(zip_file, entry))
+        if os.path.lexists(zip_file):
+            os.remove(zip_file)
+        link_file(stored, zip_file)
+        return stored
+
+    def link(self, stored, zip_file):
+        """Link a stored zip into a workspace"""
+        if os.path.lexists(zip_file):
+            os.remove(zip_file)
+        link_file(stored, zip_file)
+
+    def unzipped(self, entry, filetype=None):
+        if filetype is None:
+            return os.path.join(entry, "unzipped")
+        return os.path.join(entry, "unzipped-" + filetype)
+
+    def claim_unzip(self, entry):
+        """Return a private directory to extract a stored zip into; hand it
+        to publish_unzip once the extraction is complete.  Extractions
+        abandoned long ago by runs that died are swept away first."""
+        now = time.time()
+        for tmp in glob.glob(os.path.join(entry, "unzipped.*.tmp")):
+            try:
+                if now - os.path.getmtime(tmp) > STALE_UNZIP:
+                    logging.debug("Removing abandoned extraction {}".format(tmp))
+                    shutil.rmtree(tmp, ignore_errors=True)
+            except OSError:
+                pass
+        return tempfile.mkdtemp(dir=entry, prefix="unzipped.", suffix=".tmp")
+
+    def publish_unzip(self, entry, tmp, filetype=None):
+        dest = self.unzipped(entry, filetype)
+        try:
+            os.rename(tmp, dest)
+        except OSError:
+            # Another run finished extracting first
+            shutil.rmtree(tmp)
+        return dest
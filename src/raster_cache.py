@@ -0,0 +1,86 @@
+#!/usr/bin/python
+#
+# raster_cache.py
+#
+# Keep recently used GDAL datasets open, and their size, geotransform and
+# projection parsed, so the reference and product rasters aren't reopened
+# every time a processing step needs their georeferencing.  Entries are
+# keyed by the file and its size and mtime, so a file that is rewritten is
+# opened again.  Files in buckets (/vsis3/ and the like) have no mtime and
+# are taken not to change during a run.
+#
+import os
+import threading
+from collections import OrderedDict
+from osgeo import gdal
+from product_catalog import source_key
+from time_series_utils import isVsiPath, splitVsiZip
+
+# Number of datasets kept open
+MAX_DATASETS = 32
+
+# Number of parsed headers kept
+MAX_HEADERS = 4096
+
+
+def file_key(path):
+    """Return the cache key of path, changing whenever the file does"""
+    stat_path = path
+    if path.startswith("/vsizip/"):
+        stat_path = splitVsiZip(path)[0]
+    elif isVsiPath(path):
+        return (path, None, None)
+    st = os.stat(stat_path)
+    return (source_key(path), st.st_size, st.st_mtime)
+
+
+class LRUCache(object):
+
+    def __init__(self, size):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            value = self.items.pop(key)
+            self.items[key] = value
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.items.pop(key, None)
+            self.items[key] = value
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+_datasets = LRUCache(MAX_DATASETS)
+_headers = LRUCache(MAX_HEADERS)
+
+
+def open_raster(path):
+    """Return an open, read only GDAL dataset of path"""
+    key = file_key(path)
+    dst = _datasets.get(key)
+    if dst is None:
+        dst = gdal.Open(path, gdal.GA_ReadOnly)
+        if dst is None:
+            raise IOError("Unable to open raster {}".format(path))
+        _datasets.put(key, dst)
+    return dst
+
+
+def read_geo(path):
+    """Return (width, height, geotransform, projection) of path, like
+    saa.read_gdal_file_geo(saa.open_gdal_file(path))"""
+    key = file_key(path)
+    geo = _headers.get(key)
+    if geo is None:
+        dst = open_raster(path)
+        geo = (dst.RasterXSize, dst.RasterYSize, dst.GetGeoTransform(), dst.GetProjection())
+        _headers.put(key, geo)
+    return geo
+
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+#
+# remote_zip.py
+#
+# Read the central directory of a zip file on a web server with HTTP Range
+# requests and copy only the members we need into a smaller local zip.  The
+# compressed data of each member is copied as-is, so nothing is decompressed
+# or recompressed on the way.
+#
+import struct
+import zipfile
+import logging
+from time_series_utils import wantedMember
+
+# Smallest range requested when zipfile reads the remote directory
+BLOCK_SIZE = 64 * 1024
+
+# Size of the blocks streamed to disk
+CHUNK_SIZE = 1024 * 1024
+
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_RECORD = struct.Struct("<4s4H2LH")
+
+# Sizes and offsets from here on need Zip64 records, which we don't write
+ZIP64_LIMIT = 0xFFFFFFFF
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+class IncompleteDownload(IOError):
+    """The server sent less data than it promised; worth trying again"""
+    pass
+
+
+class HttpRangeFile(object):
+    """Read-only, seekable file object backed by HTTP Range requests"""
+
+    def __init__(self, session, url):
+        self.session = session
+        self.url = url
+        self.pos = 0
+        self.buf_start = 0
+        self.buf = b''
+        resp = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True)
+        try:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise RangeNotSupported(url)
+            self.size = int(resp.headers['content-range'].split('/')[-1])
+            # Follow any redirect once instead of on every read
+            self.url = resp.url
+        finally:
+            resp.close()
+
+    def seek(self, offset, whence=0):
+        if whence == 0:
+            self.pos = offset
+        elif whence == 1:
+            self.pos += offset
+        else:
+            self.pos = self.size + offset
+
+    def tell(self):
+        return self.pos
+
+    def seekable(self):
+        return True
+
+    def read(self, n=-1):
+        if n < 0:
+            n = self.size - self.pos
+        end = min(self.pos + n, self.size)
+        if self.pos < self.buf_start or end > self.buf_start + len(self.buf):
+            self.buf_start = self.pos
+            self.buf = self.get_range(self.pos, min(self.pos + max(n, BLOCK_SIZE), self.size))
+        data = self.buf[self.pos - self.buf_start:end - self.buf_start]
+        self.pos += len(data)
+        return data
+
+    def get_range(self, start, end):
+        if end <= start:
+            return b''
+        resp = self.session.get(self.url, headers={'Range': 'bytes={}-{}'.format(start, end - 1)})
+        resp.raise_for_status()
+        if resp.status_code != 206:
+            raise RangeNotSupported(self.url)
+        return resp.content
+
+    def copy_range(self, start, length, out_f, progress=None, cancel=None):
+        """Stream length bytes starting at start into out_f"""
+        if length == 0:
+            return True
+        resp = self.session.get(self.url, stream=True,
+                                headers={'Range': 'bytes={}-{}'.format(start, start + length - 1)})
+        try:
+            resp.raise_for_status()
+            if resp.status_code != 206:
+                raise RangeNotSupported(self.url)
+            done = 0
+            for data in resp.iter_content(chunk_size=CHUNK_SIZE):
+                if cancel is not None and cancel.is_set():
+                    return False
+                out_f.write(data)
+                done += len(data)
+                if progress is not None:
+                    progress.add_bytes(len(data))
+        finally:
+            resp.close()
+        if done != length:
+            raise IncompleteDownload("Short read of {}".format(self.url))
+        return True
+
+    def close(self):
+        self.buf = b''
+
+
+def list_members(session, url):
+    """Return the ZipInfo list of a remote zip file"""
+    remote = HttpRangeFile(session, url)
+    try:
+        zip_ref = zipfile.ZipFile(remote, 'r')
+    except zipfile.BadZipfile as err:
+        raise RangeNotSupported("Unable to read zip directory of {}: {}".format(url, err))
+    infolist = zip_ref.infolist()
+    zip_ref.close()
+    return remote, infolist
+
+
+def header_name(zinfo):
+    name = zinfo.filename
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8' if zinfo.flag_bits & 0x800 else 'cp437')
+    return name
+
+
+def fetch_members(session, url, out_name, filetype, progress=None, cancel=None):
+    """Write a zip holding only the members of the remote zip at url that are
+    used for filetype processing.  Returns True on success, False if the
+    download was cancelled.  Raises RangeNotSupported if the server can't do
+    partial downloads, in which case the whole file should be fetched."""
+    remote, infolist = list_members(session, url)
+    wanted = [z for z in infolist if wantedMember(z.filename, filetype)]
+    if len(wanted) == 0:
+        raise RangeNotSupported("No {} members found in {}".format(filetype, url))
+    # Work out where everything lands in the new zip before writing any of it
+    offset = 0
+    for zinfo in wanted:
+        if max(zinfo.compress_size, zinfo.file_size, zinfo.header_offset, offset) >= ZIP64_LIMIT:
+            raise RangeNotSupported("Zip64 member {} in {}".format(zinfo.filename, url))
+        offset += LOCAL_HEADER.size + len(header_name(zinfo)) + zinfo.compress_size
+    if offset >= ZIP64_LIMIT or len(wanted) >= 0xFFFF:
+        raise RangeNotSupported("Members of {} need a Zip64 archive".format(url))
+    logging.debug("Fetching {} of {} members from {}".format(len(wanted), len(infolist), url))
+
+    central = []
+    with open(out_name, 'wb') as out_f:
+        for zinfo in wanted:
+            # The local header may carry a different extra field than the
+            # central directory, so read its real length before copying data
+            remote.seek(zinfo.header_offset)
+            header = LOCAL_HEADER.unpack(remote.read(LOCAL_HEADER.size))
+            data_start = zinfo.header_offset + LOCAL_HEADER.size + header[9] + header[10]
+
+            name = header_name(zinfo)
+            dostime = zinfo.date_time[3] << 11 | zinfo.date_time[4] << 5 | zinfo.date_time[5] // 2
+            dosdate = (zinfo.date_time[0] - 1980) << 9 | zinfo.date_time[1] << 5 | zinfo.date_time[2]
+            # Sizes are written up front, so no data descriptor follows
+            flags = zinfo.flag_bits & ~0x08
+            offset = out_f.tell()
+            out_f.write(LOCAL_HEADER.pack(b"PK\003\004", zinfo.extract_version, flags,
+                                          zinfo.compress_type, dostime, dosdate,
+                                          zinfo.CRC, zinfo.compress_size, zinfo.file_size,
+                                          len(name), 0))
+            out_f.write(name)
+            if not remote.copy_range(data_start, zinfo.compress_size, out_f, progress, cancel):
+                return False
+            central.append(CENTRAL_HEADER.pack(b"PK\001\002",
+                                               zinfo.create_system << 8 | zinfo.create_version,
+                                               zinfo.extract_version, flags,
+                                               zinfo.compress_type, dostime, dosdate,
+                                               zinfo.CRC, zinfo.compress_size, zinfo.file_size,
+                                               len(name), 0, 0, 0, zinfo.internal_attr,
+                                               zinfo.external_attr, offset) + name)
+        start_dir = out_f.tell()
+        for record in central:
+            out_f.write(record)
+        out_f.write(END_RECORD.pack(b"PK\005\006", 0, 0, len(central), len(central),
+                                    out_f.tell() - start_dir, start_dir, 0))
+    return True
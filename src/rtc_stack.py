@@ -0,0 +1,124 @@
+#!/usr/bin/python
+#
+# rtc_stack.py
+#
+# Selection of the scenes that go into an RTC time series: the dates of
+# the scenes, culling them by flight direction (--keep), and which of them
+# can cover enough of the clip box (--clip).  These only read product names,
+# iso.xml files and the footprints already read for the stack, so they
+# don't need GDAL.
+#
+import os
+import glob
+import logging
+from time_series_utils import readText
+from zip_index import vsiZipGlob
+from product_catalog import catalog, product_name
+from footprints import Footprints
+
+
+def getDates(filelist,dates=None):
+    if dates:
+         logging.info("Reading image names and dates from file {}".format(dates))
+         f = open("../{}".format(dates),"r")
+         new_dates = []
+         names = []
+         for line in f:
+             t = line.split()
+             if t[0] != "/":
+                    t[0] = os.path.join("{}/../".format(os.getcwd()),t[0])
+             names.append(t[0])
+             new_dates.append(t[1])
+         logging.info("Names: {}".format(names))
+         logging.info("Dates: {}".format(new_dates))
+    
+    else:
+        new_dates = []
+        names = []
+        for myfile in filelist:
+            myfile = os.path.basename(myfile)
+            logging.debug("Getting date for file {}".format(myfile))
+            try:
+                if "IW_RT" in myfile:
+                    s = myfile.split("_")[3]
+                    new_dates.append(s) 
+                    names.append(myfile) 
+                else:
+                    s = myfile.split("-")[4]
+                    if len(s) <= 26:
+                        t = s.split("_")[0]
+                        new_dates.append(t)
+                    else:       
+                        t = s.split("_")[4]
+                        new_dates.append(t)
+                    names.append(myfile) 
+            except:
+                names.append(myfile)
+                new_dates.append("UNKNOWN")
+                logging.warning("Unable to determine date for file {}".format(myfile))
+
+    return(names,new_dates)
+
+def getAscDesc(myxml):
+    content = readText(myxml).splitlines()
+    for item in content:
+        if 'ascending' in item:
+             return "a"
+        if 'descending' in item:
+             return "d"
+
+def getXmlFile(myfile,date):
+    # The iso.xml sits next to the product's own raster; files without one
+    # (e.g. rasters read from zips) are found by date
+    mydir = os.path.dirname(os.path.realpath(myfile))
+    myxml = glob.glob("{}/*.iso.xml".format(mydir))
+    if len(myxml) > 0:
+        return myxml[0]
+    mydirs = glob.glob("*{}*-rtc-gamma".format(date))
+    if len(mydirs) > 0:
+        return glob.glob("{}/*.iso.xml".format(mydirs[0]))[0]
+    return vsiZipGlob("*.iso.xml","*{}*.zip".format(date))[0]
+
+def getDirection(myfile,date):
+    myxml = getXmlFile(myfile,date)
+    logging.info("Reading flight direction from {}".format(myxml))
+    ad = catalog().file_info(myxml,"direction",getAscDesc)
+    catalog().update(product_name(myxml),direction=ad)
+    return ad
+ 
+def cull_list_by_direction(filelist,direction,dates=None):
+    names,new_dates = getDates(filelist,dates)
+    logging.debug("Got dates {}".format(new_dates))
+    if len(new_dates)>0:
+        newlist = []
+        for i in range(len(filelist)):
+            myfile = filelist[i]
+            logging.info("Checking file {} for flight direction".format(myfile))
+            ad = getDirection(myfile,new_dates[i])
+            logging.info("    Found adflag {}".format(ad))
+            if ad == direction:
+                logging.info("    Keeping")
+                newlist.append(myfile)
+            else:
+                logging.info("    Discarding")
+        return newlist 
+    else:
+        logging.warning("Unable to determine orbit direction; using all files")
+        return filelist
+
+def cull_stack_by_direction(filelist,direction,all_proj,all_coords,all_pixsize):
+    # Keep the metadata lists in step with the files that are kept
+    newlist = cull_list_by_direction(filelist,direction)
+    kept = set(newlist)
+    keep = [i for i in range(len(filelist)) if filelist[i] in kept]
+    return (newlist,[all_proj[i] for i in keep],[all_coords[i] for i in keep],
+            [all_pixsize[i] for i in keep])
+
+
+def clipCandidates(all_coords,clip,thresh):
+    """Return the fraction of the clip box each scene's footprint covers,
+    and which scenes can reach thresh.  The part of the box a footprint
+    covers bounds the fraction of its clip holding data, so the other
+    scenes needn't be cut."""
+    fracs = Footprints(all_coords).fractions(clip)
+    return fracs, fracs >= thresh
@@ -2,9 +2,20 @@
 
 import glob
 import os
+import re
 import shutil
 import logging
 from time_series_utils import *
+from footprints import cluster
+from product_catalog import catalog
+from product_filter import xml_bbox, raster_bbox
+from zip_index import zipContents
+
+# Acquisitions starting within this many seconds of each other (time of
+# day, any date) belong to the same group
+TOLERANCE = 11
+
+SECONDS_PER_DAY = 86400
 
 def getTimes(path,filelist,filetype):
     newlist = []
@@ -23,6 +34,7 @@ def getTimes(path,filelist,filetype):
                     logging.error("ERROR: Unknown type of file {}".format(filetype))
                     mexit(1)
                 time = dt.split("T")[1]
+                secondOfDay(time)
                 times.append(time)
                 newlist.append(myfile)
             except:
@@ -33,67 +45,158 @@ def getTimes(path,filelist,filetype):
 
     return newlist, times
 
+def secondOfDay(time):
+    """Convert an HHMMSS time string to seconds since midnight"""
+    return (int(time[0:2])*60 + int(time[2:4]))*60 + int(time[4:6])
+
+def mission(myfile,filetype):
+    """Return the key of the files myfile may be grouped with.  RTC
+    products are only grouped with products from the same satellite."""
+    if filetype != "rtc":
+        return ""
+    if "S1A" in myfile:
+        return "S1A"
+    if "S1B" in myfile:
+        return "S1B"
+    # Unknown satellite; never grouped with anything else
+    return myfile
+
+def sweep(items):
+    """Group (second of day, time, file) items, sorted by time, so that each
+    group holds the items within TOLERANCE seconds after its first item.
+    A group just before midnight absorbs a group just after it if all of
+    that group's items are within TOLERANCE seconds after its first item."""
+    groups = []
+    for item in items:
+        if groups and item[0] - groups[-1][0][0] < TOLERANCE:
+            groups[-1].append(item)
+        else:
+            groups.append([item])
+    if len(groups) > 1 and groups[0][-1][0] + SECONDS_PER_DAY - groups[-1][0][0] < TOLERANCE:
+        groups[-1].extend(groups.pop(0))
+    return groups
+
 def sortByTime(path,filelist,filetype):
-    logging.info("Sorting files by time")
-    logging.info("Got files {}".format(filelist))
+    logging.info("Sorting {} files by time".format(len(filelist)))
+    logging.debug("Got files {}".format(filelist))
     newlist, times = getTimes(path,filelist,filetype)
-    logging.info("Got times {}".format(times))
+    logging.debug("Got times {}".format(times))
+
+    # Sort each satellite's files by time of day and sweep through them
+    byMission = {}
+    for myfile,time in zip(newlist,times):
+        byMission.setdefault(mission(myfile,filetype),[]).append((secondOfDay(time),time,myfile))
+    groups = []
+    for key in sorted(byMission):
+        groups.extend(sweep(sorted(byMission[key])))
+    groups.sort(key=lambda group: (group[0][0],group[0][2]))
+
     classes = []
     lists = []
-    max_classes = 0
-    for i in range(len(newlist)):
-        placed = False
-        for j in range(len(classes)):
-            hour = int(times[i][0:2])
-            min = int(times[i][2:4])
-            sec = int(times[i][4:6])
-            secofday = (((hour*60)+min)*60)+sec 
-
-            chour = int(classes[j][0:2])
-            cmin = int(classes[j][2:4])
-            csec = int(classes[j][4:6])
-            csecofday = (((chour*60)+cmin)*60)+csec 
-            
-            if (abs(csecofday-secofday)%86400) < 11:
-                if filetype == "rtc":
-                    if ("S1A" in newlist[i] and "S1A" in lists[j][0]):
-                        lists[j].append(newlist[i])
-                        placed = True
-                    elif ("S1B" in newlist[i] and "S1B" in lists[j][0]):
-                        lists[j].append(newlist[i])
-                        placed = True
-                else:
-                    lists[j].append(newlist[i])
-                    placed = True
-                if placed:
-                       break
-        if not placed:
-            max_classes = max_classes+1
-            classes.append(times[i])
-            namelist = []
-            lists.append(namelist)
-            lists[max_classes-1].append(newlist[i])
+    for group in groups:
+        classes.append(group[0][1])
+        lists.append(sorted(item[2] for item in group))
 
     for i in range(len(classes)):
-        logging.info("Class {} : {} contains".format(i,classes[i]))
+        logging.info("Class {} : {} contains {} files".format(i,classes[i],len(lists[i])))
         for j in range(len(lists[i])):
-            logging.info("    {}".format(os.path.basename(lists[i][j])))
+            logging.debug("    {}".format(os.path.basename(lists[i][j])))
 
     # The following won't work for AWS files, but is required for INSAR time series!
     if filetype == 'insar':
-        for i in range(len(classes)):		
-             time = classes[i]		
-             mydir = "sorted_{}".format(time)		
-             logging.info("Making clean directory {}".format(mydir))		
-             createCleanDir(mydir)		
-             for myfile in lists[i]:		
-                 newfile = os.path.join(mydir,os.path.basename(myfile))		
-                 logging.info("Linking file {} to {}".format(os.path.join(path,myfile),newfile))		
-                 os.symlink(os.path.join(path,myfile),newfile)
+        linkClasses(path,classes,lists)
 
     logging.info("Done sorting files by time")
     return classes, lists
 
+def linkClasses(path,classes,lists):
+    """Link the files of each class into a sorted_<class> directory"""
+    for i in range(len(classes)):
+        mydir = "sorted_{}".format(classes[i])
+        logging.info("Making clean directory {}".format(mydir))
+        createCleanDir(mydir)
+        for myfile in lists[i]:
+            newfile = os.path.join(mydir,os.path.basename(myfile))
+            logging.debug("Linking file {} to {}".format(os.path.join(path,myfile),newfile))
+            os.symlink(os.path.join(path,myfile),newfile)
+
+def metadataFile(path,myfile,filetype):
+    """Return the file the footprint of product myfile is read from: its
+    iso.xml if it has one, otherwise one of its rasters"""
+    if isVsiPath(myfile):
+        return myfile
+    full = os.path.join(path,myfile)
+    if myfile.endswith(".zip"):
+        names = zipContents(full).members
+        makePath = lambda name: vsiZipPath(full,name)
+    else:
+        names = sorted(os.listdir(full))
+        makePath = lambda name: os.path.join(full,name)
+    for name in names:
+        if name.endswith(".iso.xml"):
+            return makePath(name)
+    for name in selectMembers(names,filetype):
+        if name.lower().endswith(".tif"):
+            return makePath(name)
+    return None
+
+def readFootprint(source):
+    """Return the lat/lon bounding box of a product as [min lat, max lat,
+    min lon, max lon], or None"""
+    if source.endswith(".iso.xml"):
+        return xml_bbox(readText(source))
+    return raster_bbox(source)
+
+def relativeOrbit(myfile):
+    """Return the relative orbit of a Sentinel-1 product whose name holds
+    its absolute orbit, or None"""
+    match = re.search(r"(S1[AB])_.*\d{8}T\d{6}_\d{8}T\d{6}_(\d{6})_",os.path.basename(myfile).upper())
+    if match is None:
+        return None
+    offset = 73 if match.group(1) == "S1A" else 27
+    return (int(match.group(2)) - offset) % 175 + 1
+
+def sortByFootprint(path,filelist,filetype):
+    """Group files into stacks of overlapping scenes from the same relative
+    orbit.  Returns class names and file lists like sortByTime."""
+    logging.info("Sorting {} files by footprint".format(len(filelist)))
+    newlist, times = getTimes(path,filelist,filetype)
+
+    located = []
+    boxes = []
+    orbits = []
+    for myfile in sorted(newlist):
+        bbox = None
+        try:
+            source = metadataFile(path,myfile,filetype)
+            if source is not None:
+                bbox = catalog().file_info(source,"bbox",readFootprint)
+        except Exception as err:
+            logging.debug("Reading footprint of {}: {}".format(myfile,err))
+        if bbox is None:
+            logging.info("Warning: Unable to determine footprint of file {}; ignoring".format(myfile))
+            continue
+        located.append(myfile)
+        boxes.append([bbox[2],bbox[1],bbox[3],bbox[0]])
+        orbits.append(relativeOrbit(myfile))
+
+    classes = []
+    lists = []
+    for group in cluster(boxes,orbits):
+        classes.append("area{:02d}".format(len(classes)))
+        lists.append([located[i] for i in group])
+
+    for i in range(len(classes)):
+        logging.info("Class {} : {} contains {} files".format(i,classes[i],len(lists[i])))
+        for j in range(len(lists[i])):
+            logging.debug("    {}".format(os.path.basename(lists[i][j])))
+
+    if filetype == 'insar':
+        linkClasses(path,classes,lists)
+
+    logging.info("Done sorting files by footprint")
+    return classes, lists
+
 if __name__ == "__main__":
 
 
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+#
+# staging.py
+#
+# Give files a new name or place without copying their data when the file
+# system allows it.  A file is renamed if the caller no longer needs it
+# under its old name, otherwise hard linked, otherwise reflinked (a copy
+# on write clone, on file systems such as btrfs and XFS), and only copied
+# as a last resort.  Staged files may share their data with the original,
+# so they must not be modified in place.
+#
+import os
+import shutil
+import logging
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# ioctl cloning one file's data into another (linux/fs.h)
+FICLONE = 0x40049409
+
+
+def reflink(src, dst):
+    """Clone src to a new file dst, returning False if that isn't possible.
+    An existing dst is left alone."""
+    if fcntl is None:
+        return False
+    try:
+        with open(src, 'rb') as fsrc:
+            fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            try:
+                fcntl.ioctl(fd, FICLONE, fsrc.fileno())
+            except (IOError, OSError):
+                os.close(fd)
+                os.remove(dst)
+                return False
+            os.close(fd)
+    except (IOError, OSError):
+        return False
+    shutil.copystat(src, dst)
+    return True
+
+
+def stage_file(src, dst, move=False):
+    """Make dst a file with the contents of src.  If move is set, src may be
+    renamed away.  Returns how the file was staged."""
+    if move:
+        try:
+            os.rename(src, dst)
+            return "renamed"
+        except OSError:
+            pass
+    try:
+        os.link(src, dst)
+        return "linked"
+    except (OSError, AttributeError):
+        pass
+    if reflink(src, dst):
+        return "reflinked"
+    shutil.copy2(src, dst)
+    return "copied"
+
+
+def stage_tree(src, dst, move=False):
+    """Recreate the directory tree src as dst, staging each file"""
+    if move:
+        try:
+            os.rename(src, dst)
+            return
+        except OSError:
+            pass
+    for root, dirs, files in os.walk(src):
+        target = os.path.join(dst, os.path.relpath(root, src))
+        if not os.path.isdir(target):
+            os.makedirs(target)
+        for name in dirs:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                os.symlink(os.readlink(path), os.path.join(target, name))
+            else:
+                how = stage_file(path, os.path.join(target, name), move=move)
+                logging.debug("        {} {}".format(how, path))
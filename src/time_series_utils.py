@@ -3,6 +3,16 @@
 import os
 import logging
 import shutil
+import fnmatch
+import zipfile
+
+# Members of a product zip that each type of processing reads
+MEMBER_PATTERNS = {
+    'insar': ['*_unw_phase.tif','*_unwrapped.tif','????????_????????_phase.tif','*_corr.tif',
+              '*_coh.tif','*20*_20*.txt'],
+    'rtc': ['*vv*.tif','*hh*.tif','*.iso.xml'],
+    'aria': ['*filt_topophase.unw.geo*','*phsig.cor.geo*'],
+}
 
 def createCleanDir(dirName):
     if not os.path.isdir(dirName):
@@ -12,4 +22,47 @@ def createCleanDir(dirName):
         shutil.rmtree(dirName)
         os.mkdir(dirName)
 
+def wantedMember(name,filetype):
+    """Return True if zip member name is used when processing filetype products"""
+    base = os.path.basename(name).lower()
+    if not base:
+        return False
+    for pattern in MEMBER_PATTERNS[filetype]:
+        if fnmatch.fnmatch(base,pattern):
+            return True
+    return False
+
+
+def selectMembers(names,filetype):
+    """Return the zip member names that filetype processing reads.  RTC
+    processing uses the VV images when a product has them, otherwise HH."""
+    members = [name for name in names if wantedMember(name,filetype)]
+    if filetype == 'rtc':
+        vv = [name for name in members if fnmatch.fnmatch(os.path.basename(name).lower(),'*vv*.tif')]
+        if len(vv) > 0:
+            members = [name for name in members
+                       if not fnmatch.fnmatch(os.path.basename(name).lower(),'*hh*.tif')]
+    return members
+
+def vsiZipPath(zipFile,member):
+    """Return the GDAL /vsizip/ path of a member of zipFile"""
+    return "/vsizip/{}/{}".format(os.path.abspath(zipFile),member)
+
+def splitVsiZip(path):
+    """Split a /vsizip/ path into the zip file and member names"""
+    zipFile,member = path[len("/vsizip/"):].split(".zip/",1)
+    return zipFile + ".zip",member
+
+def isVsiPath(path):
+    return path.startswith("/vsi")
 
+def readText(path):
+    """Return the contents of a text file, which may be a /vsizip/ path"""
+    if path.startswith("/vsizip/"):
+        zipFile,member = splitVsiZip(path)
+        zip_ref = zipfile.ZipFile(zipFile,'r')
+        text = zip_ref.read(member).decode('utf-8','replace')
+        zip_ref.close()
+        return text
+    with open(path) as f:
+        return f.read()
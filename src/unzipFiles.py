@@ -1,62 +1,211 @@
 #!/usr/bin/python
 
 import os
+import sys
 import zipfile
 import glob
 import argparse
 import logging
 import shutil
+import multiprocessing
+from product_store import ProductStore, default_store, STORE_ENV
+from time_series_utils import MEMBER_PATTERNS
+from zip_index import zipContents, closeIndexes
 
 #
 #  Unzip any files found in path1 that aren't already in path2
 #  Note that it is assumed that zip files contain directories!
 #
 
-def unzipFiles(path1,path2):
-    logging.info("Unzipping files in {} into {}".format(path1,path2))
-    for myfile in glob.glob("{}/*.zip".format(path1)):
-        newDir = myfile.replace(".zip","")
-        if not os.path.isdir(os.path.join(path2,os.path.basename(newDir))):
-            logging.info("    unzipping file {}".format(myfile))
-            zip_ref = zipfile.ZipFile(myfile,'r')            
-            
-            # Look for a directory in the zip file
-            found_dir = False
-            
-            for f in zip_ref.namelist():
-                if '/' in f:
-                    found_dir = True
-            
-            # If no directory is found, create one
-            path = os.path.join(path2,os.path.basename(newDir))
-            if not found_dir:
-                path = os.path.join(path2,os.path.basename(newDir))
-                logging.info( "    creating directory {}".format(path))
-                os.makedirs(path)
-                zip_ref.extractall(path)
-            else:
-                zip_ref.extractall(path2)
-
-            zip_ref.close()
-
-            # Fix old phase file names
-            if (len(glob.glob("{}/*_unw_phase.tif".format(path)))==0 and 
-                len(glob.glob("{}/*_unwrapped.tif".format(path)))==0):
-                logging.debug("        found directory {} with no unwrapped phase files".format(path))
-                back = os.getcwd()
-                os.chdir(path)
-                for myfile in glob.glob("????????_????????_phase.tif"):
-                    newname = myfile.replace("phase.tif","unw_phase.tif")
-                    logging.info("        renaming file {} to {}".format(myfile,newname))
-                    shutil.move(myfile,newname) 
-                os.chdir(back)
-        else:
+def extractMembers(myfile,contents,filetype):
+    """Return the members of myfile to extract for filetype processing,
+    or None to extract them all"""
+    if filetype is None:
+        return None
+    members = contents.wanted(filetype)
+    if len(members) == 0:
+        logging.warning("    no {} files found in {}; extracting all files".format(filetype,myfile))
+        return None
+    return members
+
+# File in each extracted product naming the type of processing its files
+# were picked for, or ALL_FILES
+MARKER = ".unzipped_members"
+ALL_FILES = "all"
+
+def extractedFor(path):
+    """Return what the files in the product directory path were extracted
+    for, or None if that isn't recorded"""
+    try:
+        with open(os.path.join(path,MARKER)) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+def covers(path,filetype):
+    """Return True if the files extracted into path include everything
+    filetype processing (or, for None, anything at all) reads"""
+    extracted = extractedFor(path)
+    return extracted == ALL_FILES or (filetype is not None and extracted == filetype)
+
+def productPath(myfile,path2):
+    """Return the directory that myfile is, or will be, extracted to"""
+    top = zipContents(myfile).top
+    if len(top) == 1:
+        return os.path.join(path2,top[0])
+    return os.path.join(path2,os.path.basename(myfile.replace(".zip","")))
+
+def extractProduct(myfile,path2,filetype=None):
+    """Extract a product zip into path2, giving it a directory if it has none.
+    If filetype is 'insar', 'rtc' or 'aria', only the files that processing
+    reads are extracted.  Returns the directory holding the product's files."""
+    path = productPath(myfile,path2)
+    zip_ref = zipfile.ZipFile(myfile,'r')            
+    
+    # Look for a directory in the zip file
+    contents = zipContents(myfile)
+    found_dir = contents.has_dir
+    
+    members = extractMembers(myfile,contents,filetype)
+
+    # If no directory is found, create one
+    if not found_dir:
+        logging.info( "    creating directory {}".format(path))
+        os.makedirs(path)
+        zip_ref.extractall(path,members)
+    else:
+        zip_ref.extractall(path2,members)
+
+    zip_ref.close()
+    if os.path.isdir(path):
+        with open(os.path.join(path,MARKER),"w") as f:
+            f.write(ALL_FILES if members is None else filetype)
+
+    # Fix old phase file names
+    if (len(glob.glob("{}/*_unw_phase.tif".format(path)))==0 and 
+        len(glob.glob("{}/*_unwrapped.tif".format(path)))==0):
+        logging.debug("        found directory {} with no unwrapped phase files".format(path))
+        for oldname in glob.glob(os.path.join(path,"????????_????????_phase.tif")):
+            newname = oldname.replace("phase.tif","unw_phase.tif")
+            logging.info("        renaming file {} to {}".format(oldname,newname))
+            shutil.move(oldname,newname) 
+    return path
+
+def unzipFile(myfile,path2,store=None,filetype=None):
+    """Unzip a single file into path2 unless it has already been unzipped.
+    If myfile is linked from a product store, it is extracted once inside the
+    store and path2 gets links to the extracted files.
+    Returns the directory holding the product's files."""
+    path = productPath(myfile,path2)
+    if os.path.isdir(path):
+        if covers(path,filetype):
             logging.info("    skipping file {}".format(myfile))
+            return path
+        # Extracted for other processing, or before that was recorded
+        logging.info("    extracting {} again for {} processing".format(myfile,filetype or "any"))
+        removeProduct(path)
+
+    entry = None
+    if store is not None:
+        entry = store.lookup(myfile)
+    if entry is None:
+        logging.info("    unzipping file {}".format(myfile))
+        return extractProduct(myfile,path2,filetype)
+
+    unzipped = store.unzipped(entry,filetype)
+    if not os.path.isdir(unzipped):
+        logging.info("    unzipping file {} into store {}".format(myfile,entry))
+        tmp = store.claim_unzip(entry)
+        try:
+            extractProduct(myfile,tmp,filetype)
+        except Exception:
+            shutil.rmtree(tmp,ignore_errors=True)
+            raise
+        unzipped = store.publish_unzip(entry,tmp,filetype)
+    else:
+        logging.info("    linking stored files for {}".format(myfile))
+    if not os.path.isdir(path2):
+        os.makedirs(path2)
+    for item in os.listdir(unzipped):
+        link = os.path.join(path2,item)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(unzipped,item),link)
+    return path
+
+def unzipProduct(myfile,path2,store=None,filetype=None):
+    """Like unzipFile, but if the extraction fails, any partial directory is
+    removed so that a rerun doesn't skip the product"""
+    path = productPath(myfile,path2)
+    existed = os.path.isdir(path)
+    try:
+        return unzipFile(myfile,path2,store=store,filetype=filetype)
+    except Exception:
+        if not existed and os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path,ignore_errors=True)
+        raise
+
+def removeProduct(path):
+    """Take an extracted product out of the unzip directory"""
+    if os.path.islink(path):
+        os.remove(path)
+    elif os.path.isdir(path):
+        shutil.rmtree(path,ignore_errors=True)
+
+def unzipWorker(args):
+    """Unzip one file for unzipFiles; returns (file, error or None)"""
+    myfile,path2,store,filetype = args
+    try:
+        unzipProduct(myfile,path2,store=store,filetype=filetype)
+    except Exception as err:
+        return myfile,str(err)
+    return myfile,None
+
+def unzipFiles(path1,path2,store=None,workers=1,filetype=None,exclude=()):
+    """Unzip the files in path1 into path2 using workers processes, keeping
+    only the files used by filetype processing if it is given.  Files named
+    in exclude are left alone.  Returns a list of (file, error) for the files
+    that failed."""
+    logging.info("Unzipping files in {} into {}".format(path1,path2))
+    skip = set(os.path.basename(myfile) for myfile in exclude)
+    files = [myfile for myfile in sorted(glob.glob("{}/*.zip".format(path1)))
+             if os.path.basename(myfile) not in skip]
+    if not os.path.isdir(path2):
+        os.makedirs(path2)
+    jobs = [(myfile,path2,store,filetype) for myfile in files]
+    if workers > 1 and len(files) > 1:
+        pool = multiprocessing.Pool(min(workers,len(files)))
+        try:
+            results = pool.map(unzipWorker,jobs)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [unzipWorker(job) for job in jobs]
+    closeIndexes()
+    failures = [(myfile,err) for myfile,err in results if err is not None]
+    for myfile,err in failures:
+        logging.error("ERROR: Unable to unzip {}: {}".format(myfile,err))
+    return failures
+
+def checkUnzipped(path1,failures,minimum=2):
+    """Report the products of path1 that unzipFiles left out of the stack,
+    and exit if too few are left to make one"""
+    if not failures:
+        return
+    logging.warning("Leaving {} products out of the stack: {}".format(len(failures),
+                    ", ".join(os.path.basename(myfile) for myfile,err in failures)))
+    left = len(glob.glob("{}/*.zip".format(path1))) - len(failures)
+    if left < minimum:
+        logging.error("ERROR: Only {} products could be unzipped; at least {} are needed".format(left,minimum))
+        sys.exit(1)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(prog="unzipFiles.pt",description="Unzip all files from path1 into path2")
     parser.add_argument("path1",help="Path to input zip files")
     parser.add_argument("path2",help="Path to place output files")
+    parser.add_argument("-w","--workers",type=int,default=multiprocessing.cpu_count(),help="Number of files to unzip at once (default {})".format(multiprocessing.cpu_count()))
+    parser.add_argument("-m","--members",choices=sorted(MEMBER_PATTERNS),help="Only extract the files used by this type of processing")
+    parser.add_argument("-s","--store",help="Shared product store to extract into (default ${})".format(STORE_ENV))
     args = parser.parse_args()
 
     logFile = "unzipping_log.txt"
@@ -66,4 +215,11 @@ if __name__ == "__main__":
 
     logging.info("Starting run")
 
-    unzipFiles(args.path1,args.path2)
+    if args.store is not None:
+        store = ProductStore(args.store)
+    else:
+        store = default_store()
+    failures = unzipFiles(args.path1,args.path2,store=store,workers=args.workers,
+                          filetype=args.members)
+    if failures:
+        logging.error("{} files could not be unzipped".format(len(failures)))
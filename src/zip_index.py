@@ -0,0 +1,152 @@
+#!/usr/bin/python
+#
+# zip_index.py
+#
+# Persistent index of what is inside the product zips in a directory.  For
+# each zip the member list, whether the members are in directories, and
+# which members each type of processing reads are kept in a small SQLite
+# database next to the zips, keyed by the zip's size and mtime, so that
+# re-runs don't have to open every archive again.
+#
+import os
+import json
+import glob
+import fnmatch
+import sqlite3
+import zipfile
+import logging
+import threading
+from time_series_utils import selectMembers, vsiZipPath, MEMBER_PATTERNS
+
+INDEX_NAME = ".zip_index.sqlite"
+
+# Open indexes by (process, directory); connections can't cross a fork
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+class ZipContents(object):
+
+    def __init__(self, members, relevant):
+        self.members = members
+        self.relevant = relevant
+
+    @property
+    def has_dir(self):
+        for name in self.members:
+            if '/' in name:
+                return True
+        return False
+
+    @property
+    def top(self):
+        """Names of the top level directories in the zip"""
+        return sorted(set(name.split('/')[0] for name in self.members if '/' in name))
+
+    def wanted(self, filetype):
+        """Members read by filetype processing"""
+        if filetype not in self.relevant:
+            self.relevant[filetype] = selectMembers(self.members, filetype)
+        return self.relevant[filetype]
+
+
+def load_relevant(text):
+    """Return the stored member selections, unless they were made with other
+    member patterns than the current ones"""
+    stored = json.loads(text)
+    if stored.get('patterns') != MEMBER_PATTERNS:
+        return {}
+    return stored['relevant']
+
+
+def dump_relevant(relevant):
+    return json.dumps({'patterns': MEMBER_PATTERNS, 'relevant': relevant})
+
+
+def read_contents(zip_file):
+    zip_ref = zipfile.ZipFile(zip_file, 'r')
+    members = zip_ref.namelist()
+    zip_ref.close()
+    relevant = dict((filetype, selectMembers(members, filetype)) for filetype in MEMBER_PATTERNS)
+    return ZipContents(members, relevant)
+
+
+class ZipIndex(object):
+
+    def __init__(self, directory, name=INDEX_NAME):
+        self.path = os.path.join(directory, name)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.conn.execute("CREATE TABLE IF NOT EXISTS zips ("
+                              "name TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+                              "members TEXT, has_dir INTEGER, relevant TEXT)")
+            self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def contents(self, zip_file):
+        """Return the ZipContents of zip_file, opening it only if it isn't in
+        the index or has changed since it was indexed"""
+        st = os.stat(zip_file)
+        name = os.path.basename(zip_file)
+        with self.lock:
+            row = self.conn.execute("SELECT size, mtime, members, relevant FROM zips WHERE name=?",
+                                    (name,)).fetchone()
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime:
+            return ZipContents(json.loads(row[2]), load_relevant(row[3]))
+        logging.debug("Indexing {}".format(zip_file))
+        contents = read_contents(zip_file)
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO zips VALUES (?,?,?,?,?,?)",
+                              (name, st.st_size, st.st_mtime, json.dumps(contents.members),
+                               int(contents.has_dir), dump_relevant(contents.relevant)))
+            self.conn.commit()
+        return contents
+
+
+def zipContents(zip_file):
+    """Return the ZipContents of zip_file using the index in the directory
+    the zip is listed in.  Zips linked in from a product store each live in
+    their own directory, so the index isn't kept next to the real file.
+    Falls back to reading the zip if the index can't be written there."""
+    zip_file = os.path.abspath(zip_file)
+    directory = os.path.dirname(zip_file)
+    key = (os.getpid(), directory)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            try:
+                index = ZipIndex(directory)
+            except sqlite3.Error as err:
+                logging.debug("Unable to use zip index in {}: {}".format(directory, err))
+                index = False
+            _indexes[key] = index
+    if index is False:
+        return read_contents(zip_file)
+    try:
+        return index.contents(zip_file)
+    except sqlite3.Error as err:
+        logging.debug("Unable to use zip index in {}: {}".format(directory, err))
+        return read_contents(zip_file)
+
+
+def closeIndexes():
+    """Close the indexes this process has open"""
+    with _indexes_lock:
+        for key in [key for key in _indexes if key[0] == os.getpid()]:
+            index = _indexes.pop(key)
+            if index is not False:
+                index.close()
+
+
+def vsiZipGlob(pattern, zipPattern="*.zip"):
+    """Like glob.glob("*/" + pattern), but for the members of the zip files
+    matching zipPattern.  Returns /vsizip/ paths that GDAL can read."""
+    files = []
+    for zipFile in sorted(glob.glob(zipPattern)):
+        for name in zipContents(zipFile).members:
+            if fnmatch.fnmatchcase(os.path.basename(name), pattern):
+                files.append(vsiZipPath(zipFile, name))
+    return files
@@ -0,0 +1,31 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+
+@pytest.fixture
+def products(tmp_path):
+    """Directory of generated HyP3-like products and their names"""
+    from mock_hyp3 import make_products
+    directory = str(tmp_path / "served")
+    os.makedirs(directory)
+    return directory, make_products(directory, 6, 512 * 1024)
+
+
+@pytest.fixture
+def serve(products):
+    """Return a function starting a MockHyP3Server on the products"""
+    from mock_hyp3 import MockHyP3Server
+    servers = []
+
+    def start(**kwargs):
+        server = MockHyP3Server(products[0], **kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
@@ -0,0 +1,67 @@
+import os
+import threading
+
+from download_manifest import DownloadManifest
+
+
+def test_verify_trusts_unchanged_files(products):
+    directory, names = products
+    manifest = DownloadManifest(directory)
+    file_name = os.path.join(directory, names[0])
+    manifest.complete(names[0], file_name)
+    assert manifest.verify(names[0], file_name)
+    # A member-only zip doesn't stand in for the whole product
+    manifest.complete(names[0], file_name, members='insar')
+    assert not manifest.verify(names[0], file_name)
+    assert manifest.verify(names[0], file_name, members='insar')
+
+
+def test_verify_rehashes_touched_files(products):
+    directory, names = products
+    manifest = DownloadManifest(directory)
+    file_name = os.path.join(directory, names[0])
+    manifest.complete(names[0], file_name)
+    st = os.stat(file_name)
+    os.utime(file_name, (st.st_atime, st.st_mtime + 10))
+    assert manifest.verify(names[0], file_name)
+
+    # Same size, different contents
+    with open(file_name, 'r+b') as f:
+        f.seek(100)
+        f.write(b'x' * 10)
+    os.utime(file_name, (st.st_atime, st.st_mtime + 20))
+    assert not manifest.verify(names[0], file_name)
+
+
+def test_missing(products):
+    directory, names = products
+    manifest = DownloadManifest(directory)
+    product_list = [{'name': name} for name in names + ["absent.zip"]]
+
+    # Unknown but readable zips are adopted; truncated ones are removed
+    truncated = os.path.join(directory, names[1])
+    with open(truncated, 'r+b') as f:
+        f.truncate(1000)
+    todo = manifest.missing(product_list)
+    assert [product['name'] for product in todo] == [names[1], "absent.zip"]
+    assert not os.path.exists(truncated)
+    assert manifest.get(names[1])['state'] == 'corrupt'
+    assert manifest.get(names[0])['state'] == 'complete'
+    assert manifest.missing(product_list[:1]) == []
+
+
+def test_concurrent_marks(tmp_path):
+    manifest = DownloadManifest(str(tmp_path))
+
+    def mark(field, count):
+        for i in range(count):
+            manifest.mark("product.zip", **{field: i})
+
+    threads = [threading.Thread(target=mark, args=(field, 200)) for field in ('size', 'mtime')]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    record = manifest.get("product.zip")
+    assert record['size'] == 199
+    assert record['mtime'] == 199
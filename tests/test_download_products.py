@@ -0,0 +1,106 @@
+import os
+
+import pytest
+import requests
+
+import download_products
+from download_products import fetch_file, fetch_part, make_session
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_fetch_part_resumes(products, serve, tmp_path):
+    directory, names = products
+    server = serve()
+    full = read(os.path.join(directory, names[0]))
+    part_name = str(tmp_path / "product.zip.part")
+    with open(part_name, 'wb') as f:
+        f.write(full[:100000])
+
+    session = make_session()
+    assert fetch_part(session, server.url(names[0]), part_name)
+    assert read(part_name) == full
+    assert server.bytes_sent == len(full) - 100000
+
+
+def test_fetch_part_complete(products, serve, tmp_path):
+    directory, names = products
+    server = serve()
+    part_name = str(tmp_path / "product.zip.part")
+    with open(part_name, 'wb') as f:
+        f.write(read(os.path.join(directory, names[0])))
+    assert fetch_part(make_session(), server.url(names[0]), part_name)
+    assert server.bytes_sent == 0
+
+
+def test_fetch_file_retries_dropped_connections(products, serve, tmp_path, monkeypatch):
+    monkeypatch.setattr(download_products, "BACKOFF", 0.0)
+    directory, names = products
+    server = serve(fail_rate=0.5, seed=1)
+    out_name = str(tmp_path / names[0])
+    assert fetch_file(make_session(), server.url(names[0]), out_name, retries=20)
+    assert server.dropped > 0
+    assert read(out_name) == read(os.path.join(directory, names[0]))
+    assert not os.path.exists(out_name + ".part")
+
+
+def test_fetch_file_gives_up_on_missing_product(serve, tmp_path, monkeypatch):
+    monkeypatch.setattr(download_products, "BACKOFF", 0.0)
+    calls = []
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return fetch_part(*args, **kwargs)
+
+    monkeypatch.setattr(download_products, "fetch_part", counted)
+    server = serve()
+    with pytest.raises(requests.HTTPError):
+        fetch_file(make_session(), server.url("missing.zip"), str(tmp_path / "missing.zip"))
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize("status,expected", [(404, False), (403, False), (401, False),
+                                             (429, True), (500, True), (503, True)])
+def test_retryable_status(status, expected):
+    response = requests.Response()
+    response.status_code = status
+    assert download_products.retryable(requests.HTTPError(response=response)) == expected
+
+
+def test_local_errors_not_retried():
+    assert not download_products.retryable(OSError(28, "No space left on device"))
+    assert download_products.retryable(requests.ConnectionError())
+
+
+def test_list_products_pages():
+    from mock_hyp3 import MockAPI
+    names = ["product_{:03d}.zip".format(i) for i in range(250)]
+    api = MockAPI("http://localhost/", names)
+    products = download_products.list_products(api, sub_name="mock", prefetch=2, verbose=False)
+    assert [product['name'] for product in products] == names
+    # Pages 0-3 are fetched two at a time; page 2 is the short one
+    assert api.calls == 4
+
+
+def test_list_products_error():
+    from mock_hyp3 import MockAPI
+    api = MockAPI("http://localhost/", ["a.zip"])
+    assert 'message' in download_products.list_products(api, sub_name="other", verbose=False)
+
+
+def test_listing_cache(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "listing.json")
+    key = download_products.listing_key(None, None, "mock", None)
+    listing = [{'name': "a.zip", 'url': "http://localhost/a.zip"}]
+    assert download_products.read_listing_cache(cache_file, key, 60) is None
+    download_products.write_listing_cache(cache_file, key, listing)
+    assert download_products.read_listing_cache(cache_file, key, 60) == listing
+    assert download_products.read_listing_cache(cache_file, "other", 60) is None
+    assert download_products.read_listing_cache(cache_file, key, 0) is None
+
+    now = download_products.time.time()
+    monkeypatch.setattr(download_products.time, "time", lambda: now + 120)
+    assert download_products.read_listing_cache(cache_file, key, 60) is None
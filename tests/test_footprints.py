@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+import footprints
+from footprints import Footprints, cluster, INDEX_MIN_SCENES, MIN_OVERLAP
+
+
+def square(x, y, size=10.0):
+    return [x, y + size, x + size, y]
+
+
+def test_fractions():
+    scenes = Footprints([square(0, 0, 5), square(-5, 5), square(20, 20), square(0, 0, 20)])
+    assert list(scenes.fractions(square(0, 0))) == [0.25, 0.25, 0.0, 1.0]
+    assert list(scenes.best_fit(square(0, 0))) == [3, 0, 1, 2]
+    assert list(scenes.fractions([0, 0, 10, 0])) == [0, 0, 0, 0]
+
+
+def test_common_overlap():
+    assert Footprints([square(0, 0), square(5, 2)]).common_overlap() == [5, 10, 10, 2]
+
+
+def test_cluster_threshold():
+    assert MIN_OVERLAP == 0.5
+    # Sharing exactly half of the footprint is enough
+    assert cluster([square(0, 0), square(5, 0)]) == [[0, 1]]
+    assert cluster([square(0, 0), square(5.5, 0)]) == [[0], [1]]
+    # The fraction is of the smaller footprint
+    assert cluster([square(0, 0, 20), square(15, 0)]) == [[0, 1]]
+
+
+def test_cluster_links_chains():
+    # 0 and 2 barely overlap but are both stacked with 1
+    assert cluster([square(0, 0), square(4, 0), square(8, 0), square(30, 0)]) == [[0, 1, 2], [3]]
+
+
+def test_cluster_keys():
+    boxes = [square(0, 0), square(1, 0), square(2, 0)]
+    assert cluster(boxes, [7, 8, 7]) == [[0, 2], [1]]
+
+
+def grid(count):
+    # Overlapping rows of scenes with gaps between the rows
+    return [square((i % 20) * 2.5, (i // 20) * 25.0) for i in range(count)]
+
+
+def test_index_threshold():
+    pytest.importorskip("rtree")
+    assert Footprints(grid(INDEX_MIN_SCENES - 1)).index is None
+    assert Footprints(grid(INDEX_MIN_SCENES)).index is not None
+
+
+def test_index_matches_scan(monkeypatch):
+    pytest.importorskip("rtree")
+    boxes = grid(INDEX_MIN_SCENES + 44)
+    keys = [i % 2 for i in range(len(boxes))]
+    indexed = Footprints(boxes)
+    assert indexed.index is not None
+    found = [list(indexed.overlapping(box)) for box in boxes]
+    groups = cluster(boxes, keys)
+
+    monkeypatch.setattr(footprints, "rtree_index", None)
+    scanned = Footprints(boxes)
+    assert scanned.index is None
+    assert found == [list(scanned.overlapping(box)) for box in boxes]
+    assert groups == cluster(boxes, keys)
+    assert len(groups) == 2 * (len(boxes) // 20)
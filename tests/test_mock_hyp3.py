@@ -0,0 +1,90 @@
+import os
+import zipfile
+
+import pytest
+
+import download_products
+from bench_download import bench, CONFIGS
+from download_products import download_products as download
+from mock_hyp3 import MockAPI
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(download_products, "BACKOFF", 0.0)
+
+
+def read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("members", [None, 'insar'])
+def test_unreliable_server(products, serve, tmp_path, members):
+    directory, names = products
+    server = serve(fail_rate=0.1, seed=3)
+    api = MockAPI(server.url(""), names)
+    out_dir = str(tmp_path / "hyp3-products")
+
+    stats = download(api, directory=out_dir, sub_name="mock", verbose=False, members=members)
+    assert stats['attempted'] == len(names)
+    assert stats['succeeded'] == len(names)
+    assert stats['failed'] == 0
+    if members is None:
+        assert stats['bytes'] >= sum(os.path.getsize(os.path.join(directory, name)) for name in names)
+
+    for name in names:
+        out_name = os.path.join(out_dir, name)
+        assert not os.path.exists(out_name + ".part")
+        with zipfile.ZipFile(out_name) as zip_ref:
+            assert zip_ref.testzip() is None
+            if members is None:
+                assert read(out_name) == read(os.path.join(directory, name))
+            else:
+                assert len(zip_ref.namelist()) == 3
+
+    # Everything is in the manifest, so nothing is downloaded again
+    sent = server.bytes_sent
+    stats = download(api, directory=out_dir, sub_name="mock", verbose=False, members=members)
+    assert stats['attempted'] == 0
+    assert server.bytes_sent == sent
+
+
+def test_truncated_part_resumes(products, serve, tmp_path):
+    directory, names = products
+    server = serve()
+    out_dir = str(tmp_path / "hyp3-products")
+    os.makedirs(out_dir)
+    full = read(os.path.join(directory, names[0]))
+    with open(os.path.join(out_dir, names[0] + ".part"), 'wb') as f:
+        f.write(full[:len(full) // 2])
+
+    stats = download(MockAPI(server.url(""), names[:1]), directory=out_dir, sub_name="mock",
+                     verbose=False)
+    assert stats['succeeded'] == 1
+    assert read(os.path.join(out_dir, names[0])) == full
+    assert server.bytes_sent == len(full) - len(full) // 2
+
+
+def test_on_complete_failure_is_counted(products, serve, tmp_path, monkeypatch):
+    directory, names = products
+    server = serve()
+
+    def broken(*args, **kwargs):
+        raise IOError("disk full")
+
+    monkeypatch.setattr(download_products.DownloadManifest, "complete", broken)
+    stats = download(MockAPI(server.url(""), names), directory=str(tmp_path / "out"),
+                     sub_name="mock", verbose=False)
+    assert stats['attempted'] == len(names)
+    assert stats['failed'] == len(names)
+
+
+def test_bench(products, serve, tmp_path):
+    directory, names = products
+    server = serve(fail_rate=0.1, seed=5)
+    rows = bench(server, names, [c for c in CONFIGS if c[0] in ('serial', 'insar-members')],
+                 str(tmp_path))
+    assert [name for name, stats in rows] == ['serial', 'insar-members']
+    for name, stats in rows:
+        assert stats['succeeded'] == stats['attempted'] == len(names)
@@ -0,0 +1,42 @@
+import os
+import product_catalog
+from product_catalog import catalog, CATALOG_NAME
+
+
+def test_catalog_opens_in_run_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(product_catalog, "_catalog", None)
+    run = tmp_path / "run"
+    run.mkdir()
+    monkeypatch.chdir(run)
+    opened = catalog()
+    try:
+        assert opened.path == os.path.join(str(run), CATALOG_NAME)
+        # Later chdirs don't move it
+        monkeypatch.chdir(tmp_path)
+        assert catalog() is opened
+    finally:
+        opened.close()
+
+
+def test_file_info(tmp_path, monkeypatch):
+    monkeypatch.setattr(product_catalog, "_catalog", None)
+    monkeypatch.chdir(tmp_path)
+    source = tmp_path / "product.txt"
+    source.write_text(u"first")
+    reads = []
+
+    def reader(path):
+        reads.append(path)
+        return open(path).read()
+
+    opened = catalog()
+    try:
+        assert opened.file_info(str(source), "text", reader) == "first"
+        assert opened.file_info(str(source), "text", reader) == "first"
+        assert len(reads) == 1
+        source.write_text(u"second")
+        os.utime(str(source), (0, 0))
+        assert opened.file_info(str(source), "text", reader) == "second"
+        assert len(reads) == 2
+    finally:
+        opened.close()
@@ -0,0 +1,39 @@
+import os
+import zipfile
+
+from product_pipeline import ProductPipeline
+from unzipFiles import unzipFiles
+
+
+def make_zip(directory, name):
+    path = os.path.join(directory, name + ".zip")
+    zip_ref = zipfile.ZipFile(path, 'w')
+    zip_ref.writestr("{}/{}_VV.tif".format(name, name), "data")
+    zip_ref.close()
+    return path
+
+
+def test_failures_stay_out_of_the_stack(tmp_path):
+    zips = str(tmp_path / "zips")
+    unzipped = str(tmp_path / "unzipped")
+    os.makedirs(zips)
+    good = make_zip(zips, "good")
+    unreadable = make_zip(zips, "unreadable")
+    corrupt = os.path.join(zips, "corrupt.zip")
+    with open(corrupt, 'w') as f:
+        f.write("not a zip")
+
+    def process(path):
+        if os.path.basename(path) == "unreadable":
+            raise IOError("can't read {}".format(path))
+
+    pipeline = ProductPipeline(unzipped, process=process)
+    for myfile in [good, unreadable, corrupt]:
+        pipeline.submit(myfile)
+    failures = pipeline.close()
+    assert sorted(myfile for myfile, err in failures) == [corrupt, unreadable]
+    assert os.listdir(unzipped) == ["good"]
+
+    # The unzip pass that follows leaves the failed products alone
+    assert unzipFiles(zips, unzipped, exclude=[myfile for myfile, err in failures]) == []
+    assert os.listdir(unzipped) == ["good"]
@@ -0,0 +1,46 @@
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+from product_store import ProductStore, STALE_UNZIP
+from unzipFiles import unzipFile
+
+
+def stored_product(tmp_path, contents):
+    store = ProductStore(str(tmp_path / "store"))
+    zip_file = str(tmp_path / "P.zip")
+    with open(zip_file, 'wb') as f:
+        f.write(contents)
+    store.add(zip_file, "0123")
+    return store, zip_file, store.lookup(zip_file)
+
+
+def good_zip():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zip_ref:
+        zip_ref.writestr("P/P_VV.tif", "data")
+    return buf.getvalue()
+
+
+def test_failed_extraction_is_cleaned_up(tmp_path):
+    store, zip_file, entry = stored_product(tmp_path, b"not a zip")
+    with pytest.raises(Exception):
+        unzipFile(zip_file, str(tmp_path / "unzipped"), store=store)
+    assert [name for name in os.listdir(entry) if name.endswith(".tmp")] == []
+
+
+def test_stale_extractions_are_swept(tmp_path):
+    store, zip_file, entry = stored_product(tmp_path, good_zip())
+    stale = store.claim_unzip(entry)
+    recent = store.claim_unzip(entry)
+    old = time.time() - STALE_UNZIP - 60
+    os.utime(stale, (old, old))
+
+    path = unzipFile(zip_file, str(tmp_path / "unzipped"), store=store)
+    assert os.path.isfile(os.path.join(path, "P_VV.tif"))
+    assert not os.path.exists(stale)
+    # Another run may still be extracting into a recent one
+    assert os.path.isdir(recent)
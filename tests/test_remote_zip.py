@@ -0,0 +1,68 @@
+import os
+import zipfile
+
+import pytest
+
+import remote_zip
+from download_products import make_session
+from remote_zip import fetch_members, RangeNotSupported
+
+
+def test_fetch_members(products, serve, tmp_path):
+    directory, names = products
+    server = serve()
+    out_name = str(tmp_path / names[0])
+    assert fetch_members(make_session(), server.url(names[0]), out_name, 'insar')
+
+    with zipfile.ZipFile(os.path.join(directory, names[0])) as full:
+        wanted = [name for name in full.namelist()
+                  if name.endswith(("_unw_phase.tif", "_corr.tif", ".txt"))]
+        with zipfile.ZipFile(out_name) as cut:
+            assert cut.testzip() is None
+            assert sorted(cut.namelist()) == sorted(wanted)
+            for name in wanted:
+                assert cut.read(name) == full.read(name)
+    assert server.bytes_sent < os.path.getsize(os.path.join(directory, names[0]))
+
+
+def test_fetch_members_without_ranges(products, serve, tmp_path):
+    directory, names = products
+    server = serve(ranges=False)
+    with pytest.raises(RangeNotSupported):
+        fetch_members(make_session(), server.url(names[0]), str(tmp_path / names[0]), 'insar')
+
+
+@pytest.mark.parametrize("field", ["file_size", "compress_size", "header_offset"])
+def test_zip64_members_fall_back(products, serve, tmp_path, monkeypatch, field):
+    directory, names = products
+    server = serve()
+    list_members = remote_zip.list_members
+
+    def large_members(session, url):
+        remote, infolist = list_members(session, url)
+        for zinfo in infolist:
+            setattr(zinfo, field, 5 * 1024 ** 3)
+        return remote, infolist
+
+    monkeypatch.setattr(remote_zip, "list_members", large_members)
+    out_name = str(tmp_path / names[0])
+    with pytest.raises(RangeNotSupported):
+        fetch_members(make_session(), server.url(names[0]), out_name, 'insar')
+    assert not os.path.exists(out_name)
+
+
+def test_zip64_output_falls_back(products, serve, tmp_path, monkeypatch):
+    directory, names = products
+    server = serve()
+    list_members = remote_zip.list_members
+
+    def large_members(session, url):
+        # Each member fits, but together they run past 4 GiB
+        remote, infolist = list_members(session, url)
+        for zinfo in infolist:
+            zinfo.compress_size = 0xFFFFFFFF // 2
+        return remote, infolist
+
+    monkeypatch.setattr(remote_zip, "list_members", large_members)
+    with pytest.raises(RangeNotSupported):
+        fetch_members(make_session(), server.url(names[0]), str(tmp_path / names[0]), 'insar')
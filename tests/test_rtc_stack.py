@@ -0,0 +1,63 @@
+import product_catalog
+from rtc_stack import getDates, cull_stack_by_direction, clipCandidates
+
+PRODUCTS = ["S1A_IW_RT30_20180101T000000_G_gpn",
+            "S1A_IW_RT30_20180113T000000_G_gpn",
+            "S1A_IW_RT30_20180125T000000_G_gpn"]
+
+DIRECTIONS = ["descending", "ascending", "ascending"]
+
+
+def make_scenes(tmp_path):
+    scenes = []
+    for product, direction in zip(PRODUCTS, DIRECTIONS):
+        prodDir = tmp_path / product
+        prodDir.mkdir()
+        (prodDir / (product + ".iso.xml")).write_text(
+            u"<gmd:orbitDirection>{}</gmd:orbitDirection>\n".format(direction))
+        (prodDir / (product + "_VV.tif")).write_bytes(b"")
+        scenes.append("{}/{}_VV.tif".format(product, product))
+    return scenes
+
+
+def test_dates():
+    names, dates = getDates(["TEMP/{}_VV.tif".format(p) for p in PRODUCTS])
+    assert dates == ["20180101T000000", "20180113T000000", "20180125T000000"]
+
+
+def test_keep_with_clip(tmp_path, monkeypatch):
+    monkeypatch.setattr(product_catalog, "_catalog", None)
+    monkeypatch.chdir(tmp_path)
+    scenes = make_scenes(tmp_path)
+
+    # The descending scene is far from the clip box, the ascending ones cover it
+    all_coords = [[500000, 7000000, 600000, 6900000],
+                  [300000, 7500000, 400000, 7400000],
+                  [300000, 7500000, 390000, 7400000]]
+    all_proj = ["d", "a1", "a2"]
+    all_pixsize = [10.0, 30.0, 20.0]
+    clip = [320000, 7480000, 380000, 7420000]
+
+    try:
+        filelist, all_proj, all_coords, all_pixsize = cull_stack_by_direction(
+            list(scenes), "a", all_proj, all_coords, all_pixsize)
+        assert filelist == scenes[1:]
+        assert all_proj == ["a1", "a2"]
+        assert all_pixsize == [30.0, 20.0]
+
+        fracs, candidates = clipCandidates(all_coords, clip, 0.5)
+        assert list(fracs) == [1.0, 1.0]
+        assert list(candidates) == [True, True]
+
+        # Culling the other way keeps only the scene outside the box
+        filelist, all_proj, all_coords, all_pixsize = cull_stack_by_direction(
+            list(scenes), "d", ["d", "a1", "a2"],
+            [[500000, 7000000, 600000, 6900000]] * 3, [10.0, 30.0, 20.0])
+        assert filelist == scenes[:1]
+        fracs, candidates = clipCandidates(all_coords, clip, 0.5)
+        assert list(candidates) == [False]
+
+        # The directions are cataloged by product
+        assert product_catalog.catalog().product(PRODUCTS[1])['direction'] == "a"
+    finally:
+        product_catalog.catalog().close()
@@ -0,0 +1,51 @@
+from sortByTime import sweep, sortByTime, secondOfDay, TOLERANCE, SECONDS_PER_DAY
+
+
+def items(*seconds):
+    return [(second, "t{}".format(second), "f{}".format(second)) for second in seconds]
+
+
+def seconds(groups):
+    return [[item[0] for item in group] for group in groups]
+
+
+def test_tolerance():
+    assert TOLERANCE == 11
+    assert seconds(sweep(items(100, 110))) == [[100, 110]]
+    assert seconds(sweep(items(100, 111))) == [[100], [111]]
+
+
+def test_groups_by_first_item():
+    # 116 is within TOLERANCE of 108 but not of the group's first item
+    assert seconds(sweep(items(100, 108, 116, 124))) == [[100, 108], [116, 124]]
+
+
+def test_midnight_wrap():
+    last = SECONDS_PER_DAY - 5
+    assert seconds(sweep(items(2, 5, last))) == [[last, 2, 5]]
+
+
+def test_midnight_wrap_compares_extent():
+    # The group after midnight starts close enough to the group before it,
+    # but ends too late to join it
+    last = SECONDS_PER_DAY - 2
+    assert seconds(sweep(items(2, 9, last))) == [[2, 9], [last]]
+
+
+def test_single_group_is_not_wrapped():
+    assert seconds(sweep(items(3))) == [[3]]
+    assert sweep([]) == []
+
+
+def name(satellite, time):
+    return "{}_IW_GRDH_1SDV_20170101T{}_20170101T{}_014620_017C5D_1234.zip".format(
+        satellite, time, time)
+
+
+def test_sortByTime_missions(tmp_path):
+    files = [name("S1A", "235955"), name("S1A", "000003"), name("S1B", "000001"),
+             name("S1A", "120000")]
+    classes, lists = sortByTime(str(tmp_path), files, "rtc")
+    assert classes == ["000001", "120000", "235955"]
+    assert lists == [[files[2]], [files[3]], sorted([files[0], files[1]])]
+    assert secondOfDay("235955") == SECONDS_PER_DAY - 5
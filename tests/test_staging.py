@@ -0,0 +1,41 @@
+import os
+import staging
+from staging import reflink, stage_file
+
+
+def test_reflink_keeps_existing_file(tmp_path):
+    src = tmp_path / "src.tif"
+    src.write_bytes(b"new")
+    dst = tmp_path / "dst.tif"
+    dst.write_bytes(b"old")
+    assert not reflink(str(src), str(dst))
+    assert dst.read_bytes() == b"old"
+
+
+def test_reflink_removes_partial_file(tmp_path, monkeypatch):
+    src = tmp_path / "src.tif"
+    src.write_bytes(b"data")
+    dst = tmp_path / "dst.tif"
+
+    def ioctl(fd, request, arg):
+        raise IOError("not supported")
+
+    monkeypatch.setattr(staging.fcntl, "ioctl", ioctl)
+    assert not reflink(str(src), str(dst))
+    assert not os.path.lexists(str(dst))
+
+
+def test_stage_file_falls_back_to_copy(tmp_path, monkeypatch):
+    src = tmp_path / "src.tif"
+    src.write_bytes(b"data")
+    dst = tmp_path / "dst.tif"
+
+    def link(src, dst):
+        raise OSError("cross device")
+
+    monkeypatch.setattr(os, "link", link)
+    monkeypatch.setattr(staging, "reflink", lambda src, dst: False)
+    assert stage_file(str(src), str(dst)) == "copied"
+    assert dst.read_bytes() == b"data"
+    assert stage_file(str(src), str(tmp_path / "moved.tif"), move=True) == "renamed"
+    assert not src.exists()
@@ -0,0 +1,25 @@
+from time_series_utils import selectMembers
+
+# Members of a HyP3 InSAR product
+PRODUCT = "S1AA_20161223T070700_20170116T070658_VVP024_INT80_G_ueF_5CA4"
+INSAR_MEMBERS = ["{}/{}{}".format(PRODUCT, PRODUCT, suffix) for suffix in [
+    ".txt", "_amp.tif", "_color_phase.kmz", "_color_phase.png", "_color_phase.tif",
+    "_corr.tif", "_dem.tif", "_inc_map.tif", "_los_disp.tif", "_lv_phi.tif",
+    "_lv_theta.tif", "_unw_phase.kmz", "_unw_phase.png", "_unw_phase.tif",
+    "_vert_disp.tif", "_wrapped_phase.tif"]]
+
+# Members of a product from before the unwrapped phase was named as such
+LEGACY_MEMBERS = ["20161223_20170116.txt", "20161223_20170116_amp.tif",
+                  "20161223_20170116_coh.tif", "20161223_20170116_phase.tif",
+                  "20161223_20170116_wrapped_phase.tif", "notes.txt"]
+
+
+def test_insar_members():
+    assert selectMembers(INSAR_MEMBERS, 'insar') == [
+        "{}/{}{}".format(PRODUCT, PRODUCT, suffix)
+        for suffix in [".txt", "_corr.tif", "_unw_phase.tif"]]
+
+
+def test_legacy_insar_members():
+    assert selectMembers(LEGACY_MEMBERS, 'insar') == [
+        "20161223_20170116.txt", "20161223_20170116_coh.tif", "20161223_20170116_phase.tif"]
@@ -0,0 +1,46 @@
+import os
+import zipfile
+
+from unzipFiles import unzipFile
+
+NAME = "PRODUCT_20161223_20170116"
+
+
+def make_product(tmp_path):
+    zip_file = str(tmp_path / (NAME + ".zip"))
+    zip_ref = zipfile.ZipFile(zip_file, 'w')
+    for suffix in [".txt", "_unw_phase.tif", "_corr.tif", "_amp.tif", "_VV.tif", ".iso.xml"]:
+        zip_ref.writestr("{}/{}{}".format(NAME, NAME, suffix), "data")
+    zip_ref.close()
+    return zip_file
+
+
+def files(path):
+    return sorted(name[len(NAME):] for name in os.listdir(path) if not name.startswith("."))
+
+
+def test_filtered_extraction_is_not_reused(tmp_path):
+    zip_file = make_product(tmp_path)
+    unzipped = str(tmp_path / "unzipped")
+
+    path = unzipFile(zip_file, unzipped, filetype='rtc')
+    assert files(path) == [".iso.xml", "_VV.tif"]
+
+    path = unzipFile(zip_file, unzipped, filetype='insar')
+    assert files(path) == [".txt", "_corr.tif", "_unw_phase.tif"]
+
+    # A full extraction covers every type of processing
+    path = unzipFile(zip_file, unzipped)
+    assert len(files(path)) == 6
+    os.utime(os.path.join(path, NAME + "_VV.tif"), (0, 0))
+    unzipFile(zip_file, unzipped, filetype='rtc')
+    assert os.path.getmtime(os.path.join(path, NAME + "_VV.tif")) == 0
+
+
+def test_unmarked_directory_is_extracted_again(tmp_path):
+    zip_file = make_product(tmp_path)
+    unzipped = str(tmp_path / "unzipped")
+    # Left by an interrupted extraction
+    os.makedirs(os.path.join(unzipped, NAME))
+    path = unzipFile(zip_file, unzipped, filetype='insar')
+    assert files(path) == [".txt", "_corr.tif", "_unw_phase.tif"]